@@ -1,32 +1,159 @@
 # app.py
 import sqlite3
 import os
+import re
 import sys
+import json
+import io
+import csv
+import base64
+import hashlib
 import datetime
+import random
+import threading
+import time
 from dateutil.relativedelta import relativedelta
 from flask import (
-    Flask, render_template, request, g, redirect, url_for, flash, jsonify
+    Flask, render_template, request, g, redirect, url_for, flash, jsonify, Response, stream_with_context
 )
+from db_pool import SQLiteConnectionPool, PooledConnection
+from sql_metrics import SQLMetrics
+from write_queue import GroupCommitWriter, WriteOutcomeUnknownError, is_busy_error
+from report_pool import ReportExecutor
+from data_version_cache import DataVersionCache
+from device_autocomplete import DeviceModelIndex
+import repository
 
 # --- Configuration ---
 DATABASE = 'inventory.db'
 ALLOWED_ITEM_STATUSES = ['Available', 'Reserved', 'Installed', 'Broken', 'Returned']
 PART_TYPES_CATEGORIES = ["Screen", "Battery", "Back Cover", "Charging Port", "Camera", "Adhesive", "Small Parts", "Tools", "Other"]
 OLD_STOCK_THRESHOLD_MONTHS = 5
+STOCK_AGING_BUCKET_MONTHS = [1, 3, 5] # Bucket edges: 0-1, 1-3, 3-5 and 5+ months
 ALLOWED_BOOKING_STATUSES = ['Booked In', 'In Progress', 'Awaiting Part', 'Ready for Collection', 'Completed', 'Cancelled']
-DB_SCHEMA_REQ = 8 # Required schema version for this app
+DB_SCHEMA_REQ = 16 # Required schema version for this app
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a_very_secret_dev_key_change_me')
+# SQLite connection pool and per-connection PRAGMAs (see db_pool.py)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+app.config['DB_POOL_CHECKOUT_TIMEOUT'] = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 10))
+app.config['DB_JOURNAL_MODE'] = os.environ.get('DB_JOURNAL_MODE', 'WAL')
+app.config['DB_SYNCHRONOUS'] = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['DB_CACHE_SIZE'] = int(os.environ.get('DB_CACHE_SIZE', -20000)) # negative = KiB
+app.config['DB_TEMP_STORE'] = os.environ.get('DB_TEMP_STORE', 'MEMORY')
+app.config['DB_STATEMENT_CACHE_SIZE'] = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', repository.STATEMENT_CACHE_SIZE)) # Prepared statements per connection
+# Write transactions (see run_write_transaction) retry SQLITE_BUSY with jittered exponential backoff
+app.config['WRITE_RETRY_ATTEMPTS'] = int(os.environ.get('WRITE_RETRY_ATTEMPTS', 5))
+app.config['WRITE_RETRY_BASE_DELAY_MS'] = float(os.environ.get('WRITE_RETRY_BASE_DELAY_MS', 20))
+app.config['WRITE_RETRY_MAX_DELAY_MS'] = float(os.environ.get('WRITE_RETRY_MAX_DELAY_MS', 1000))
+# Single writer thread that group-commits the write routes' units (see write_queue.py); 0 = each request commits itself
+app.config['WRITE_QUEUE_ENABLED'] = os.environ.get('WRITE_QUEUE_ENABLED', '1') == '1'
+app.config['WRITE_QUEUE_MAX_BATCH'] = int(os.environ.get('WRITE_QUEUE_MAX_BATCH', 64))
+app.config['WRITE_QUEUE_BATCH_WAIT_MS'] = float(os.environ.get('WRITE_QUEUE_BATCH_WAIT_MS', 0)) # >0 trades latency for bigger batches
+app.config['WRITE_QUEUE_SUBMIT_TIMEOUT'] = float(os.environ.get('WRITE_QUEUE_SUBMIT_TIMEOUT', 30))
+# Worker processes for the heavy list views (see report_pool.py); results are memoized until the next commit or for at most REPORT_CACHE_MAX_AGE_SECONDS
+app.config['REPORT_POOL_ENABLED'] = os.environ.get('REPORT_POOL_ENABLED', '1') == '1'
+app.config['REPORT_POOL_WORKERS'] = int(os.environ.get('REPORT_POOL_WORKERS', 2))
+app.config['REPORT_MAX_CONCURRENT'] = int(os.environ.get('REPORT_MAX_CONCURRENT', 4))
+app.config['REPORT_TIMEOUT_SECONDS'] = float(os.environ.get('REPORT_TIMEOUT_SECONDS', 15))
+app.config['REPORT_CACHE_SIZE'] = int(os.environ.get('REPORT_CACHE_SIZE', 128))
+app.config['REPORT_CACHE_MAX_AGE_SECONDS'] = float(os.environ.get('REPORT_CACHE_MAX_AGE_SECONDS', 60)) # Bounds how old memoized ages can get
+# Per-route SQL timing exposed at /metrics (see sql_metrics.py); slower statements are logged with their query plan
+app.config['SQL_METRICS_ENABLED'] = os.environ.get('SQL_METRICS_ENABLED', '1') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['SQL_METRICS_MAX_STATEMENTS'] = int(os.environ.get('SQL_METRICS_MAX_STATEMENTS', 500)) # Distinct (route, statement) pairs tracked
+app.config['SLOW_QUERY_LOG_SIZE'] = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 50)) # Recent slow queries kept for /api/slow_queries
+# Keyset pagination of the list views (?per_page=, ?after=, ?before=, ?with_total=1)
+app.config['PAGE_SIZE_DEFAULT'] = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+app.config['PAGE_SIZE_MAX'] = int(os.environ.get('PAGE_SIZE_MAX', 500))
+# Bounded LRU cache of /api/parts_for_device responses, keyed on normalized (brand, model)
+app.config['PARTS_API_CACHE_SIZE'] = int(os.environ.get('PARTS_API_CACHE_SIZE', 256))
+# Device model typeahead (/api/device_models); the index is rebuilt once older than this many seconds
+app.config['AUTOCOMPLETE_MAX_AGE_SECONDS'] = int(os.environ.get('AUTOCOMPLETE_MAX_AGE_SECONDS', 300))
+app.config['AUTOCOMPLETE_LIMIT_DEFAULT'] = int(os.environ.get('AUTOCOMPLETE_LIMIT_DEFAULT', 10))
+app.config['AUTOCOMPLETE_LIMIT_MAX'] = int(os.environ.get('AUTOCOMPLETE_LIMIT_MAX', 50))
+# Rows fetched per fetchmany() batch by the streaming /export/* endpoints
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+# Brand/model/category filter lists, cleared with invalidate() after every part type insert or update
+facet_cache = DataVersionCache(lambda: external_data_version())
+# Cleared with invalidate() after every commit that can change which units are Available
+parts_api_cache = DataVersionCache(lambda: external_data_version(), max_entries=app.config['PARTS_API_CACHE_SIZE'])
+# Distinct part type / booked device models per brand, updated by add_booking and the part type forms
+device_model_index = DeviceModelIndex(max_age_seconds=app.config['AUTOCOMPLETE_MAX_AGE_SECONDS'], connect=lambda: get_db_pool().open_unpooled())
+# Statement timings, request latencies and write transaction durations per route
+sql_metrics = SQLMetrics(enabled=app.config['SQL_METRICS_ENABLED'], slow_query_ms=app.config['SLOW_QUERY_MS'],
+                         max_statements=app.config['SQL_METRICS_MAX_STATEMENTS'], slow_log_size=app.config['SLOW_QUERY_LOG_SIZE'])
 
 # --- Database Connection Handling ---
+_db_pool = None
+
+def get_db_pool():
+    """Creates the shared connection pool on first use, from the DB_* settings in app.config."""
+    global _db_pool
+    if _db_pool is None:
+        _db_pool = SQLiteConnectionPool(DATABASE, max_size=app.config['DB_POOL_SIZE'],
+                                        checkout_timeout=app.config['DB_POOL_CHECKOUT_TIMEOUT'],
+                                        journal_mode=app.config['DB_JOURNAL_MODE'], synchronous=app.config['DB_SYNCHRONOUS'],
+                                        busy_timeout_ms=app.config['DB_BUSY_TIMEOUT_MS'], mmap_size=app.config['DB_MMAP_SIZE'],
+                                        cache_size=app.config['DB_CACHE_SIZE'], temp_store=app.config['DB_TEMP_STORE'],
+                                        statement_cache_size=app.config['DB_STATEMENT_CACHE_SIZE'],
+                                        connection_factory=sql_metrics.connection_factory if sql_metrics.enabled else PooledConnection)
+    return _db_pool
+
+_write_queue = None
+
+def get_write_queue():
+    """Creates the group-commit writer on first use; it writes through its own unpooled connection."""
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = GroupCommitWriter(get_db_pool().open_unpooled, max_batch=app.config['WRITE_QUEUE_MAX_BATCH'],
+                                         batch_wait_ms=app.config['WRITE_QUEUE_BATCH_WAIT_MS'],
+                                         submit_timeout=app.config['WRITE_QUEUE_SUBMIT_TIMEOUT'],
+                                         retry_attempts=app.config['WRITE_RETRY_ATTEMPTS'],
+                                         retry_base_delay_ms=app.config['WRITE_RETRY_BASE_DELAY_MS'],
+                                         retry_max_delay_ms=app.config['WRITE_RETRY_MAX_DELAY_MS'])
+    return _write_queue
+
+_data_version_conn = None
+_data_version_lock = threading.Lock()
+
+def external_data_version():
+    """PRAGMA data_version as seen by this process's writes, so facet_cache and parts_api_cache notice other processes' commits.
+
+    With the write queue every write of this process commits on the writer's connection, whose
+    data_version ignores its own commits. Without it writes commit on pooled connections, so a
+    dedicated connection sees them as well and they also clear the caches.
+    """
+    global _data_version_conn
+    if app.config['WRITE_QUEUE_ENABLED']: return get_write_queue().data_version()
+    with _data_version_lock:
+        if _data_version_conn is None: _data_version_conn = get_db_pool().open_unpooled()
+        return _data_version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+_report_executor = None
+
+def get_report_executor():
+    """Creates the report worker pool on first use; workers open DATABASE read-only."""
+    global _report_executor
+    if _report_executor is None:
+        _report_executor = ReportExecutor(DATABASE, max_workers=app.config['REPORT_POOL_WORKERS'],
+                                          max_concurrent=app.config['REPORT_MAX_CONCURRENT'],
+                                          timeout_s=app.config['REPORT_TIMEOUT_SECONDS'], cache_entries=app.config['REPORT_CACHE_SIZE'],
+                                          pragmas=[('busy_timeout', app.config['DB_BUSY_TIMEOUT_MS']), ('mmap_size', app.config['DB_MMAP_SIZE']),
+                                                   ('cache_size', app.config['DB_CACHE_SIZE']), ('temp_store', app.config['DB_TEMP_STORE'])],
+                                          statement_cache_size=app.config['DB_STATEMENT_CACHE_SIZE'],
+                                          cache_max_age_s=app.config['REPORT_CACHE_MAX_AGE_SECONDS'])
+    return _report_executor
+
 def get_db():
     if 'db' not in g:
         try:
-            g.db = sqlite3.connect(DATABASE)
-            g.db.row_factory = sqlite3.Row
-            g.db.execute("PRAGMA foreign_keys = ON") # Ensure foreign key constraints are enabled
+            g.db = get_db_pool().acquire() # Foreign keys and the other PRAGMAs are set once per pooled connection
         except sqlite3.Error as e:
             print(f"DB CONNECT ERROR: {e}", file=sys.stderr)
             g.db = None # Make sure g.db is None if connection fails
@@ -38,22 +165,296 @@ def close_db(error): # error argument is passed by Flask
     db = g.pop('db', None)
     if db is not None:
         try:
-            db.close()
-        except sqlite3.Error as e: # Catch potential errors during close
-            print(f"ERROR CLOSING DB: {e}", file=sys.stderr)
+            get_db_pool().release(db)
+        except sqlite3.Error as e: # Catch potential errors while returning the connection
+            print(f"ERROR RELEASING DB: {e}", file=sys.stderr)
     if error: # Log Flask teardown errors if any
         print(f"Request teardown error: {error}", file=sys.stderr)
 
+# --- Request Metrics ---
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    sql_metrics.start_request(request.endpoint or 'unmatched')
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error): # Runs after a streamed response has been sent completely
+    if 'request_start' in g:
+        sql_metrics.finish_request(request.method, g.get('response_status', 500), time.perf_counter() - g.request_start)
+
 # --- Utility ---
 def flash_errors(errors):
     for error_message in errors: # Renamed e to error_message for clarity
         flash(error_message, 'error')
 
+def flash_write_outcome_unknown(e):
+    """The writer was still running a write when the wait for it ran out, so it may or may not have been saved."""
+    print(f"WRITE OUTCOME UNKNOWN: {e}", file=sys.stderr)
+    flash(f"{e} Check whether the change was saved before submitting it again.", 'warning')
+
+def create_received_stock(cursor, order_number_ref, order_notes, order_date_to_insert, lines_to_process):
+    """Creates a stock order, its lines and all physical units in the caller's transaction.
+
+    Units for each line are created by one recursive-CTE INSERT ... SELECT instead of one
+    INSERT per unit. Returns (stock_order_id, created_lines) where every created line is a dict
+    with part_type_id, line_id, qty, first_item_id and last_item_id.
+    """
+    if order_date_to_insert: cursor.execute(repository.INSERT_STOCK_ORDER_SQL,(order_number_ref,order_notes,order_date_to_insert))
+    else: cursor.execute(repository.INSERT_STOCK_ORDER_NOW_SQL,(order_number_ref,order_notes))
+    stock_order_id = cursor.lastrowid
+    if not stock_order_id: raise sqlite3.Error("Failed to create stock order.")
+    created_lines = []
+    for line in lines_to_process:
+        part_type_id,qty_received = line['part_type_id'],line['qty']
+        cursor.execute(repository.INSERT_STOCK_ORDER_LINE_SQL,(stock_order_id,part_type_id,qty_received))
+        line_id = cursor.lastrowid
+        if not line_id: raise sqlite3.Error(f"Failed to create stock order line for part ID {part_type_id}.")
+        cursor.execute(repository.INSERT_RECEIVED_UNITS_SQL,(qty_received,part_type_id,line_id))
+        if cursor.rowcount != qty_received: raise sqlite3.Error(f"Created {cursor.rowcount} of {qty_received} item(s) for part ID {part_type_id}.")
+        # The write lock is held for the whole statement, so AUTOINCREMENT ids are contiguous.
+        last_item_id = cursor.lastrowid
+        created_lines.append({'part_type_id':part_type_id,'line_id':line_id,'qty':qty_received,
+                              'first_item_id':last_item_id - qty_received + 1,'last_item_id':last_item_id})
+    return stock_order_id, created_lines
+
+# --- Age Filters ---
+AGE_SORT_OPTIONS = {'age_asc': 'Youngest first', 'age_desc': 'Oldest first'}
+
+def get_age_filter_args():
+    """Reads min_age/max_age (non-negative whole numbers) and sort from the query string."""
+    errors = []; ages = {}
+    for arg_name in ('min_age', 'max_age'):
+        ages[arg_name] = None; raw_value = request.args.get(arg_name, '').strip()
+        if not raw_value: continue
+        try:
+            ages[arg_name] = int(raw_value)
+            if ages[arg_name] < 0: raise ValueError
+        except ValueError:
+            ages[arg_name] = None; errors.append(f"Invalid {arg_name.replace('_', ' ')}. Must be a whole number of 0 or more.")
+    sort = request.args.get('sort', '').strip()
+    return ages['min_age'], ages['max_age'], sort if sort in AGE_SORT_OPTIONS else '', errors
+
+def age_range_conditions(date_column, min_age, max_age, age_unit):
+    """Turns an age range into (conditions, params) on date_column so its index can be used.
+
+    age >= min_age  <=>  date <= now - min_age;  age <= max_age  <=>  date > now - (max_age + 1).
+    """
+    now_naive = datetime.datetime.now(); params = []
+    to_delta = (lambda n: datetime.timedelta(days=n)) if age_unit == 'days' else (lambda n: relativedelta(months=n))
+    if min_age is not None: params.append((now_naive - to_delta(min_age)).strftime('%Y-%m-%d %H:%M:%S'))
+    if max_age is not None: params.append((now_naive - to_delta(max_age + 1)).strftime('%Y-%m-%d %H:%M:%S'))
+    return repository.age_range_conditions(date_column, min_age is not None, max_age is not None), params
+
+# --- Filter Facets ---
+def get_facet_values(facet_name):
+    """Returns the distinct non-empty part_types values for facet_name, served from facet_cache."""
+    return facet_cache.get(get_db(), facet_name, lambda conn: [row[0] for row in conn.execute(repository.FACET_QUERIES[facet_name]).fetchall()])
+
+# --- Keyset Pagination ---
+# Sort keys and the page SQL built from them live in repository.py; page cursors carry the sort key values.
+
+def encode_page_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_page_cursor(token, sort_keys):
+    """Returns the key values stored in a page cursor, or None if the token is missing or malformed."""
+    if not token: return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == len(sort_keys) else None
+
+def get_page_args():
+    """Reads per_page/after/before/with_total from the query string."""
+    try: per_page = int(request.args.get('per_page', app.config['PAGE_SIZE_DEFAULT']))
+    except ValueError: per_page = app.config['PAGE_SIZE_DEFAULT']
+    per_page = max(1, min(per_page, app.config['PAGE_SIZE_MAX']))
+    return {'per_page': per_page, 'after': request.args.get('after', '').strip(), 'before': request.args.get('before', '').strip(),
+            'with_total': request.args.get('with_total', '') in ('1', 'true', 'yes')}
+
+def keyset_page_queries(sql, params, sort_keys, page_args):
+    """Returns ([(sql, params)], page_state) for one page: the page query, preceded by a COUNT(*) if a total was asked for."""
+    after = decode_page_cursor(page_args['after'], sort_keys)
+    before = decode_page_cursor(page_args['before'], sort_keys) if after is None else None
+    cursor_values = after if after is not None else before
+    backwards = before is not None
+    queries = [(repository.count_sql(sql), list(params))] if page_args['with_total'] else []
+    null_values = None if cursor_values is None else tuple(value is None for value in cursor_values)
+    page_sql, value_positions = repository.keyset_page_sql(sql, sort_keys, null_values, backwards)
+    page_params = list(params) + [cursor_values[position] for position in value_positions] + [page_args['per_page'] + 1]
+    queries.append((page_sql, page_params))
+    return queries, {'after': after, 'backwards': backwards, 'per_page': page_args['per_page']}
+
+def fetch_keyset_page(cursor, sql, params, sort_keys, page_args):
+    """Runs sql (a SELECT ending in a WHERE clause) for one page in sort_keys order.
+
+    Returns (rows, page_info). page_info holds next/prev cursors and, on request, the total
+    row count of the unpaginated query.
+    """
+    queries, page_state = keyset_page_queries(sql, params, sort_keys, page_args)
+    results = [repository.fetch_all(cursor, query_sql, query_params) for query_sql, query_params in queries]
+    return keyset_page_result(results, sort_keys, page_state)
+
+def fetch_keyset_page_report(report_name, sql, params, sort_keys, page_args):
+    """fetch_keyset_page() for heavy list views: runs in the report worker pool (see report_pool.py) if enabled."""
+    if not app.config['REPORT_POOL_ENABLED']:
+        return fetch_keyset_page(get_db().cursor(), sql, params, sort_keys, page_args)
+    queries, page_state = keyset_page_queries(sql, params, sort_keys, page_args)
+    key = (report_name, tuple((query_sql, tuple(query_params)) for query_sql, query_params in queries))
+    def record_timings(results): # Statements ran in a worker process, so they are recorded here
+        for (query_sql, query_params), (_columns, rows, seconds) in zip(queries, results):
+            sql_metrics.record_statement(query_sql, seconds, len(rows), get_db(), query_params, sql_metrics.current_request())
+    results = [repository.to_records(columns, rows) for columns, rows, _seconds in get_report_executor().run(key, queries, on_run=record_timings)]
+    return keyset_page_result(results, sort_keys, page_state)
+
+def keyset_page_result(results, sort_keys, page_state):
+    """Turns the row lists of keyset_page_queries() into (rows, page_info)."""
+    total = results[0][0]['total_rows'] if len(results) == 2 else None
+    rows = results[-1]; per_page = page_state['per_page']; after = page_state['after']; backwards = page_state['backwards']
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards: rows.reverse()
+    row_key = lambda row: [row[col] for _expr, _direction, col in sort_keys]
+    next_cursor = encode_page_cursor(row_key(rows[-1])) if rows and (has_more or backwards) else None
+    prev_cursor = encode_page_cursor(row_key(rows[0])) if rows and (after is not None or (backwards and has_more)) else None
+    return rows, {'per_page': per_page, 'next': next_cursor, 'prev': prev_cursor, 'total': total}
+
+def build_page_links(page_info):
+    """Adds next_url/prev_url to page_info, keeping the current filters in the query string."""
+    base_args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    view_args = dict(request.view_args or {})
+    page_info['next_url'] = url_for(request.endpoint, **view_args, **base_args, after=page_info['next']) if page_info['next'] else None
+    page_info['prev_url'] = url_for(request.endpoint, **view_args, **base_args, before=page_info['prev']) if page_info['prev'] else None
+    return page_info
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def stream_export(cursor, sql, params, sort_keys, filename_stem):
+    """Streams sql (a SELECT ending in a WHERE clause) in sort_keys order as CSV or NDJSON (?format=).
+
+    The query runs before the response starts, so SQL errors still get a proper error status;
+    rows are then written fetchmany() batch by batch, keeping memory flat for any export size.
+    """
+    export_format = request.args.get('format', 'csv').strip().lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error_message": f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    cursor.execute(repository.ordered_sql(sql, sort_keys), params)
+    columns = repository.column_names(cursor)
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+
+    def generate_rows():
+        buffer = io.StringIO(); writer = csv.writer(buffer) if export_format == 'csv' else None
+        if writer: writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows: break
+            for row in rows:
+                if writer: writer.writerow(row)
+                else: buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+            yield buffer.getvalue(); buffer.seek(0); buffer.truncate(0)
+        if buffer.tell(): yield buffer.getvalue() # CSV header of an empty export
+
+    response = Response(stream_with_context(generate_rows()), mimetype=EXPORT_FORMATS[export_format])
+    filename = f"{filename_stem}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def build_fts_prefix_query(search_term):
+    """Turns free text into an FTS5 MATCH expression where every word is a quoted prefix term.
+
+    Quoting keeps FTS5 operators and punctuation typed by users (e.g. '#' in GPC numbers) from
+    being parsed as query syntax. Returns None when the text contains no searchable words.
+    """
+    words = re.findall(r'\w+', search_term)
+    if not words: return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+_write_retry_lock = threading.Lock()
+write_retry_stats = {'transactions': 0, 'retries': 0, 'busy_failures': 0}
+
+def run_write_transaction(conn, work):
+    """Runs work(cursor) in a write transaction and commits; returns work()'s result or raises its exception.
+
+    With WRITE_QUEUE_ENABLED the unit goes to the group-commit writer thread (conn is not used) and
+    shares a transaction with other units queued at the same time, under its own savepoint.
+    Otherwise it runs on conn in BEGIN IMMEDIATE, which takes the write lock up front (waiting up to
+    DB_BUSY_TIMEOUT_MS), so reads inside work() cannot go stale before its writes. If the lock still
+    cannot be had, the transaction is rolled back and retried up to WRITE_RETRY_ATTEMPTS times.
+    Either way work() must only touch the database through its cursor; flash messages and cache
+    invalidation belong after this call returns. If the queue stops waiting for a unit the writer has
+    already started, WriteOutcomeUnknownError says it may still commit: routes then send the user to
+    a page showing the result instead of back to the form. The call, queue wait included, is timed as
+    one transaction of the current route in sql_metrics.
+    """
+    start = time.perf_counter()
+    try: return _run_write_transaction(conn, sql_metrics.bind(work))
+    finally: sql_metrics.record_transaction(time.perf_counter() - start)
+
+def _run_write_transaction(conn, work):
+    if app.config['WRITE_QUEUE_ENABLED']: return get_write_queue().submit(work)
+    attempts = max(1, app.config['WRITE_RETRY_ATTEMPTS'])
+    with _write_retry_lock: write_retry_stats['transactions'] += 1
+    for attempt in range(attempts):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            result = work(cursor)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction: conn.rollback()
+            if not is_busy_error(e): raise
+            if attempt == attempts - 1:
+                with _write_retry_lock: write_retry_stats['busy_failures'] += 1
+                raise
+            with _write_retry_lock: write_retry_stats['retries'] += 1
+            delay_ms = min(app.config['WRITE_RETRY_MAX_DELAY_MS'], app.config['WRITE_RETRY_BASE_DELAY_MS'] * 2 ** attempt)
+            time.sleep(random.uniform(delay_ms / 2, delay_ms) / 1000) # Jitter keeps retrying writers from colliding again
+        except Exception:
+            if conn.in_transaction: conn.rollback()
+            raise
+
+def reserve_item(cursor, item_id, booking_id):
+    """Reserves one specific unit for a booking with a single conditional UPDATE (no read-then-write race)."""
+    cursor.execute(repository.RESERVE_ITEM_SQL, (item_id,))
+    if cursor.rowcount == 0:
+        item_row = repository.fetch_one(cursor, repository.ITEM_STATUS_SQL, (item_id,))
+        if not item_row: raise ValueError(f"Selected Inventory Item ID {item_id} not found.")
+        raise ValueError(f"Item (ID: {item_id}) is not 'Available' (current status: {item_row['status']}). Cannot reserve.")
+    cursor.execute(repository.INSERT_BOOKING_PART_SQL, (booking_id, item_id))
+
+def reserve_oldest_available_unit(cursor, part_type_id, booking_id):
+    """Reserves the oldest Available unit (FIFO on date_received) of a part type for a booking.
+
+    Must run inside a write transaction. The pick is a single probe of idx_invitem_available_fifo;
+    the status guard on the UPDATE keeps a unit from being reserved twice. Returns the item id,
+    or None if the part type has no Available unit.
+    """
+    item_row = repository.fetch_one(cursor, repository.OLDEST_AVAILABLE_ITEM_SQL, (part_type_id,))
+    if not item_row: return None
+    cursor.execute(repository.RESERVE_ITEM_SQL, (item_row.id,))
+    if cursor.rowcount == 0: raise sqlite3.Error(f"Failed to update status to 'Reserved' for Item ID {item_row.id}.")
+    cursor.execute(repository.INSERT_BOOKING_PART_SQL, (booking_id, item_row.id))
+    return item_row.id
+
+def describe_created_items(created_lines):
+    """Formats the item count and ID range of create_received_stock() for flash messages."""
+    if not created_lines: return "0 item(s) added."
+    items_created_count = sum(line['qty'] for line in created_lines)
+    return f"{items_created_count} item(s) added (IDs {created_lines[0]['first_item_id']}-{created_lines[-1]['last_item_id']})."
+
 # --- Routes ---
 
 @app.route('/')
 def index():
     part_type_summary = []
+    page_info = {}
     show_old_stock_alert = False
     filter_brand = request.args.get('brand', '').strip()
     filter_model = request.args.get('model', '').strip()
@@ -67,76 +468,33 @@ def index():
         cursor = conn.cursor()
 
         threshold_date_str = (datetime.datetime.now() - relativedelta(months=OLD_STOCK_THRESHOLD_MONTHS)).strftime('%Y-%m-%d %H:%M:%S')
-        alert_query = """
-            SELECT 1 FROM stock_orders so
-            WHERE so.order_date < ? AND EXISTS (
-                SELECT 1 FROM stock_order_lines sol
-                JOIN inventory_items i ON sol.id = i.stock_order_line_id
-                WHERE sol.stock_order_id = so.id AND i.status IN ('Available', 'Reserved')
-            ) LIMIT 1;
-        """
-        cursor.execute(alert_query, (threshold_date_str,))
+        cursor.execute(repository.OLD_STOCK_ALERT_SQL, (threshold_date_str,))
         if cursor.fetchone():
             show_old_stock_alert = True
 
-        cursor.execute("SELECT DISTINCT brand FROM part_types WHERE brand IS NOT NULL AND brand != '' ORDER BY brand")
-        brands = [row['brand'] for row in cursor.fetchall()]
-        cursor.execute("SELECT DISTINCT model FROM part_types WHERE model IS NOT NULL AND model != '' ORDER BY model")
-        models = [row['model'] for row in cursor.fetchall()]
-        cursor.execute("SELECT DISTINCT part_type FROM part_types WHERE part_type IS NOT NULL AND part_type != '' ORDER BY part_type")
-        part_type_categories_for_filter = [row['part_type'] for row in cursor.fetchall()]
-
-        query_base = """
-            SELECT
-                pt.id, pt.part_name, pt.part_number, pt.artikelnummer, pt.brand, pt.model, pt.part_type, pt.storage_location,
-                COUNT(i.id) AS total_stock,
-                SUM(CASE WHEN i.status = 'Available' THEN 1 ELSE 0 END) AS available_stock,
-                SUM(CASE WHEN i.status = 'Reserved' THEN 1 ELSE 0 END) AS reserved_stock,
-                SUM(CASE WHEN i.status = 'Broken' THEN 1 ELSE 0 END) AS broken_stock,
-                SUM(CASE WHEN i.status = 'Returned' THEN 1 ELSE 0 END) AS returned_stock
-            FROM part_types pt
-            LEFT JOIN inventory_items i ON pt.id = i.part_type_id
-        """
+        brands = get_facet_values('brand')
+        models = get_facet_values('model')
+        part_type_categories_for_filter = get_facet_values('part_type')
 
         conditions = []
         params = []
 
         if filter_brand:
-            conditions.append("LOWER(pt.brand) LIKE LOWER(?)")
-            params.append(f"%{filter_brand}%")
+            condition, condition_params = repository.part_types_search_condition(filter_brand, ('brand',))
+            conditions.append(condition); params.extend(condition_params)
         if filter_model:
-            conditions.append("LOWER(pt.model) LIKE LOWER(?)")
-            params.append(f"%{filter_model}%")
+            condition, condition_params = repository.part_types_search_condition(filter_model, ('model',))
+            conditions.append(condition); params.extend(condition_params)
         if filter_type:
-            conditions.append("pt.part_type = ?")
+            conditions.append(repository.INDEX_PART_TYPE_CATEGORY_CONDITION)
             params.append(filter_type)
 
         if search_term_parts:
-            search_like_term = f"%{search_term_parts}%"
-            conditions.append("(LOWER(IFNULL(pt.artikelnummer,'')) LIKE LOWER(?) OR LOWER(IFNULL(pt.part_number,'')) LIKE LOWER(?))")
-            params.extend([search_like_term, search_like_term])
-
-        if conditions:
-            query_base += " WHERE " + " AND ".join(conditions)
-
-        query_base += """
-            GROUP BY pt.id, pt.part_name, pt.part_number, pt.artikelnummer, pt.brand, pt.model, pt.part_type, pt.storage_location
-            ORDER BY
-                (CASE WHEN SUM(CASE WHEN i.status = 'Broken' THEN 1 ELSE 0 END) > 0 THEN 0 ELSE 1 END) ASC,
-                SUM(CASE WHEN i.status = 'Broken' THEN 1 ELSE 0 END) DESC,
-                (CASE WHEN SUM(CASE WHEN i.status = 'Available' THEN 1 ELSE 0 END) > 0 THEN 0 ELSE 1 END) ASC,
-                SUM(CASE WHEN i.status = 'Available' THEN 1 ELSE 0 END) DESC,
-                (CASE WHEN SUM(CASE WHEN i.status = 'Reserved' THEN 1 ELSE 0 END) > 0 THEN 0 ELSE 1 END) ASC,
-                SUM(CASE WHEN i.status = 'Reserved' THEN 1 ELSE 0 END) DESC,
-                (CASE WHEN SUM(CASE WHEN i.status = 'Returned' THEN 1 ELSE 0 END) > 0 THEN 0 ELSE 1 END) ASC,
-                SUM(CASE WHEN i.status = 'Returned' THEN 1 ELSE 0 END) DESC,
-                COUNT(i.id) DESC,
-                pt.brand ASC,
-                pt.model ASC,
-                pt.part_name ASC;
-        """
-        cursor.execute(query_base, params)
-        part_type_summary = cursor.fetchall()
+            condition, condition_params = repository.part_types_search_condition(search_term_parts, ('artikelnummer', 'part_number'))
+            conditions.append(condition); params.extend(condition_params)
+
+        query = repository.with_conditions(repository.INDEX_SUMMARY_SQL, tuple(conditions))
+        part_type_summary, page_info = fetch_keyset_page_report('index', query, params, repository.INDEX_SORT_KEYS, get_page_args())
 
     except sqlite3.Error as e:
         print(f"DB Error index: {e}", file=sys.stderr)
@@ -158,98 +516,131 @@ def index():
                            models_filter=models,
                            part_type_categories_filter=part_type_categories_for_filter,
                            current_filters=current_filters,
+                           page=build_page_links(page_info) if page_info else None,
                            show_old_stock_alert=show_old_stock_alert,
                            OLD_STOCK_THRESHOLD_MONTHS=OLD_STOCK_THRESHOLD_MONTHS)
 
-@app.route('/part_type/<int:part_type_id>/details')
-def part_type_details(part_type_id):
-    part_type_info = None
-    items_processed = []
+def build_items_query(part_type_id):
+    """Builds the item list query from the part_type_details filters in request.args.
 
-    # Get filter parameters from request.args
+    Returns (sql, params, sort_keys, current_filters, errors). part_type_id None selects the
+    items of every part type (full inventory_items history).
+    """
     search_stock_order = request.args.get('search_stock_order', '').strip()
     search_gpc = request.args.get('search_gpc', '').strip()
     search_booking_id_str = request.args.get('search_booking_id', '').strip()
     search_date = request.args.get('search_date', '').strip() # YYYY-MM-DD format
+    min_age_days, max_age_days, sort, errors = get_age_filter_args()
 
     # Store current filters for template repopulation
     current_filters = {
         'search_stock_order': search_stock_order,
         'search_gpc': search_gpc,
         'search_booking_id': search_booking_id_str,
-        'search_date': search_date
+        'search_date': search_date,
+        'min_age': request.args.get('min_age', '').strip(),
+        'max_age': request.args.get('max_age', '').strip(),
+        'sort': sort
     }
 
+    query = repository.ALL_ITEMS_SQL if part_type_id is None else repository.PART_TYPE_ITEMS_SQL
+    params = [] if part_type_id is None else [part_type_id]
+    conditions = []
 
-    try:
-        conn = get_db(); cursor = conn.cursor()
-        cursor.execute("SELECT * FROM part_types WHERE id = ?", (part_type_id,))
-        part_type_info = cursor.fetchone()
-        if not part_type_info: flash(f"Part Type ID {part_type_id} not found.", "error"); return redirect(url_for('index'))
-        query = """
-            SELECT i.id AS item_id, i.serial_number, i.status AS item_status, i.notes AS item_notes,
-                   i.date_received, i.last_updated, so.order_number AS stock_order_number,
-                   b.id AS booking_id, b.customer_name AS booking_customer, b.gpc_number AS booking_gpc_number,
-                   pt_parent.storage_location AS default_storage_location
-            FROM inventory_items i
-            LEFT JOIN stock_order_lines sol ON i.stock_order_line_id = sol.id
-            LEFT JOIN stock_orders so ON sol.stock_order_id = so.id
-            LEFT JOIN booking_parts_used bpu ON i.id = bpu.inventory_item_id
-            LEFT JOIN bookings b ON bpu.booking_id = b.id
-            LEFT JOIN part_types pt_parent ON i.part_type_id = pt_parent.id
-            WHERE i.part_type_id = ?
-        """
-        params = [part_type_id]
-        conditions = []
+    if search_stock_order:
+        conditions.append(repository.ITEMS_STOCK_ORDER_CONDITION)
+        params.append(f"%{search_stock_order}%")
 
-        if search_stock_order:
-            conditions.append("LOWER(IFNULL(so.order_number,'')) LIKE LOWER(?)")
-            params.append(f"%{search_stock_order}%")
-        
-        if search_gpc:
-            conditions.append("LOWER(IFNULL(b.gpc_number,'')) LIKE LOWER(?)")
-            params.append(f"%{search_gpc}%")
+    if search_gpc:
+        conditions.append(repository.ITEMS_GPC_CONDITION)
+        params.append(f"%{search_gpc}%")
 
-        search_booking_id_int = None
-        if search_booking_id_str:
-            try:
-                search_booking_id_int = int(search_booking_id_str)
-                conditions.append("b.id = ?")
-                params.append(search_booking_id_int)
-            except ValueError:
-                flash("Invalid Booking ID. Must be a number.", "error")
+    if search_booking_id_str:
+        try:
+            search_booking_id_int = int(search_booking_id_str)
+            conditions.append(repository.ITEMS_BOOKING_ID_CONDITION)
+            params.append(search_booking_id_int)
+        except ValueError:
+            errors.append("Invalid Booking ID. Must be a number.")
 
-        if search_date:
-            try:
-                datetime.datetime.strptime(search_date, '%Y-%m-%d')
-                conditions.append("SUBSTR(i.date_received, 1, 10) = ?")
-                params.append(search_date)
-            except ValueError:
-                flash("Invalid Date format. Please use YYYY-MM-DD.", "error")
-
-        if conditions:
-            query += " AND " + " AND ".join(conditions)
-
-        query += " ORDER BY i.status, i.id;"
-        cursor.execute(query, tuple(params)); items_raw = cursor.fetchall()
-        now_naive = datetime.datetime.now()
-        for item_row in items_raw:
-            item_dict = dict(item_row); days_in_stock = 0
-            date_received_str = item_dict.get('date_received')
-            if date_received_str:
-                try:
-                    date_received_dt_naive = datetime.datetime.strptime(date_received_str.split('.')[0], '%Y-%m-%d %H:%M:%S')
-                    days_in_stock = (now_naive - date_received_dt_naive).days
-                except (ValueError, TypeError) as e_date: print(f"Warning: Could not parse date_received '{date_received_str}' for item ID {item_dict.get('item_id')}: {e_date}", file=sys.stderr)
-            item_dict['days_in_stock'] = days_in_stock; items_processed.append(item_dict)
+    if search_date:
+        try:
+            datetime.datetime.strptime(search_date, '%Y-%m-%d')
+            conditions.append(repository.ITEMS_RECEIVED_ON_CONDITION)
+            params.extend([search_date, search_date])
+        except ValueError:
+            errors.append("Invalid Date format. Please use YYYY-MM-DD.")
+
+    age_conditions, age_params = age_range_conditions('i.date_received', min_age_days, max_age_days, 'days')
+    conditions.extend(age_conditions); params.extend(age_params)
+
+    sort_keys = repository.PART_TYPE_DETAILS_AGE_SORT_KEYS.get(sort, repository.PART_TYPE_DETAILS_SORT_KEYS)
+    return repository.with_conditions(query, tuple(conditions)), params, sort_keys, current_filters, errors
+
+@app.route('/part_type/<int:part_type_id>/details')
+def part_type_details(part_type_id):
+    part_type_info = None
+    items = []; page_info = {}
+    query, params, sort_keys, current_filters, filter_errors = build_items_query(part_type_id)
+    flash_errors(filter_errors)
+
+    try:
+        conn = get_db(); cursor = conn.cursor()
+        part_type_info = repository.fetch_one(cursor, repository.PART_TYPE_BY_ID_SQL, (part_type_id,))
+        if not part_type_info: flash(f"Part Type ID {part_type_id} not found.", "error"); return redirect(url_for('index'))
+        items, page_info = fetch_keyset_page_report('part_type_details', query, params, sort_keys, get_page_args())
     except sqlite3.Error as e: print(f"DB Error part_type_details: {e}", file=sys.stderr); flash(f"Error: {e}", "error"); return redirect(url_for('index'))
     except Exception as e: print(f"Error part_type_details: {e}", file=sys.stderr); flash("Unexpected error.", "error"); return redirect(url_for('index'))
     return render_template('part_type_details.html',
                            part_type_info=part_type_info,
-                           items=items_processed,
+                           items=items,
                            allowed_item_statuses=ALLOWED_ITEM_STATUSES,
+                           age_sort_options=AGE_SORT_OPTIONS,
                            return_url=url_for('part_type_details', part_type_id=part_type_id, **current_filters), # Pass current filters to return_url
-                           current_filters=current_filters) # Pass filters to template
+                           current_filters=current_filters, # Pass filters to template
+                           page=build_page_links(page_info) if page_info else None)
+
+@app.route('/export/items', methods=['GET'])
+def export_items():
+    """Streams inventory items (optionally ?part_type_id=) with the part_type_details filters."""
+    part_type_id = None
+    part_type_id_str = request.args.get('part_type_id', '').strip()
+    if part_type_id_str:
+        try: part_type_id = int(part_type_id_str)
+        except ValueError: return jsonify({"error_message": "Invalid part_type_id."}), 400
+    query, params, sort_keys, current_filters, filter_errors = build_items_query(part_type_id)
+    if filter_errors: return jsonify({"error_message": " ".join(filter_errors)}), 400
+    try:
+        return stream_export(get_db().cursor(), query, params, sort_keys if current_filters['sort'] else repository.ITEMS_EXPORT_SORT_KEYS, 'inventory_items')
+    except sqlite3.Error as e:
+        print(f"DB Error /export/items: {e}", file=sys.stderr)
+        return jsonify({"error_message": f"DB error: {e}"}), 500
+
+@app.route('/api/reports/stock_aging', methods=['GET'])
+def api_stock_aging_report():
+    """Per part type histogram of Available/Reserved units by receipt age, in one aggregate query."""
+    now_naive = datetime.datetime.now()
+    edges = [(now_naive - relativedelta(months=months)).strftime('%Y-%m-%d %H:%M:%S') for months in STOCK_AGING_BUCKET_MONTHS]
+    bucket_labels = [f"{low}-{high}" for low, high in zip([0] + STOCK_AGING_BUCKET_MONTHS, STOCK_AGING_BUCKET_MONTHS)] + [f"{STOCK_AGING_BUCKET_MONTHS[-1]}+"]
+    params = [edges[0]] # Bucket edges in the order repository.stock_aging_sql() takes them
+    for newer_edge, older_edge in zip(edges, edges[1:]): params.extend([newer_edge, older_edge])
+    params.append(edges[-1])
+    part_type_id_str = request.args.get('part_type_id', '').strip()
+    if part_type_id_str:
+        try: params.append(int(part_type_id_str))
+        except ValueError: return jsonify({"error_message": "Invalid part_type_id."}), 400
+    sql = repository.stock_aging_sql(len(bucket_labels), bool(part_type_id_str))
+    try:
+        cursor = get_db().cursor()
+        cursor.execute(sql, params)
+        report_rows = [{'part_type_id': part_type_id, 'part_name': part_name, 'brand': brand, 'model': model,
+                        'open_units': open_units, 'oldest_receipt_date': oldest_receipt_date,
+                        'age_buckets_months': dict(zip(bucket_labels, bucket_counts))}
+                       for part_type_id, part_name, brand, model, open_units, oldest_receipt_date, *bucket_counts in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"DB Error /api/reports/stock_aging: {e}", file=sys.stderr)
+        return jsonify({"error_message": f"DB error: {e}"}), 500
+    return jsonify({'generated_at': now_naive.strftime('%Y-%m-%d %H:%M:%S'), 'buckets': bucket_labels, 'part_types': report_rows})
 
 @app.route('/inventory/item/<int:item_id>/status', methods=['POST'])
 def update_item_status(item_id):
@@ -257,13 +648,98 @@ def update_item_status(item_id):
     if not new_status or new_status not in ALLOWED_ITEM_STATUSES: flash("Invalid status.", "error"); return redirect(return_url)
     conn = get_db()
     try:
-        cursor = conn.cursor(); cursor.execute("UPDATE inventory_items SET status = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?", (new_status, item_id))
-        if cursor.rowcount == 0: flash(f"Item ID {item_id} not found.", "error")
-        else: conn.commit(); flash(f"Status for item ID {item_id} updated to '{new_status}'.", "success")
+        def set_item_status(cursor):
+            cursor.execute(repository.SET_ITEM_STATUS_SQL, (new_status, item_id))
+            return cursor.rowcount
+        if run_write_transaction(conn, set_item_status) == 0: flash(f"Item ID {item_id} not found.", "error")
+        else: parts_api_cache.invalidate(); flash(f"Status for item ID {item_id} updated to '{new_status}'.", "success")
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e)
     except sqlite3.Error as e:
-        if conn: conn.rollback(); print(f"DB Error: {e}", file=sys.stderr); flash(f"DB error: {e}", "error")
+        print(f"DB Error: {e}", file=sys.stderr); flash(f"DB error: {e}", "error")
     except Exception as e:
-        if conn: conn.rollback(); print(f"Unexpected error: {e}", file=sys.stderr); flash(f"Error: {e}", "error")
+        print(f"Unexpected error: {e}", file=sys.stderr); flash(f"Error: {e}", "error")
+    return redirect(return_url)
+
+def parse_id_list(values):
+    """Returns values (a JSON array or a form's getlist()) as a list of ints, or None unless it is a list of whole numbers."""
+    if not isinstance(values, list): return None # A JSON string such as "12" would otherwise be read digit by digit
+    ids = []
+    for value in values:
+        if isinstance(value, bool): return None
+        if isinstance(value, int): ids.append(value); continue
+        if not isinstance(value, str): return None # Floats are not IDs either
+        try: ids.append(int(value))
+        except ValueError: return None
+    return ids
+
+def build_batch_item_target(args):
+    """Returns (conditions, params, errors) selecting the items a batch status change applies to.
+
+    Either an explicit item_ids list, or a filter of part_type_id / from_status / stock_order_number
+    (at least one of them, so a batch can never silently hit every item).
+    """
+    errors = []
+    item_ids = parse_id_list([] if args.get('item_ids') is None else args.get('item_ids'))
+    if item_ids is None: return (), [], ["Item IDs must be a list of numbers."]
+    if item_ids:
+        return (repository.ITEM_IDS_CONDITION,), [json.dumps(item_ids)], errors
+    conditions = []; params = []
+    part_type_id = args.get('part_type_id')
+    if part_type_id not in (None, ''):
+        try: params.append(int(part_type_id)); conditions.append(repository.ITEM_PART_TYPE_CONDITION)
+        except (TypeError, ValueError): errors.append("Invalid part_type_id.")
+    from_status = args.get('from_status')
+    if from_status:
+        if from_status in ALLOWED_ITEM_STATUSES: conditions.append(repository.ITEM_STATUS_CONDITION); params.append(from_status)
+        else: errors.append(f"Invalid from_status '{from_status}'.")
+    stock_order_number = (args.get('stock_order_number') or '').strip()
+    if stock_order_number:
+        conditions.append(repository.ITEM_STOCK_ORDER_CONDITION)
+        params.append(stock_order_number)
+    if not conditions and not errors: errors.append("Select items or give a part_type_id, from_status or stock_order_number filter.")
+    return tuple(conditions), params, errors
+
+@app.route('/items/status/batch', methods=['POST'])
+def batch_update_item_status():
+    """Sets one status on many items with a single UPDATE; answers JSON for JSON requests, else flashes and redirects."""
+    if request.is_json:
+        args = request.get_json(silent=True) or {}
+        if not isinstance(args, dict): return jsonify({"error_message": "Expected a JSON object."}), 400
+    else:
+        args = request.form.to_dict(); args['item_ids'] = request.form.getlist('item_ids')
+    return_url = request.form.get('return_url', url_for('index'))
+    new_status = args.get('new_status')
+    conditions, params, errors = build_batch_item_target(args)
+    if new_status not in ALLOWED_ITEM_STATUSES: errors.insert(0, "Invalid status.")
+    if errors:
+        if request.is_json: return jsonify({"error_message": " ".join(errors)}), 400
+        flash_errors(errors); return redirect(return_url)
+
+    conn = get_db(); status_counts_sql, update_sql = repository.batch_item_status_sql(conditions)
+    def set_items_status(cursor): # Counts and UPDATE run under the same write lock, so they see the same rows
+        cursor.execute(status_counts_sql, params)
+        previous_counts = {status: count for status, count in cursor.fetchall()}
+        cursor.execute(update_sql, [new_status] + params + [new_status])
+        return previous_counts, cursor.rowcount
+    try:
+        previous_counts, updated = run_write_transaction(conn, set_items_status)
+        if updated: parts_api_cache.invalidate()
+    except WriteOutcomeUnknownError as e:
+        if request.is_json: print(f"WRITE OUTCOME UNKNOWN: {e}", file=sys.stderr); return jsonify({"error_message": str(e)}), 504
+        flash_write_outcome_unknown(e); return redirect(return_url)
+    except sqlite3.Error as e:
+        print(f"DB Error batch_update_item_status: {e}", file=sys.stderr)
+        if request.is_json: return jsonify({"error_message": f"Database error: {e}"}), 500
+        flash(f"DB error: {e}", "error"); return redirect(return_url)
+
+    result = {'new_status': new_status, 'matched': sum(previous_counts.values()), 'updated': updated,
+              'unchanged': previous_counts.get(new_status, 0), 'previous_status_counts': previous_counts}
+    if request.is_json: return jsonify(result)
+    if not result['matched']: flash("No matching items found.", "error")
+    else:
+        changed_from = ", ".join(f"{count} {status}" for status, count in previous_counts.items() if status != new_status)
+        flash(f"{updated} item(s) set to '{new_status}'" + (f" (from {changed_from})" if changed_from else "") +
+              (f"; {result['unchanged']} already '{new_status}'." if result['unchanged'] else "."), "success")
     return redirect(return_url)
 
 @app.route('/part_types/add', methods=['GET'])
@@ -287,40 +763,37 @@ def add_part_type():
     if errors: flash_errors(errors); return render_template('add_part_type.html', part_types_categories=PART_TYPES_CATEGORIES, submitted_data=request.form), 400
     conn = get_db()
     try:
-        cursor = conn.cursor()
-        sql = "INSERT INTO part_types (part_name,part_number,artikelnummer,part_type,brand,model,cost_price,storage_location,description,created_at) VALUES (?,?,?,?,?,?,?,?,?,CURRENT_TIMESTAMP)"
         values = (part_name,part_number,artikelnummer,part_type_category,brand,model,cost_price,storage_location,description)
-        cursor.execute(sql, values); conn.commit()
+        run_write_transaction(conn, lambda write_cursor: write_cursor.execute(repository.INSERT_PART_TYPE_SQL, values).rowcount); facet_cache.invalidate(); device_model_index.record_part_type(brand, model)
         flash(f"Part Type '{part_name}' added!", 'success'); return redirect(url_for('part_types_overview'))
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e); return redirect(url_for('part_types_overview'))
     except sqlite3.IntegrityError as e:
-        conn.rollback(); err_msg = str(e).lower()
+        err_msg = str(e).lower()
         if 'part_types.part_number' in err_msg : flash(f"Error: SKU '{part_number}' already exists.", 'error')
         elif 'part_types.artikelnummer' in err_msg: flash(f"Error: Artikelnummer '{artikelnummer}' already exists.", 'error')
         else: flash(f"DB integrity error: {e}", 'error')
     except sqlite3.Error as e:
-        if conn: conn.rollback(); flash(f"DB error: {e}", 'error'); print(e, file=sys.stderr)
+        flash(f"DB error: {e}", 'error'); print(e, file=sys.stderr)
     except Exception as e:
-        if conn: conn.rollback(); flash(f"Unexpected error: {e}", "error"); print(e, file=sys.stderr)
+        flash(f"Unexpected error: {e}", "error"); print(e, file=sys.stderr)
     return render_template('add_part_type.html', part_types_categories=PART_TYPES_CATEGORIES, submitted_data=request.form), 500
 
 @app.route('/part_types/overview')
 def part_types_overview():
-    part_types_list = []
+    part_types_list = []; page_info = {}
     try:
         conn = get_db(); cursor = conn.cursor()
-        cursor.execute("SELECT id,part_name,part_number,artikelnummer,brand,model,part_type FROM part_types ORDER BY brand,model,part_name ASC")
-        part_types_list = cursor.fetchall()
+        part_types_list, page_info = fetch_keyset_page(cursor, repository.PART_TYPES_OVERVIEW_SQL, [], repository.PART_TYPES_OVERVIEW_SORT_KEYS, get_page_args())
     except sqlite3.Error as e: print(f"DB Error: {e}", file=sys.stderr); flash(f"Error: {e}", "error")
     except Exception as e: print(f"Error: {e}", file=sys.stderr); flash("Unexpected error.", "error")
-    return render_template('part_types_overview.html', part_types=part_types_list)
+    return render_template('part_types_overview.html', part_types=part_types_list, page=build_page_links(page_info) if page_info else None)
 
 @app.route('/part_type/<int:part_type_id>/edit', methods=['GET'])
 def edit_part_type_form(part_type_id):
     part_type_data = None
     try:
         conn = get_db(); cursor = conn.cursor()
-        cursor.execute("SELECT id,part_name,part_number,artikelnummer,part_type,brand,model,cost_price,storage_location,description FROM part_types WHERE id=?", (part_type_id,))
-        part_type_data = cursor.fetchone()
+        part_type_data = repository.fetch_one(cursor, repository.PART_TYPE_FOR_EDIT_SQL, (part_type_id,))
         if not part_type_data: flash(f"Part Type ID {part_type_id} not found.", "error"); return redirect(url_for('part_types_overview'))
     except sqlite3.Error as e: flash(f"Error loading details: {e}", "error"); return redirect(url_for('part_types_overview'))
     except Exception as e: flash(f"Unexpected error: {e}", "error"); return redirect(url_for('part_types_overview'))
@@ -331,8 +804,7 @@ def update_part_type(part_type_id):
     conn = get_db(); current_part_type_db_vals = None
     try:
         cursor_check = conn.cursor()
-        cursor_check.execute("SELECT part_number,artikelnummer FROM part_types WHERE id=?", (part_type_id,))
-        current_part_type_db_vals = cursor_check.fetchone()
+        current_part_type_db_vals = repository.fetch_one(cursor_check, repository.PART_TYPE_IDENTIFIERS_SQL, (part_type_id,))
         if not current_part_type_db_vals: flash(f"Part Type ID {part_type_id} not found.", "error"); return redirect(url_for('part_types_overview'))
     except sqlite3.Error as e_fetch:
         flash(f"DB error fetching current part type: {e_fetch}", "error")
@@ -355,40 +827,39 @@ def update_part_type(part_type_id):
         form_data_dict['part_type'] = part_type_category
         return render_template('edit_part_type.html', part_type=form_data_dict, part_types_categories=PART_TYPES_CATEGORIES), 400
     try:
-        cursor = conn.cursor()
-        sql = "UPDATE part_types SET part_name=?,part_number=?,artikelnummer=?,part_type=?,brand=?,model=?,cost_price=?,storage_location=?,description=? WHERE id=?"
         values = (part_name,part_number,artikelnummer,part_type_category,brand,model,cost_price,storage_location,description,part_type_id)
-        cursor.execute(sql,values); conn.commit()
+        run_write_transaction(conn,lambda write_cursor: write_cursor.execute(repository.UPDATE_PART_TYPE_SQL,values).rowcount); facet_cache.invalidate(); parts_api_cache.invalidate(); device_model_index.record_part_type(brand, model)
         flash(f"Part Type '{part_name}' updated!",'success'); return redirect(url_for('part_types_overview'))
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e); return redirect(url_for('part_types_overview'))
     except sqlite3.IntegrityError as e:
-        conn.rollback(); err_msg=str(e).lower()
+        err_msg=str(e).lower()
         original_db_pn = current_part_type_db_vals['part_number'] if current_part_type_db_vals else None
         original_db_an = current_part_type_db_vals['artikelnummer'] if current_part_type_db_vals else None
         if 'part_types.part_number' in err_msg and (part_number != original_db_pn or (part_number and not original_db_pn)): flash(f"Error: Part Number '{part_number}' already exists.",'error')
         elif 'part_types.artikelnummer' in err_msg and (artikelnummer != original_db_an or (artikelnummer and not original_db_an)): flash(f"Error: Artikelnummer '{artikelnummer}' already exists.",'error')
         else: flash(f"DB integrity error: {e}",'error')
     except sqlite3.Error as e:
-        if conn: conn.rollback(); flash(f"DB error: {e}",'error'); print(e,file=sys.stderr)
+        flash(f"DB error: {e}",'error'); print(e,file=sys.stderr)
     except Exception as e:
-        if conn: conn.rollback(); flash(f"Unexpected error: {e}","error"); print(e,file=sys.stderr)
+        flash(f"Unexpected error: {e}","error"); print(e,file=sys.stderr)
     form_data_dict_err = {k:v for k,v in request.form.items()}; form_data_dict_err['id'] = part_type_id
     form_data_dict_err['part_type'] = part_type_category
     return render_template('edit_part_type.html',part_type=form_data_dict_err,part_types_categories=PART_TYPES_CATEGORIES),500
 
-@app.route('/receive', methods=['GET'])
-def receive_stock_form():
+def render_receive_stock_form(status_code=200, order_number='', order_date='', notes=''):
+    """Renders the receive stock form (also after a failed submit), loading its part type picker once."""
     part_types_list = []
-    try:
-        cursor = get_db().cursor()
-        cursor.execute("SELECT id,part_name,part_number,artikelnummer,brand,model FROM part_types ORDER BY brand,model,part_name ASC")
-        part_types_list = cursor.fetchall()
+    try: part_types_list = repository.fetch_all(get_db().cursor(), repository.PART_TYPES_FOR_RECEIVING_SQL)
     except sqlite3.Error as e: flash(f"Error loading part types: {e}","error"); print(e,file=sys.stderr)
-    except Exception as e: flash(f"Unexpected error: {e}","error"); print(e,file=sys.stderr)
-    return render_template('receive_stock.html',part_types_list=part_types_list,submitted_order_number=request.form.get('order_number',''),submitted_order_date=request.form.get('order_date',''),submitted_notes=request.form.get('order_notes',''))
+    return render_template('receive_stock.html',part_types_list=part_types_list,submitted_order_number=order_number,submitted_order_date=order_date,submitted_notes=notes),status_code
+
+@app.route('/receive', methods=['GET'])
+def receive_stock_form():
+    return render_receive_stock_form()
 
 @app.route('/receive', methods=['POST'])
 def receive_stock():
-    conn = get_db(); cursor = conn.cursor(); items_created_count = 0; errors = []; lines_to_process = []
+    conn = get_db(); errors = []; lines_to_process = []
     order_number_ref = request.form.get('order_number','').strip() or None
     order_notes = request.form.get('order_notes','').strip() or None
     order_date_str = request.form.get('order_date','').strip(); order_date_to_insert = None
@@ -404,66 +875,52 @@ def receive_stock():
             except ValueError: errors.append(f"Invalid quantity for '{key}'.")
             except IndexError: errors.append(f"Malformed key: '{key}'.")
     if errors:
-        flash_errors(errors); part_types_list_form = []
-        try:
-            temp_cursor = get_db().cursor()
-            temp_cursor.execute("SELECT id,part_name,part_number,artikelnummer,brand,model FROM part_types ORDER BY brand,model,part_name ASC")
-            part_types_list_form = temp_cursor.fetchall()
-        except sqlite3.Error as e_fetch: print(f"Error re-fetching part types: {e_fetch}",file=sys.stderr)
-        return render_template('receive_stock.html',part_types_list=part_types_list_form,submitted_order_number=order_number_ref or '',submitted_order_date=order_date_str,submitted_notes=order_notes or ''),400
+        flash_errors(errors)
+        return render_receive_stock_form(400,order_number_ref or '',order_date_str,order_notes or '')
     if not lines_to_process: flash("No positive stock quantities entered.",'warning'); return redirect(url_for('receive_stock_form'))
     try:
-        cursor.execute("BEGIN TRANSACTION")
-        if order_date_to_insert: cursor.execute("INSERT INTO stock_orders (order_number,notes,order_date) VALUES (?,?,?)",(order_number_ref,order_notes,order_date_to_insert))
-        else: cursor.execute("INSERT INTO stock_orders (order_number,notes,order_date) VALUES (?,?,CURRENT_TIMESTAMP)",(order_number_ref,order_notes))
-        stock_order_id = cursor.lastrowid
-        if not stock_order_id: raise sqlite3.Error("Failed to create stock order.")
-        for line in lines_to_process:
-            part_type_id,qty_received = line['part_type_id'],line['qty']
-            cursor.execute("INSERT INTO stock_order_lines (stock_order_id,part_id,quantity_received) VALUES (?,?,?)",(stock_order_id,part_type_id,qty_received))
-            line_id = cursor.lastrowid
-            if not line_id: raise sqlite3.Error(f"Failed to create stock order line for part ID {part_type_id}.")
-            for _ in range(qty_received):
-                cursor.execute("INSERT INTO inventory_items (part_type_id,status,stock_order_line_id,date_received,last_updated) VALUES (?, 'Available', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",(part_type_id,line_id)); items_created_count +=1
-        conn.commit()
-        flash(f"Stock received for '{order_number_ref or '(No Ref)'}'. {items_created_count} item(s) added.",'success'); return redirect(url_for('orders_overview',search_term=order_number_ref or ''))
+        stock_order_id,created_lines = run_write_transaction(conn,lambda write_cursor: create_received_stock(write_cursor,order_number_ref,order_notes,order_date_to_insert,lines_to_process))
+        parts_api_cache.invalidate()
+        flash(f"Stock received for '{order_number_ref or '(No Ref)'}'. {describe_created_items(created_lines)}",'success'); return redirect(url_for('orders_overview',search_term=order_number_ref or ''))
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e); return redirect(url_for('orders_overview',search_term=order_number_ref or ''))
     except sqlite3.Error as e:
-        if conn: conn.rollback(); print(f"DB Error: {e}",file=sys.stderr); flash(f"DB error: {e}",'error')
+        print(f"DB Error: {e}",file=sys.stderr); flash(f"DB error: {e}",'error')
     except Exception as e:
-        if conn: conn.rollback(); print(f"Error: {e}",file=sys.stderr); flash(f"Unexpected error: {e}",'error')
-    part_types_list_err = []
-    try:
-        temp_cursor_err = get_db().cursor()
-        temp_cursor_err.execute("SELECT id,part_name,part_number,artikelnummer,brand,model FROM part_types ORDER BY brand,model,part_name ASC")
-        part_types_list_err = temp_cursor_err.fetchall()
-    except sqlite3.Error as e_fetch_err: print(f"Error re-fetching part types: {e_fetch_err}",file=sys.stderr)
-    return render_template('receive_stock.html',part_types_list=part_types_list_err,submitted_order_number=order_number_ref or '',submitted_order_date=order_date_str,submitted_notes=order_notes or ''),500
+        print(f"Error: {e}",file=sys.stderr); flash(f"Unexpected error: {e}",'error')
+    return render_receive_stock_form(500,order_number_ref or '',order_date_str,order_notes or '')
+
+def build_orders_query(search_term):
+    """Returns (sql, params) for the stock order lines matching search_term (orders_overview filter)."""
+    if not search_term: return repository.ORDER_LINES_SQL, []
+    search_like = f"%{search_term}%"; part_condition,part_params = repository.part_types_search_condition(search_term,repository.ORDER_LINES_SEARCH_COLUMNS)
+    sql = repository.with_conditions(repository.ORDER_LINES_SQL,(repository.order_lines_search_condition(part_condition),))
+    return sql, [search_like,search_like]+part_params
 
 @app.route('/orders')
 def orders_overview():
-    order_lines = []; search_term = request.args.get('search_term','').strip()
+    order_lines = []; page_info = {}; search_term = request.args.get('search_term','').strip()
     try:
-        conn = get_db(); cursor = conn.cursor()
-        sql = """SELECT so.id as order_id,so.order_number,so.order_date,so.notes AS order_notes,sol.id as line_id,sol.quantity_received,sol.cost_price_per_unit,
-                   pt.id as part_type_id,pt.part_name,pt.part_number,pt.artikelnummer,pt.brand,pt.model
-                   FROM stock_order_lines sol JOIN stock_orders so ON sol.stock_order_id=so.id JOIN part_types pt ON sol.part_id=pt.id WHERE 1=1 """
-        params = []
-        if search_term:
-            search_like = f"%{search_term}%"; sql_addition = " AND (LOWER(IFNULL(so.order_number,'')) LIKE LOWER(?) OR LOWER(IFNULL(pt.artikelnummer,'')) LIKE LOWER(?) OR LOWER(IFNULL(pt.part_number,'')) LIKE LOWER(?) OR LOWER(pt.part_name) LIKE LOWER(?) OR LOWER(IFNULL(pt.brand,'')) LIKE LOWER(?) OR LOWER(IFNULL(pt.model,'')) LIKE LOWER(?) OR LOWER(IFNULL(so.notes,'')) LIKE LOWER(?))"
-            sql += sql_addition; params.extend([search_like]*7)
-        sql += " ORDER BY so.order_date DESC,so.id DESC,sol.id ASC"; cursor.execute(sql,params); order_lines = cursor.fetchall()
+        sql,params = build_orders_query(search_term)
+        order_lines,page_info = fetch_keyset_page_report('orders_overview',sql,params,repository.ORDERS_OVERVIEW_SORT_KEYS,get_page_args())
     except sqlite3.Error as e: print(f"DB Error: {e}",file=sys.stderr); flash(f"Error: {e}","error")
     except Exception as e: print(f"Error: {e}",file=sys.stderr); flash("Unexpected error.","error")
-    return render_template('orders_overview.html',order_lines=order_lines,search_term=search_term)
+    return render_template('orders_overview.html',order_lines=order_lines,search_term=search_term,page=build_page_links(page_info) if page_info else None)
+
+@app.route('/export/orders', methods=['GET'])
+def export_orders():
+    """Streams stock order lines with the orders_overview search filter."""
+    sql,params = build_orders_query(request.args.get('search_term','').strip())
+    try:
+        return stream_export(get_db().cursor(),sql,params,repository.ORDERS_OVERVIEW_SORT_KEYS,'stock_orders')
+    except sqlite3.Error as e:
+        print(f"DB Error /export/orders: {e}",file=sys.stderr)
+        return jsonify({"error_message": f"DB error: {e}"}),500
 
 @app.route('/bookings/add', methods=['GET'])
 def add_booking_form():
     brands = []
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT brand FROM part_types WHERE brand IS NOT NULL AND brand != '' ORDER BY brand ASC")
-        brands = [row['brand'] for row in cursor.fetchall()]
+        brands = get_facet_values('brand')
     except sqlite3.Error as e:
         flash(f"Error loading brands: {e}", "error")
         print(f"Error loading brands for add_booking_form: {e}", file=sys.stderr)
@@ -473,10 +930,42 @@ def add_booking_form():
                            submitted_data=request.form if request.method == 'POST' else {},
                            brands_for_filter=brands)
 
+def normalize_device_query(text):
+    """Lower-cases text and collapses whitespace, so 'iPhone  12 ' and 'iphone 12' share a cache entry."""
+    return ' '.join(text.lower().split())
+
+def load_parts_for_device(conn, brand_query, model_query, grouped=False):
+    """Runs the Available-units lookup and returns the serialized response with its validators.
+
+    grouped returns one entry per part type with its available_count, read from
+    part_type_stock_summary, so the response size does not depend on how many units are in stock.
+    """
+    params = []
+    conditions = []
+
+    if brand_query:
+        conditions.append(repository.PART_BRAND_CONDITION)
+        params.append(brand_query)
+
+    if model_query:
+        # Alleen filteren op model als er ook daadwerkelijk iets is ingevuld
+        condition, condition_params = repository.part_types_search_condition(model_query, ('model',))
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    if grouped: sql = repository.with_conditions(repository.PARTS_FOR_DEVICE_GROUPED_SQL, tuple(conditions), repository.PARTS_FOR_DEVICE_GROUPED_ORDER_SQL)
+    else: sql = repository.with_conditions(repository.PARTS_FOR_DEVICE_SQL, tuple(conditions), repository.PARTS_FOR_DEVICE_ORDER_SQL)
+
+    parts_for_model = repository.fetch_dicts(conn.cursor(), sql, params)
+    body = app.json.dumps(parts_for_model)
+    return {'body': body, 'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+            'last_modified': datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)}
+
 @app.route('/api/parts_for_device', methods=['GET'])
 def api_parts_for_device():
-    model_query = request.args.get('model', '').strip()
-    brand_query = request.args.get('brand', '').strip()
+    model_query = normalize_device_query(request.args.get('model', ''))
+    brand_query = normalize_device_query(request.args.get('brand', ''))
+    grouped = request.args.get('group', '') == 'part_type' # One entry per part type instead of per unit
 
     # Als beide leeg zijn, retourneer een lege lijst (JS handelt dit af)
     if not model_query and not brand_query:
@@ -486,40 +975,8 @@ def api_parts_for_device():
     if not conn:
         return jsonify({"error_message": "DB connection failed."}), 500
 
-    parts_for_model = []
     try:
-        cursor = conn.cursor()
-        sql_query_base = """
-            SELECT i.id, pt.part_name, pt.brand, pt.model, i.serial_number,
-                   pt.part_number, pt.artikelnummer
-            FROM inventory_items i
-            JOIN part_types pt ON i.part_type_id = pt.id
-            WHERE i.status = 'Available'
-        """
-        params = []
-        conditions = []
-
-        if brand_query:
-            conditions.append("LOWER(pt.brand) = LOWER(?)")
-            params.append(brand_query)
-
-        if model_query:
-            # Alleen filteren op model als er ook daadwerkelijk iets is ingevuld
-            conditions.append("LOWER(pt.model) LIKE LOWER(?)")
-            params.append(f"%{model_query}%")
-
-        if conditions:
-            sql_query_base += " AND " + " AND ".join(conditions)
-
-        sql_query_base += " ORDER BY pt.brand, pt.model, pt.part_name, i.id;"
-
-        cursor.execute(sql_query_base, tuple(params))
-        rows = cursor.fetchall()
-        for row in rows:
-            parts_for_model.append(dict(row))
-
-        return jsonify(parts_for_model)
-
+        cached = parts_api_cache.get(conn, (brand_query, model_query, grouped), lambda c: load_parts_for_device(c, brand_query, model_query, grouped))
     except sqlite3.Error as e:
         print(f"DB Error /api/parts_for_device: {e}", file=sys.stderr)
         return jsonify({"error_message": f"DB error: {e}"}), 500
@@ -527,9 +984,69 @@ def api_parts_for_device():
         print(f"Error /api/parts_for_device: {e}", file=sys.stderr)
         return jsonify({"error_message": f"Unexpected error: {e}"}), 500
 
+    response = Response(cached['body'], mimetype='application/json')
+    response.set_etag(cached['etag']); response.last_modified = cached['last_modified']
+    response.cache_control.no_cache = True # Browser keeps the body but revalidates every keystroke (cheap 304)
+    return response.make_conditional(request)
+
+@app.route('/api/device_models', methods=['GET'])
+def api_device_models():
+    """Typeahead for the booking form: ?q=<model prefix>&brand=<optional>&limit=<n>, most booked first."""
+    try: limit = int(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT_DEFAULT']))
+    except ValueError: return jsonify({"error_message": "Invalid limit."}), 400
+    limit = max(1, min(limit, app.config['AUTOCOMPLETE_LIMIT_MAX']))
+    try:
+        device_model_index.ensure_fresh(get_db())
+    except sqlite3.Error as e:
+        print(f"DB Error /api/device_models: {e}", file=sys.stderr)
+        return jsonify({"error_message": f"DB error: {e}"}), 500
+    return jsonify(device_model_index.suggest(request.args.get('q', ''), brand=request.args.get('brand', ''), limit=limit))
+
+@app.route('/api/device_models_stats', methods=['GET'])
+def api_device_models_stats():
+    return jsonify(device_model_index.stats())
+
+@app.route('/api/db_pool_stats', methods=['GET'])
+def api_db_pool_stats():
+    return jsonify(get_db_pool().stats())
+
+@app.route('/api/write_retry_stats', methods=['GET'])
+def api_write_retry_stats():
+    with _write_retry_lock: return jsonify(dict(write_retry_stats))
+
+@app.route('/api/write_queue_stats', methods=['GET'])
+def api_write_queue_stats():
+    if _write_queue is None: return jsonify({'enabled': app.config['WRITE_QUEUE_ENABLED'], 'running': False})
+    return jsonify(dict(_write_queue.stats(), enabled=app.config['WRITE_QUEUE_ENABLED']))
+
+@app.route('/api/report_pool_stats', methods=['GET'])
+def api_report_pool_stats():
+    if _report_executor is None: return jsonify({'enabled': app.config['REPORT_POOL_ENABLED'], 'runs': 0})
+    return jsonify(dict(_report_executor.stats(), enabled=app.config['REPORT_POOL_ENABLED']))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    component_stats = [('db_pool', get_db_pool().stats()), ('write_retry', write_retry_stats), ('facet_cache', facet_cache.stats()),
+                       ('parts_cache', parts_api_cache.stats()), ('device_models', device_model_index.stats())]
+    if _write_queue is not None: component_stats.append(('write_queue', _write_queue.stats()))
+    if _report_executor is not None: component_stats.append(('report_pool', _report_executor.stats()))
+    return Response(sql_metrics.render_prometheus(component_stats), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/slow_queries', methods=['GET'])
+def api_slow_queries():
+    return jsonify(sql_metrics.slow_queries())
+
+@app.route('/api/facet_cache_stats', methods=['GET'])
+def api_facet_cache_stats():
+    return jsonify(facet_cache.stats())
+
+@app.route('/api/parts_cache_stats', methods=['GET'])
+def api_parts_cache_stats():
+    return jsonify(parts_api_cache.stats())
+
 @app.route('/bookings/add', methods=['POST'])
 def add_booking():
-    conn = get_db(); cursor = conn.cursor()
+    conn = get_db()
     customer_name = request.form.get('customer_name', '').strip()
     customer_phone = request.form.get('customer_phone', '').strip() or None
     device_model = request.form.get('device_model', '').strip()
@@ -540,6 +1057,7 @@ def add_booking():
     notes = request.form.get('notes', '').strip() or None
     booking_date_str = request.form.get('booking_date', '').strip()
     selected_item_id_str = request.form.get('inventory_item_id', '').strip()
+    selected_part_type_id_str = request.form.get('part_type_id', '').strip() # Grouped picker: reserve the oldest unit of this type
     errors = []
 
     if not customer_name: errors.append("Customer Name required.")
@@ -558,15 +1076,17 @@ def add_booking():
         try: selected_item_id = int(selected_item_id_str)
         except ValueError: errors.append("Invalid Inventory Item selected.")
 
+    selected_part_type_id = None
+    if selected_part_type_id_str and not selected_item_id_str:
+        try: selected_part_type_id = int(selected_part_type_id_str)
+        except ValueError: errors.append("Invalid Part Type selected.")
+
     if errors:
         flash_errors(errors)
         # Re-fetch brands for form repopulation on error
         brands_for_form_repopulation = []
         try:
-            conn_repop = get_db()
-            cursor_repop = conn_repop.cursor()
-            cursor_repop.execute("SELECT DISTINCT brand FROM part_types WHERE brand IS NOT NULL AND brand != '' ORDER BY brand ASC")
-            brands_for_form_repopulation = [row['brand'] for row in cursor_repop.fetchall()]
+            brands_for_form_repopulation = get_facet_values('brand')
         except sqlite3.Error as e_repop:
             print(f"Error re-fetching brands for form repopulation: {e_repop}", file=sys.stderr)
         return render_template('add_booking.html',
@@ -574,46 +1094,38 @@ def add_booking():
                                available_items=[],
                                brands_for_filter=brands_for_form_repopulation), 400
     new_booking_id = None
-    try:
-        cursor.execute("BEGIN TRANSACTION")
-        cols = ["customer_name", "customer_phone", "device_model", "device_serial",
-                "gpc_number", "zir_reference", "reported_issue", "notes", "last_updated"]
-        placeholders = ["?", "?", "?", "?", "?", "?", "?", "?", "CURRENT_TIMESTAMP"]
-        vals = [customer_name, customer_phone, device_model, device_serial,
-                gpc_number, zir_reference, reported_issue, notes]
-        if booking_date_to_insert:
-            cols.append("booking_date"); placeholders.append("?"); vals.append(booking_date_to_insert)
-        else:
-            cols.append("booking_date"); placeholders.append("CURRENT_TIMESTAMP")
-
-        sql_booking = f"INSERT INTO bookings ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
-        cursor.execute(sql_booking, tuple(vals))
-        new_booking_id = cursor.lastrowid
-        if not new_booking_id: raise sqlite3.Error("Failed to create booking record (no lastrowid).")
-
+    def insert_booking(cursor):
+        vals = (customer_name, customer_phone, device_model, device_serial,
+                gpc_number, zir_reference, reported_issue, notes)
+        if booking_date_to_insert: cursor.execute(repository.INSERT_BOOKING_DATED_SQL, vals + (booking_date_to_insert,))
+        else: cursor.execute(repository.INSERT_BOOKING_SQL, vals)
+        booking_id = cursor.lastrowid
+        if not booking_id: raise sqlite3.Error("Failed to create booking record (no lastrowid).")
+
+        reserved_item_id = selected_item_id
         if selected_item_id:
-            cursor.execute("SELECT status FROM inventory_items WHERE id = ?", (selected_item_id,))
-            item_row = cursor.fetchone()
-            if not item_row: raise ValueError(f"Selected Inventory Item ID {selected_item_id} not found.")
-            if item_row['status'] != 'Available':
-                raise ValueError(f"Item (ID: {selected_item_id}) is not 'Available' (current status: {item_row['status']}). Cannot reserve.")
-            cursor.execute("INSERT INTO booking_parts_used (booking_id, inventory_item_id) VALUES (?, ?)", (new_booking_id, selected_item_id))
-            cursor.execute("UPDATE inventory_items SET status = 'Reserved', last_updated = CURRENT_TIMESTAMP WHERE id = ?", (selected_item_id,))
-            if cursor.rowcount == 0: raise sqlite3.Error(f"Failed to update status to 'Reserved' for Item ID {selected_item_id}.")
-
-        conn.commit()
-        flash(f"Booking added (ID: {new_booking_id}). {'Item assigned and status set to Reserved.' if selected_item_id else 'No item assigned.'}", 'success')
+            reserve_item(cursor, selected_item_id, booking_id)
+        elif selected_part_type_id:
+            # run_write_transaction holds the write lock from BEGIN IMMEDIATE, so no other request can take the same unit.
+            reserved_item_id = reserve_oldest_available_unit(cursor, selected_part_type_id, booking_id)
+            if not reserved_item_id: raise ValueError(f"No 'Available' unit left for Part Type ID {selected_part_type_id}. Cannot reserve.")
+        return booking_id, reserved_item_id
+
+    try:
+        new_booking_id, selected_item_id = run_write_transaction(conn, insert_booking)
+        parts_api_cache.invalidate(); device_model_index.record_booking(device_model)
+        flash(f"Booking added (ID: {new_booking_id}). {f'Item ID {selected_item_id} assigned and status set to Reserved.' if selected_item_id else 'No item assigned.'}", 'success')
+        return redirect(url_for('bookings_overview'))
+    except WriteOutcomeUnknownError as e:
+        flash_write_outcome_unknown(e)
         return redirect(url_for('bookings_overview'))
     except ValueError as e:
-        if conn: conn.rollback()
         errors.append(str(e))
         flash_errors(errors)
     except sqlite3.Error as e:
-        if conn: conn.rollback()
         print(f"DB Error adding booking: {e}", file=sys.stderr)
         flash(f"Database error adding booking: {e}", 'error')
     except Exception as e:
-        if conn: conn.rollback()
         print(f"Unexpected error adding booking: {e}", file=sys.stderr)
         flash(f"Unexpected error adding booking: {e}", 'error')
 
@@ -621,10 +1133,7 @@ def add_booking():
     # Re-fetch brands for form repopulation on exception
     brands_for_form_repopulation_exc = []
     try:
-        conn_repop_exc = get_db()
-        cursor_repop_exc = conn_repop_exc.cursor()
-        cursor_repop_exc.execute("SELECT DISTINCT brand FROM part_types WHERE brand IS NOT NULL AND brand != '' ORDER BY brand ASC")
-        brands_for_form_repopulation_exc = [row['brand'] for row in cursor_repop_exc.fetchall()]
+        brands_for_form_repopulation_exc = get_facet_values('brand')
     except sqlite3.Error as e_repop_exc:
         print(f"Error re-fetching brands for form repopulation after exception: {e_repop_exc}", file=sys.stderr)
 
@@ -633,37 +1142,64 @@ def add_booking():
                            available_items=[],
                            brands_for_filter=brands_for_form_repopulation_exc), status_code
 
+def build_bookings_query(cursor, search_term):
+    """Builds the bookings_overview query for search_term and the age filters in request.args.
+
+    Returns (sql, params, sort_keys, age_filters, errors).
+    """
+    min_age_months, max_age_months, sort, errors = get_age_filter_args()
+    age_filters = {'min_age': request.args.get('min_age', '').strip(), 'max_age': request.args.get('max_age', '').strip(), 'sort': sort}
+    age_conditions, age_params = age_range_conditions('b.booking_date', min_age_months, max_age_months, 'months')
+    sort_keys = repository.BOOKINGS_AGE_SORT_KEYS.get(sort, repository.BOOKINGS_SORT_KEYS)
+    if not search_term:
+        return repository.with_conditions(repository.BOOKINGS_SQL, age_conditions), age_params, sort_keys, age_filters, errors
+    exact_params = [search_term, search_term]
+    if search_term.isdigit(): exact_params.insert(0, int(search_term))
+    by_id = len(exact_params) == 3
+    cursor.execute(repository.BOOKING_EXACT_WITH_ID_MATCH_SQL if by_id else repository.BOOKING_EXACT_MATCH_SQL, exact_params)
+    if cursor.fetchone():
+        exact_sql = repository.BOOKINGS_EXACT_WITH_ID_SQL if by_id else repository.BOOKINGS_EXACT_SQL
+        return repository.with_conditions(exact_sql, age_conditions), exact_params + age_params, sort_keys, age_filters, errors
+    fts_query = build_fts_prefix_query(search_term)
+    if not fts_query:
+        return repository.BOOKINGS_NONE_SQL, [], sort_keys, age_filters, errors
+    # Ranked by relevance unless an explicit age sort was asked for.
+    sql = repository.with_conditions(repository.BOOKINGS_SEARCH_SQL, age_conditions)
+    return sql, [fts_query] + age_params, sort_keys if sort else repository.BOOKINGS_SEARCH_SORT_KEYS, age_filters, errors
+
 @app.route('/bookings')
 def bookings_overview():
-    bookings_processed = []; search_term = request.args.get('search_booking', '').strip()
+    bookings = []; page_info = {}; search_term = request.args.get('search_booking', '').strip()
+    age_filters = {'min_age': request.args.get('min_age', '').strip(), 'max_age': request.args.get('max_age', '').strip(), 'sort': ''}
     try:
         conn = get_db(); cursor = conn.cursor()
-        sql = "SELECT id, booking_date, customer_name, device_model, device_serial, status, notes, gpc_number, zir_reference, last_updated FROM bookings WHERE 1=1 "
-        params = []
-        if search_term:
-            search_pattern = f"%{search_term}%"; sql += "AND (LOWER(customer_name) LIKE LOWER(?) OR LOWER(device_model) LIKE LOWER(?) OR CAST(id AS TEXT) LIKE ? OR LOWER(IFNULL(gpc_number,'')) LIKE LOWER(?) OR LOWER(IFNULL(zir_reference,'')) LIKE LOWER(?) OR LOWER(IFNULL(device_serial,'')) LIKE LOWER(?) OR LOWER(IFNULL(notes,'')) LIKE LOWER(?))"
-            params.extend([search_pattern] * 7)
-        sql += " ORDER BY booking_date DESC, id DESC"; cursor.execute(sql, params); bookings_raw = cursor.fetchall()
-        now_naive = datetime.datetime.now()
-        for booking_row in bookings_raw:
-            booking_dict = dict(booking_row); months_in_system = 0; booking_date_str = booking_dict.get('booking_date')
-            if booking_date_str:
-                try:
-                    booking_date_dt_naive = datetime.datetime.strptime(booking_date_str.split('.')[0], '%Y-%m-%d %H:%M:%S'); delta = relativedelta(now_naive, booking_date_dt_naive)
-                    months_in_system = delta.years * 12 + delta.months
-                except (ValueError, TypeError) as e_date_parse: print(f"Warning: Could not parse booking_date '{booking_date_str}' for ID {booking_dict.get('id')}: {e_date_parse}", file=sys.stderr)
-            booking_dict['months_in_system'] = months_in_system; bookings_processed.append(booking_dict)
+        sql, params, sort_keys, age_filters, filter_errors = build_bookings_query(cursor, search_term)
+        flash_errors(filter_errors)
+        bookings, page_info = fetch_keyset_page(cursor, sql, params, sort_keys, get_page_args())
     except sqlite3.Error as e: print(f"DB Error: {e}", file=sys.stderr); flash(f"Error: {e}", "error")
     except Exception as e: print(f"Error: {e}", file=sys.stderr); flash("Unexpected error.", "error")
-    return render_template('bookings_overview.html', bookings=bookings_processed, search_term=search_term, allowed_booking_statuses=ALLOWED_BOOKING_STATUSES)
+    return render_template('bookings_overview.html', bookings=bookings, search_term=search_term, allowed_booking_statuses=ALLOWED_BOOKING_STATUSES,
+                           age_filters=age_filters, age_sort_options=AGE_SORT_OPTIONS,
+                           page=build_page_links(page_info) if page_info else None)
+
+@app.route('/export/bookings', methods=['GET'])
+def export_bookings():
+    """Streams bookings with the bookings_overview search and age filters."""
+    try:
+        cursor = get_db().cursor()
+        sql, params, sort_keys, _age_filters, filter_errors = build_bookings_query(cursor, request.args.get('search_booking', '').strip())
+        if filter_errors: return jsonify({"error_message": " ".join(filter_errors)}), 400
+        return stream_export(cursor, sql, params, sort_keys, 'bookings')
+    except sqlite3.Error as e:
+        print(f"DB Error /export/bookings: {e}", file=sys.stderr)
+        return jsonify({"error_message": f"DB error: {e}"}), 500
 
 @app.route('/booking/<int:booking_id>/edit', methods=['GET'])
 def edit_booking_form(booking_id):
     booking_data = None
     try:
         conn = get_db(); cursor = conn.cursor()
-        cursor.execute("SELECT id, booking_date, customer_name, customer_phone, device_model, device_serial, gpc_number, zir_reference, reported_issue, status, notes FROM bookings WHERE id = ?", (booking_id,))
-        booking_data = cursor.fetchone()
+        booking_data = repository.fetch_one(cursor, repository.BOOKING_FOR_EDIT_SQL, (booking_id,))
         if not booking_data: flash(f"Booking ID {booking_id} not found.", "error"); return redirect(url_for('bookings_overview'))
     except sqlite3.Error as e: flash(f"Error loading details: {e}", "error"); return redirect(url_for('bookings_overview'))
     except Exception as e: flash(f"Unexpected error: {e}", "error"); return redirect(url_for('bookings_overview') )
@@ -675,7 +1211,7 @@ def receive_stock_fast_form():
 
 @app.route('/receive_fast', methods=['POST'])
 def receive_stock_fast():
-    conn = get_db(); cursor = conn.cursor(); items_created_count = 0; errors = []; line_item_errors = []
+    conn = get_db(); cursor = conn.cursor(); errors = []; line_item_errors = []
     order_number_ref = request.form.get('order_number', '').strip() or None; order_notes = request.form.get('order_notes', '').strip() or None
     order_date_str = request.form.get('order_date', '').strip(); part_identifiers = request.form.getlist('part_identifier[]'); quantities_str = request.form.getlist('quantity[]')
     order_date_to_insert = None
@@ -695,8 +1231,7 @@ def receive_stock_fast():
             quantity = int(quantity_str)
             if quantity <= 0: line_item_errors.append(f"Row {i+1}: Quantity for '{identifier}' must be positive."); continue
         except ValueError: line_item_errors.append(f"Row {i+1}: Invalid quantity '{quantity_str}' for '{identifier}'."); continue
-        cursor.execute("SELECT id, part_name FROM part_types WHERE part_number = ? OR artikelnummer = ?", (identifier, identifier))
-        part_type_row = cursor.fetchone()
+        part_type_row = repository.fetch_one(cursor, repository.PART_TYPE_BY_IDENTIFIER_SQL, (identifier, identifier))
         if not part_type_row: line_item_errors.append(f"Row {i+1}: Part '{identifier}' not found."); continue
         lines_to_process.append({'part_type_id': part_type_row['id'], 'part_name': part_type_row['part_name'], 'identifier_used': identifier, 'qty': quantity})
     if errors or line_item_errors:
@@ -709,69 +1244,111 @@ def receive_stock_fast():
         submitted_data_repop_novalid = {'order_number':order_number_ref,'order_date':order_date_str,'order_notes':order_notes,'items':submitted_items_for_repopulation}
         return render_template('receive_stock_fast.html', submitted_data=submitted_data_repop_novalid), 400
     try:
-        cursor.execute("BEGIN TRANSACTION")
-        if order_date_to_insert: cursor.execute("INSERT INTO stock_orders (order_number, notes, order_date) VALUES (?, ?, ?)", (order_number_ref, order_notes, order_date_to_insert))
-        else: cursor.execute("INSERT INTO stock_orders (order_number, notes, order_date) VALUES (?, ?, CURRENT_TIMESTAMP)", (order_number_ref, order_notes))
-        stock_order_id = cursor.lastrowid
-        if not stock_order_id: raise sqlite3.Error("Failed to create stock order.")
-        for line in lines_to_process:
-            part_type_id, qty_received = line['part_type_id'], line['qty']
-            cursor.execute("INSERT INTO stock_order_lines (stock_order_id, part_id, quantity_received) VALUES (?, ?, ?)", (stock_order_id, part_type_id, qty_received))
-            line_id = cursor.lastrowid
-            if not line_id: raise sqlite3.Error(f"Failed to create order line for part ID {part_type_id}.")
-            for _ in range(qty_received):
-                cursor.execute("INSERT INTO inventory_items (part_type_id, status, stock_order_line_id, date_received, last_updated) VALUES (?, 'Available', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",(part_type_id, line_id)); items_created_count += 1
-        conn.commit(); flash(f"Stock received for '{order_number_ref or '(No Ref)'}'. {items_created_count} item(s) added.", 'success'); return redirect(url_for('orders_overview', search_term=order_number_ref or ''))
+        stock_order_id, created_lines = run_write_transaction(conn, lambda write_cursor: create_received_stock(write_cursor, order_number_ref, order_notes, order_date_to_insert, lines_to_process))
+        parts_api_cache.invalidate(); flash(f"Stock received for '{order_number_ref or '(No Ref)'}'. {describe_created_items(created_lines)}", 'success'); return redirect(url_for('orders_overview', search_term=order_number_ref or ''))
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e); return redirect(url_for('orders_overview', search_term=order_number_ref or ''))
     except sqlite3.Error as e:
-        if conn: conn.rollback(); print(f"DB Error: {e}", file=sys.stderr); flash(f"DB error: {e}", 'error')
+        print(f"DB Error: {e}", file=sys.stderr); flash(f"DB error: {e}", 'error')
     except Exception as e:
-        if conn: conn.rollback(); print(f"Error: {e}", file=sys.stderr); flash(f"Unexpected error: {e}", 'error')
+        print(f"Error: {e}", file=sys.stderr); flash(f"Unexpected error: {e}", 'error')
     submitted_data_repop_error = {'order_number':order_number_ref,'order_date':order_date_str,'order_notes':order_notes,'items':submitted_items_for_repopulation}
     return render_template('receive_stock_fast.html', submitted_data=submitted_data_repop_error), 500
 
 @app.route('/booking/<int:booking_id>/edit', methods=['POST'])
 def update_booking(booking_id):
     new_status = request.form.get('status', '').strip()
-    conn = get_db(); cursor = conn.cursor(); error_page_redirect_func = None
+    conn = get_db(); error_page_redirect_func = None
     is_from_full_edit_page = 'submit_edit_booking_details' in request.form
     try:
         if is_from_full_edit_page:
             new_notes = request.form.get('notes', '').strip() or None; new_gpc_number = request.form.get('gpc_number', '').strip() or None
             new_zir_reference = request.form.get('zir_reference', '').strip() or None
             if not new_status or new_status not in ALLOWED_BOOKING_STATUSES: flash("Invalid status.", "error"); return redirect(url_for('edit_booking_form', booking_id=booking_id))
-            sql = "UPDATE bookings SET status = ?, notes = ?, gpc_number = ?, zir_reference = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?"
             params = (new_status, new_notes, new_gpc_number, new_zir_reference, booking_id)
             success_redirect_url = url_for('bookings_overview'); error_page_redirect_func = lambda: redirect(url_for('edit_booking_form', booking_id=booking_id))
         else:
             flash("Invalid form submission for booking update. Please use the edit page.", "error")
             return redirect(url_for('bookings_overview'))
 
-        cursor.execute("BEGIN TRANSACTION"); cursor.execute(sql, params)
-        booking_updated = cursor.rowcount > 0
+        def save_booking(write_cursor):
+            write_cursor.execute(repository.UPDATE_BOOKING_SQL, params)
+            booking_updated = write_cursor.rowcount > 0
+            updated_item_count = install_booking_parts(write_cursor, [booking_id]) if booking_updated and new_status == 'Completed' else 0
+            return booking_updated, updated_item_count
+        booking_updated, updated_item_count = run_write_transaction(conn, save_booking)
         if not booking_updated: flash(f"Booking ID {booking_id} not found or no changes made.", "warning")
         else: flash(f"Booking ID {booking_id} updated. Status: '{new_status}'.", "success")
-        if booking_updated and new_status == 'Completed':
-            cursor.execute("SELECT inventory_item_id FROM booking_parts_used WHERE booking_id = ?", (booking_id,)); items_to_update = cursor.fetchall(); updated_item_count = 0
-            for item_row in items_to_update:
-                item_id_to_update = item_row['inventory_item_id']
-                cursor.execute("UPDATE inventory_items SET status = 'Installed', last_updated = CURRENT_TIMESTAMP WHERE id = ? AND status != 'Installed'", (item_id_to_update,))
-                if cursor.rowcount > 0: updated_item_count += 1
-            if updated_item_count > 0: flash(f"{updated_item_count} part(s) for Booking ID {booking_id} set to 'Installed'.", "info")
-        conn.commit(); return redirect(success_redirect_url)
+        if updated_item_count > 0: flash(f"{updated_item_count} part(s) for Booking ID {booking_id} set to 'Installed'.", "info")
+        parts_api_cache.invalidate(); return redirect(success_redirect_url)
+    except WriteOutcomeUnknownError as e: flash_write_outcome_unknown(e); return redirect(url_for('bookings_overview'))
     except sqlite3.Error as e:
-        if conn: conn.rollback(); flash(f"DB error: {e}", "error"); print(f"SQLite Error booking update (ID: {booking_id}): {e}", file=sys.stderr)
+        flash(f"DB error: {e}", "error"); print(f"SQLite Error booking update (ID: {booking_id}): {e}", file=sys.stderr)
         return error_page_redirect_func() if error_page_redirect_func else redirect(url_for('bookings_overview'))
     except Exception as e:
-        if conn: conn.rollback(); flash(f"Unexpected error: {e}", "error"); print(f"Unexpected Error booking update (ID: {booking_id}): {e}", file=sys.stderr)
+        flash(f"Unexpected error: {e}", "error"); print(f"Unexpected Error booking update (ID: {booking_id}): {e}", file=sys.stderr)
         return error_page_redirect_func() if error_page_redirect_func else redirect(url_for('bookings_overview'))
 
+def install_booking_parts(cursor, booking_ids):
+    """Marks every part used by the given bookings 'Installed' in one UPDATE; returns how many items changed."""
+    cursor.execute(repository.INSTALL_BOOKING_PARTS_SQL, (json.dumps(booking_ids),))
+    return cursor.rowcount
+
+@app.route('/bookings/status/batch', methods=['POST'])
+def batch_update_booking_status():
+    """Sets one status on many bookings in one transaction; 'Completed' also installs all of their parts."""
+    if request.is_json:
+        args = request.get_json(silent=True) or {}
+        if not isinstance(args, dict): return jsonify({"error_message": "Expected a JSON object."}), 400
+        booking_ids = [] if args.get('booking_ids') is None else args.get('booking_ids')
+    else:
+        args = request.form; booking_ids = request.form.getlist('booking_ids')
+    return_url = request.form.get('return_url', url_for('bookings_overview'))
+    new_status = args.get('new_status'); errors = []
+    if new_status not in ALLOWED_BOOKING_STATUSES: errors.append("Invalid status.")
+    booking_ids = parse_id_list(booking_ids)
+    if booking_ids is None: errors.append("Booking IDs must be a list of numbers."); booking_ids = []
+    if not booking_ids and not errors: errors.append("No bookings selected.")
+    if errors:
+        if request.is_json: return jsonify({"error_message": " ".join(errors)}), 400
+        flash_errors(errors); return redirect(return_url)
+
+    conn = get_db(); booking_ids_json = json.dumps(booking_ids)
+    def set_bookings_status(cursor):
+        cursor.execute(repository.BOOKING_STATUS_COUNTS_SQL, (booking_ids_json,))
+        previous_counts = {status: count for status, count in cursor.fetchall()}
+        cursor.execute(repository.SET_BOOKINGS_STATUS_SQL, (new_status, booking_ids_json, new_status))
+        updated = cursor.rowcount
+        # Already-Completed bookings in the selection are included, so any part they left un-installed is fixed too.
+        parts_installed = install_booking_parts(cursor, booking_ids) if new_status == 'Completed' else 0
+        return previous_counts, updated, parts_installed
+    try:
+        previous_counts, updated, parts_installed = run_write_transaction(conn, set_bookings_status)
+        if updated or parts_installed: parts_api_cache.invalidate()
+    except WriteOutcomeUnknownError as e:
+        if request.is_json: print(f"WRITE OUTCOME UNKNOWN: {e}", file=sys.stderr); return jsonify({"error_message": str(e)}), 504
+        flash_write_outcome_unknown(e); return redirect(return_url)
+    except sqlite3.Error as e:
+        print(f"DB Error batch_update_booking_status: {e}", file=sys.stderr)
+        if request.is_json: return jsonify({"error_message": f"Database error: {e}"}), 500
+        flash(f"DB error: {e}", "error"); return redirect(return_url)
+
+    matched = sum(previous_counts.values())
+    result = {'new_status': new_status, 'matched': matched, 'not_found': len(set(booking_ids)) - matched, 'updated': updated,
+              'parts_installed': parts_installed, 'previous_status_counts': previous_counts}
+    if request.is_json: return jsonify(result)
+    if not matched: flash("No matching bookings found.", "error")
+    else:
+        flash(f"{updated} booking(s) set to '{new_status}'" + (f"; {matched - updated} already '{new_status}'." if matched - updated else "."), "success")
+        if parts_installed: flash(f"{parts_installed} part(s) set to 'Installed'.", "info")
+    return redirect(return_url)
+
 def get_schema_version(conn_to_check):
     cursor = conn_to_check.cursor()
     try:
-        cursor.execute("SELECT version FROM schema_version LIMIT 1"); result = cursor.fetchone(); return result['version'] if result else 0
+        cursor.execute(repository.SCHEMA_VERSION_SQL); result = cursor.fetchone(); return result[0] if result else 0
     except sqlite3.Error:
         try:
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+            cursor.execute(repository.SCHEMA_VERSION_TABLE_SQL)
             if not cursor.fetchone(): return 0
             else: print("Warning: schema_version table exists but 'SELECT version' failed. Assuming 0.", file=sys.stderr); return 0
         except sqlite3.Error as e_check: print(f"Error checking schema_version table: {e_check}. Assuming 0.", file=sys.stderr); return 0
@@ -782,10 +1359,10 @@ if __name__ == '__main__':
     if not os.path.exists(DATABASE): print(f"CRITICAL: DB '{DATABASE}' not found. Run database_setup.py.", file=sys.stderr); sys.exit(1)
     temp_conn_for_check = None
     try:
-        temp_conn_for_check = sqlite3.connect(DATABASE); temp_conn_for_check.row_factory = sqlite3.Row; current_ver = get_schema_version(temp_conn_for_check)
+        temp_conn_for_check = sqlite3.connect(DATABASE); current_ver = get_schema_version(temp_conn_for_check)
         if current_ver < DB_SCHEMA_REQ: print(f"WARNING: DB schema ({current_ver}) < required ({DB_SCHEMA_REQ}). Run database_setup.py.", file=sys.stderr)
         elif current_ver > DB_SCHEMA_REQ: print(f"WARNING: DB schema ({current_ver}) > expected ({DB_SCHEMA_REQ}). App might malfunction.", file=sys.stderr)
-        else: print(f"DB schema version ({current_ver}) is compatible.")
+        else: print(f"DB schema version ({current_ver}) is compatible."); device_model_index.rebuild(temp_conn_for_check) # Typeahead ready before the first request
     except Exception as e: print(f"Error checking DB version: {e}", file=sys.stderr); sys.exit(1) # Exit on DB check error
     finally:
         if temp_conn_for_check: temp_conn_for_check.close()
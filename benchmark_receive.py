@@ -0,0 +1,59 @@
+# benchmark_receive.py - Times stock receiving for growing quantities
+import sqlite3
+import os
+import sys
+import time
+import tempfile
+
+import database_setup
+from app import create_received_stock
+
+QUANTITIES = [1, 10, 100, 1000, 2000, 10000]
+REPEATS = 3
+
+def legacy_receive(cursor, part_type_id, qty_received):
+    """The pre-existing per-unit loop, kept here only as the comparison baseline."""
+    cursor.execute("INSERT INTO stock_orders (order_number,notes,order_date) VALUES (?,?,CURRENT_TIMESTAMP)",('BENCH-LEGACY',None))
+    stock_order_id = cursor.lastrowid
+    cursor.execute("INSERT INTO stock_order_lines (stock_order_id,part_id,quantity_received) VALUES (?,?,?)",(stock_order_id,part_type_id,qty_received))
+    line_id = cursor.lastrowid
+    for _ in range(qty_received):
+        cursor.execute("INSERT INTO inventory_items (part_type_id,status,stock_order_line_id,date_received,last_updated) VALUES (?, 'Available', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",(part_type_id,line_id))
+
+def set_based_receive(cursor, part_type_id, qty_received):
+    create_received_stock(cursor, 'BENCH-SET', None, None, [{'part_type_id': part_type_id, 'qty': qty_received}])
+
+def time_receive(conn, receive_func, part_type_id, qty):
+    """Returns the best wall time (seconds) of REPEATS receives, each in its own transaction."""
+    best = None
+    for _ in range(REPEATS):
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        cursor.execute("BEGIN TRANSACTION")
+        receive_func(cursor, part_type_id, qty)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_benchmark():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_setup.DATABASE = os.path.join(tmp_dir, 'bench_inventory.db')
+        database_setup.init_db()
+        conn = sqlite3.connect(database_setup.DATABASE)
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO part_types (part_name, brand, model, part_type) VALUES ('Bench Adhesive Strip', 'Apple', 'IPHONE 11', 'Adhesive')")
+        part_type_id = cursor.lastrowid
+        conn.commit()
+
+        print(f"\n{'Qty':>8} {'Per-unit loop (ms)':>20} {'Set-based (ms)':>16} {'Speed-up':>10}")
+        for qty in QUANTITIES:
+            legacy_s = time_receive(conn, legacy_receive, part_type_id, qty)
+            set_s = time_receive(conn, set_based_receive, part_type_id, qty)
+            print(f"{qty:>8} {legacy_s * 1000:>20.2f} {set_s * 1000:>16.2f} {legacy_s / set_s:>9.1f}x")
+        conn.close()
+
+if __name__ == '__main__':
+    print("Running stock receiving benchmark on a temporary database...")
+    run_benchmark()
+    sys.exit(0)
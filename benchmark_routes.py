@@ -0,0 +1,202 @@
+# benchmark_routes.py - p50/p95 latency and peak memory of every route, with JSON baselines to compare runs
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import database_setup
+import generate_synthetic_data
+
+DEFAULT_REPEAT = 20
+RESULTS_DIR = 'benchmark_results'
+REGRESSION_THRESHOLD = 0.10 # Flag routes whose p50 or p95 got more than 10% slower than the baseline
+
+def copy_database(source, target):
+    """Copies source through SQLite's backup API, so changes still in its WAL file are included."""
+    source_conn = sqlite3.connect(source); target_conn = sqlite3.connect(target)
+    source_conn.backup(target_conn)
+    target_conn.close(); source_conn.close()
+
+def pick_fixtures(database):
+    """Looks up the ids and search terms the routes are driven with (the busiest part type, newest booking, ...)."""
+    conn = sqlite3.connect(database); conn.row_factory = sqlite3.Row
+    part_type = conn.execute("""SELECT pt.id, pt.brand, pt.model, pt.part_number FROM part_type_stock_summary s JOIN part_types pt ON pt.id = s.part_type_id
+                                ORDER BY s.available_stock DESC LIMIT 1""").fetchone()
+    items = [row[0] for row in conn.execute("SELECT id FROM inventory_items WHERE part_type_id = ? ORDER BY id LIMIT 20", (part_type['id'],))]
+    bookings = [row[0] for row in conn.execute("SELECT id FROM bookings ORDER BY id DESC LIMIT 20")]
+    customer = conn.execute("SELECT customer_name FROM bookings ORDER BY id DESC LIMIT 1").fetchone()[0]
+    order_number = conn.execute("SELECT order_number FROM stock_orders WHERE order_number IS NOT NULL ORDER BY id DESC LIMIT 1").fetchone()[0]
+    conn.close()
+    return {'part_type_id': part_type['id'], 'brand': part_type['brand'] or '', 'model': part_type['model'] or '',
+            'part_number': part_type['part_number'], 'item_ids': items, 'booking_ids': bookings,
+            'customer_last_name': customer.split()[-1], 'order_number': order_number}
+
+def build_routes(f):
+    """Returns [(name, method, path, kwargs_factory)]; kwargs_factory(n) gives the test client kwargs for run n."""
+    pt = f['part_type_id']; item = f['item_ids'][0]; booking = f['booking_ids'][0]
+    get = lambda name, path, **query: (name, 'GET', path, lambda n: {'query_string': query})
+    return [
+        get('index', '/'),
+        get('index_brand_filter', '/', brand=f['brand']),
+        get('index_part_search', '/', search_term_parts=f['part_number']),
+        get('part_types_overview', '/part_types/overview'),
+        get('part_type_details', f'/part_type/{pt}/details'),
+        get('part_type_details_with_total', f'/part_type/{pt}/details', with_total=1),
+        get('part_type_details_age_sorted', f'/part_type/{pt}/details', sort='age_desc', min_age=30),
+        get('edit_part_type_form', f'/part_type/{pt}/edit'),
+        get('add_part_type_form', '/part_types/add'),
+        get('receive_stock_form', '/receive'),
+        get('receive_stock_fast_form', '/receive_fast'),
+        get('orders_overview', '/orders'),
+        get('orders_search', '/orders', search_term=f['order_number']),
+        get('bookings_overview', '/bookings'),
+        get('bookings_search', '/bookings', search_booking=f['customer_last_name']),
+        get('bookings_age_sorted', '/bookings', sort='age_desc', min_age=6),
+        get('edit_booking_form', f'/booking/{booking}/edit'),
+        get('add_booking_form', '/bookings/add'),
+        get('api_parts_for_device', '/api/parts_for_device', brand=f['brand'], model=f['model']),
+        get('api_parts_for_device_grouped', '/api/parts_for_device', brand=f['brand'], model=f['model'], group='part_type'),
+        get('api_device_models', '/api/device_models', q=f['model'][:3], brand=f['brand']),
+        get('api_stock_aging_report', '/api/reports/stock_aging'),
+        get('export_items_part_type', '/export/items', part_type_id=pt),
+        get('export_orders', '/export/orders'),
+        get('export_bookings_search', '/export/bookings', search_booking=f['customer_last_name'], format='ndjson'),
+        get('api_db_pool_stats', '/api/db_pool_stats'),
+        get('api_facet_cache_stats', '/api/facet_cache_stats'),
+        get('api_parts_cache_stats', '/api/parts_cache_stats'),
+        get('api_device_models_stats', '/api/device_models_stats'),
+        get('api_write_retry_stats', '/api/write_retry_stats'),
+        get('api_write_queue_stats', '/api/write_queue_stats'),
+        get('api_report_pool_stats', '/api/report_pool_stats'),
+        get('metrics', '/metrics'),
+        get('api_slow_queries', '/api/slow_queries'),
+        ('add_booking_fifo', 'POST', '/bookings/add', lambda n: {'data': {
+            'customer_name': f'Bench {n}', 'device_model': f"{f['brand']} {f['model']}", 'reported_issue': 'benchmark', 'part_type_id': str(pt)}}),
+        ('update_item_status', 'POST', f'/inventory/item/{item}/status', lambda n: {'data': {
+            'new_status': 'Broken' if n % 2 == 0 else 'Available', 'return_url': '/'}}),
+        ('batch_item_status', 'POST', '/items/status/batch', lambda n: {'json': {
+            'new_status': 'Returned' if n % 2 == 0 else 'Available', 'item_ids': f['item_ids'][1:]}}),
+        ('update_booking', 'POST', f'/booking/{booking}/edit', lambda n: {'data': {
+            'status': 'In Progress' if n % 2 == 0 else 'Booked In', 'notes': f'bench {n}', 'submit_edit_booking_details': '1'}}),
+        ('batch_booking_status', 'POST', '/bookings/status/batch', lambda n: {'json': {
+            'new_status': 'Awaiting Part' if n % 2 == 0 else 'In Progress', 'booking_ids': f['booking_ids'][1:]}}),
+        ('receive_stock', 'POST', '/receive', lambda n: {'data': {'order_number': f'BENCH-{n}', f'quantity_{pt}': '5'}}),
+        ('receive_stock_fast', 'POST', '/receive_fast', lambda n: {'data': {
+            'order_number': f'BENCH-FAST-{n}', 'part_identifier[]': f['part_number'], 'quantity[]': '5'}}),
+        ('add_part_type', 'POST', '/part_types/add', lambda n: {'data': {
+            'part_name': f'Bench Part {n}', 'part_number': f'BENCH-{os.getpid()}-{n}', 'brand': f['brand'], 'model': f['model']}}),
+        ('update_part_type', 'POST', f'/part_type/{pt}/edit', lambda n: {'data': {
+            'part_name': f'Bench Renamed {n % 2}', 'part_number': f['part_number'], 'brand': f['brand'], 'model': f['model']}}),
+    ]
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 1: return sorted_values[0]
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position); upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def time_route(client, method, path, kwargs_factory, repeat):
+    """Returns the route's measurements; the first (cold) request is reported apart from the repeats."""
+    def call(n):
+        start = time.perf_counter()
+        response = client.open(path, method=method, **kwargs_factory(n))
+        response.get_data() # Drains streamed responses too
+        return (time.perf_counter() - start) * 1000, response.status_code
+    first_ms, status = call(0)
+    timings = sorted(call(n)[0] for n in range(1, repeat + 1))
+    tracemalloc.start()
+    call(repeat + 1)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'method': method, 'path': path, 'status': status, 'first_ms': round(first_ms, 3),
+            'p50_ms': round(percentile(timings, 0.50), 3), 'p95_ms': round(percentile(timings, 0.95), 3),
+            'mean_ms': round(statistics.fmean(timings), 3), 'peak_kib': round(peak / 1024, 1)}
+
+def table_counts(database):
+    conn = sqlite3.connect(database)
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('part_types', 'inventory_items', 'bookings', 'stock_orders', 'stock_order_lines', 'booking_parts_used')}
+    conn.close()
+    return counts
+
+def compare(results, baseline):
+    print(f"\n{'Route':<32} {'p50 base':>10} {'p50 now':>10} {'Δ':>7} {'p95 base':>10} {'p95 now':>10} {'Δ':>7}")
+    regressions = []
+    for name, now in results['routes'].items():
+        base = baseline['routes'].get(name)
+        if not base: print(f"{name:<32} {'(new)':>10}"); continue
+        d50 = now['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        d95 = now['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0.0
+        flag = '  <-- slower' if max(d50, d95) > REGRESSION_THRESHOLD else ''
+        if flag: regressions.append(name)
+        print(f"{name:<32} {base['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} {d50:>+7.0%} {base['p95_ms']:>10.2f} {now['p95_ms']:>10.2f} {d95:>+7.0%}{flag}")
+    return regressions
+
+def run_benchmark(database, repeat, only=None):
+    import app as inventory_app # Imported late: app reads its config from the environment at import time
+    inventory_app.DATABASE = database
+    inventory_app.app.config['TESTING'] = True
+    inventory_app.app.template_folder = os.path.dirname(os.path.abspath(__file__))
+    fixtures = pick_fixtures(database)
+    client = inventory_app.app.test_client()
+    routes = [route for route in build_routes(fixtures) if not only or any(part in route[0] for part in only)]
+    results = {'meta': {'created_at': datetime.datetime.now().isoformat(timespec='seconds'), 'database': os.path.basename(database),
+                        'rows': table_counts(database), 'repeat': repeat, 'python': platform.python_version(),
+                        'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+                        'write_queue': inventory_app.app.config['WRITE_QUEUE_ENABLED'], 'report_pool': inventory_app.app.config['REPORT_POOL_ENABLED']},
+               'routes': {}}
+    print(f"\n{'Route':<32} {'Status':>6} {'First':>9} {'p50 ms':>9} {'p95 ms':>9} {'Peak KiB':>10}")
+    for name, method, path, kwargs_factory in routes:
+        measured = time_route(client, method, path, kwargs_factory, repeat)
+        results['routes'][name] = measured
+        print(f"{name:<32} {measured['status']:>6} {measured['first_ms']:>9.2f} {measured['p50_ms']:>9.2f} {measured['p95_ms']:>9.2f} {measured['peak_kib']:>10.1f}")
+    if inventory_app._write_queue is not None: inventory_app._write_queue.stop()
+    if inventory_app._report_executor is not None: inventory_app._report_executor.shutdown()
+    inventory_app.get_db_pool().close_all()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every route through the Flask test client.")
+    parser.add_argument('--db', help="Database to benchmark (a temporary copy is used, so POST routes leave it untouched)")
+    parser.add_argument('--scale', choices=generate_synthetic_data.SCALES, default='small',
+                        help="Without --db: generate a synthetic database of this size (see generate_synthetic_data.py)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed requests per route after the first (cold) one")
+    parser.add_argument('--routes', nargs='*', help="Only routes whose name contains one of these")
+    parser.add_argument('--output', help=f"Where to write the JSON results (default: {RESULTS_DIR}/routes-<label>-<timestamp>.json)")
+    parser.add_argument('--label', help="Name for this run in the default output file name (default: db name or scale)")
+    parser.add_argument('--compare', help="Baseline JSON to compare this run against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = os.path.join(tmp_dir, 'benchmark_inventory.db')
+        if args.db:
+            print(f"Copying '{args.db}' to a temporary database...")
+            copy_database(args.db, database)
+        else:
+            print(f"Generating a '{args.scale}' synthetic database...")
+            database_setup.DATABASE = database; database_setup.init_db()
+            generate_synthetic_data.generate(database, *generate_synthetic_data.SCALES[args.scale])
+        database_setup.DATABASE = database; database_setup.init_db() # Brings a copied database up to the app's schema
+        results = run_benchmark(database, args.repeat, args.routes)
+
+    label = args.label or (os.path.splitext(os.path.basename(args.db))[0] if args.db else args.scale)
+    results['meta']['label'] = label
+    output = args.output or os.path.join(RESULTS_DIR, f"routes-{label}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as results_file: json.dump(results, results_file, indent=2)
+    print(f"\nResults written to '{output}'.")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file: baseline = json.load(baseline_file)
+        regressions = compare(results, baseline)
+        print(f"\n{len(regressions)} route(s) more than {REGRESSION_THRESHOLD:.0%} slower than '{args.compare}'." if regressions else "\nNo regressions.")
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,77 @@
+# check_batch_status_input.py - Batch status endpoints must reject ID lists that are not lists of numbers
+import sqlite3
+import os
+import sys
+import tempfile
+
+import database_setup
+import app as inventory_app
+
+UNITS = 20
+BOOKINGS = 20
+# ID list values that are not a list of whole numbers; "12" used to be read as IDs 1 and 2
+BAD_ID_LISTS = ["12", 12, 1.5, True, {"1": 1}, [1.5], [True], ["1", "x"], [None]]
+
+def seed_database(path):
+    database_setup.DATABASE = path
+    database_setup.init_db()
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO part_types (part_name, brand, model, part_type) VALUES ('Check Screen', 'Apple', 'IPHONE 11', 'Screen')")
+    inventory_app.create_received_stock(cursor, 'CHECK-BATCH', None, None, [{'part_type_id': cursor.lastrowid, 'qty': UNITS}])
+    for booking_no in range(1, BOOKINGS + 1): # Booking n uses item n, so a stray 'Completed' would also install parts
+        cursor.execute("INSERT INTO bookings (customer_name, device_model, reported_issue) VALUES (?, 'Apple iPhone 11', 'Check')", (f'Check {booking_no}',))
+        cursor.execute("INSERT INTO booking_parts_used (booking_id, inventory_item_id) VALUES (?, ?)", (cursor.lastrowid, booking_no))
+    conn.commit(); conn.close()
+
+def item_statuses(path):
+    conn = sqlite3.connect(path)
+    statuses = conn.execute("SELECT id, status FROM inventory_items ORDER BY id").fetchall()
+    conn.close()
+    return statuses
+
+def booking_and_item_statuses(path):
+    conn = sqlite3.connect(path)
+    statuses = conn.execute("SELECT id, status FROM bookings ORDER BY id").fetchall()
+    conn.close()
+    return statuses, item_statuses(path)
+
+def check_item_ids(client, path, failures):
+    for bad_ids in BAD_ID_LISTS:
+        before = item_statuses(path)
+        response = client.post('/items/status/batch', json={'item_ids': bad_ids, 'new_status': 'Broken'})
+        if response.status_code != 400: failures.append(f"item_ids={bad_ids!r}: HTTP {response.status_code}, expected 400")
+        if item_statuses(path) != before: failures.append(f"item_ids={bad_ids!r}: item statuses changed")
+    response = client.post('/items/status/batch', json={'item_ids': [1, "2"], 'new_status': 'Broken'})
+    if response.status_code != 200 or response.get_json().get('updated') != 2: failures.append(f"item_ids=[1, '2']: expected 2 items updated, got HTTP {response.status_code}")
+
+def check_booking_ids(client, path, failures):
+    for bad_ids in BAD_ID_LISTS:
+        before = booking_and_item_statuses(path)
+        response = client.post('/bookings/status/batch', json={'booking_ids': bad_ids, 'new_status': 'Completed'})
+        if response.status_code != 400: failures.append(f"booking_ids={bad_ids!r}: HTTP {response.status_code}, expected 400")
+        if booking_and_item_statuses(path) != before: failures.append(f"booking_ids={bad_ids!r}: booking or item statuses changed")
+    response = client.post('/bookings/status/batch', json={'booking_ids': [3, "4"], 'new_status': 'Completed'})
+    result = response.get_json() or {}
+    if response.status_code != 200 or result.get('updated') != 2 or result.get('parts_installed') != 2:
+        failures.append(f"booking_ids=[3, '4']: expected 2 bookings completed and 2 parts installed, got HTTP {response.status_code} {result}")
+
+def run_check():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'check_inventory.db')
+        seed_database(path)
+        inventory_app.DATABASE = path
+        inventory_app.app.config.update(TESTING=True)
+        client = inventory_app.app.test_client()
+        failures = []
+        check_item_ids(client, path, failures)
+        check_booking_ids(client, path, failures)
+        if inventory_app.app.config['WRITE_QUEUE_ENABLED']: inventory_app.get_write_queue().stop()
+        inventory_app.get_db_pool().close_all()
+        for failure in failures: print(f"FAIL: {failure}", file=sys.stderr)
+        return not failures
+
+if __name__ == '__main__':
+    ok = run_check()
+    print("OK: malformed ID lists were rejected and changed nothing." if ok else "Batch status input check FAILED.")
+    sys.exit(0 if ok else 1)
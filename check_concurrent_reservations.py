@@ -0,0 +1,80 @@
+# check_concurrent_reservations.py - Many clerks reserving from a small pool of units at once
+import sqlite3
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+import database_setup
+import app as inventory_app
+
+WORKERS = 16
+BOOKINGS_PER_WORKER = 10
+UNITS = 100 # Fewer than WORKERS * BOOKINGS_PER_WORKER, so the pool runs dry under contention
+BUSY_TIMEOUT_MS = 20 # Deliberately short so the retry path is exercised
+
+def seed_database(path):
+    database_setup.DATABASE = path
+    database_setup.init_db()
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO part_types (part_name, brand, model, part_type) VALUES ('Check Screen', 'Apple', 'IPHONE 11', 'Screen')")
+    part_type_id = cursor.lastrowid
+    _, created_lines = inventory_app.create_received_stock(cursor, 'CHECK-CONCURRENCY', None, None, [{'part_type_id': part_type_id, 'qty': UNITS}])
+    conn.commit(); conn.close()
+    return part_type_id, created_lines[0]['first_item_id']
+
+def reserver(worker_no, part_type_id, contested_item_id, outcomes):
+    client = inventory_app.app.test_client()
+    for booking_no in range(BOOKINGS_PER_WORKER):
+        form = {'customer_name': f'Clerk {worker_no}', 'device_model': 'Apple iPhone 11', 'reported_issue': f'Check {booking_no}'}
+        if booking_no == 0: form['inventory_item_id'] = str(contested_item_id) # Everyone goes for the same unit first
+        else: form['part_type_id'] = str(part_type_id)
+        response = client.post('/bookings/add', data=form)
+        body = response.get_data(as_text=True)
+        if response.status_code == 302: outcomes.append('reserved')
+        elif 'locked' in body.lower() or 'busy' in body.lower(): outcomes.append('lock_error')
+        elif response.status_code == 400: outcomes.append('not_available')
+        else: outcomes.append(f'http_{response.status_code}')
+
+def run_check():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'check_inventory.db')
+        part_type_id, contested_item_id = seed_database(path)
+        inventory_app.DATABASE = path
+        inventory_app.app.config.update(TESTING=True, DB_POOL_SIZE=WORKERS, DB_BUSY_TIMEOUT_MS=BUSY_TIMEOUT_MS)
+        inventory_app.app.template_folder = os.path.dirname(os.path.abspath(__file__)) # Error responses re-render add_booking.html
+
+        outcomes = []
+        threads = [threading.Thread(target=reserver, args=(n, part_type_id, contested_item_id, outcomes)) for n in range(WORKERS)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        if inventory_app.app.config['WRITE_QUEUE_ENABLED']: inventory_app.get_write_queue().stop()
+        inventory_app.get_db_pool().close_all()
+
+        conn = sqlite3.connect(path)
+        uses_per_item = conn.execute("SELECT inventory_item_id, COUNT(*) FROM booking_parts_used GROUP BY inventory_item_id").fetchall()
+        reserved_units = conn.execute("SELECT COUNT(*) FROM inventory_items WHERE status = 'Reserved'").fetchone()[0]
+        orphan_bookings = conn.execute("SELECT COUNT(*) FROM bookings WHERE id NOT IN (SELECT booking_id FROM booking_parts_used)").fetchone()[0]
+        conn.close()
+
+        counts = Counter(outcomes)
+        print(f"Outcomes: {dict(counts)}")
+        if inventory_app.app.config['WRITE_QUEUE_ENABLED']: print(f"Write queue: {inventory_app.get_write_queue().stats()}")
+        else: print(f"Write retries: {inventory_app.write_retry_stats}")
+        failures = []
+        if any(uses > 1 for _, uses in uses_per_item): failures.append("an item was booked more than once")
+        if reserved_units != counts['reserved'] or len(uses_per_item) != counts['reserved']: failures.append("reserved units do not match successful bookings")
+        if counts['reserved'] != UNITS: failures.append(f"expected all {UNITS} units reserved, got {counts['reserved']}")
+        if orphan_bookings: failures.append(f"{orphan_bookings} booking(s) committed without their part")
+        if counts['lock_error']: failures.append(f"{counts['lock_error']} lock error(s) reached the user")
+        if set(counts) - {'reserved', 'not_available', 'lock_error'}: failures.append("unexpected HTTP responses")
+        for failure in failures: print(f"FAIL: {failure}", file=sys.stderr)
+        return not failures
+
+if __name__ == '__main__':
+    print(f"Running {WORKERS} concurrent reservers against {UNITS} units on a temporary database...")
+    ok = run_check()
+    print("OK: no double bookings and no user-visible lock errors." if ok else "Concurrency check FAILED.")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,173 @@
+# check_online_migration.py - Upgrade a v8 database while it is being read and written, killing the migration midway
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import database_setup
+import generate_synthetic_data
+
+KILL_AFTER_BATCHES = [3, 40, 25] # Each attempt is killed (SIGKILL) after this many more committed batches, then a final run completes
+BUSY_TIMEOUT_MS = 5000 # The app's DB_BUSY_TIMEOUT_MS default: a write waiting longer would fail in the app
+PROGRESS_LINE = re.compile(r"^\s+v\d+ \w+: +[\d.]+%")
+
+# Words written by the concurrent writer; after the migration the FTS indexes must find exactly what a full rebuild finds.
+FTS_PROBES = [('bookings_fts', 'zyxwvonline'), ('bookings_fts', 'qwertychanged'), ('bookings_fts', 'a*'),
+              ('part_types_fts', 'trigramxyz'), ('part_types_fts', 'renamedxyz'), ('part_types_fts', 'scr')]
+
+def create_v8_database(path, scale):
+    database_setup.DATABASE, target = path, database_setup.DB_SCHEMA_VERSION
+    database_setup.DB_SCHEMA_VERSION = 8 # The shipped inventory.db is at v8: everything from v9 on runs online
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): database_setup.init_db()
+    finally:
+        database_setup.DB_SCHEMA_VERSION = target
+    with contextlib.redirect_stdout(io.StringIO()): generate_synthetic_data.generate(path, *generate_synthetic_data.SCALES[scale])
+
+def run_migration(path, kill_after_batches=None):
+    """Runs database_setup in a child process; returns its output, or kills it after kill_after_batches batches."""
+    env = dict(os.environ, MIGRATION_PROGRESS_INTERVAL_S='0', PYTHONUNBUFFERED='1') # A progress line per batch
+    code = "import sys, database_setup; database_setup.DATABASE = sys.argv[1]; database_setup.init_db()"
+    child = subprocess.Popen([sys.executable, '-c', code, path], stdout=subprocess.PIPE, text=True, env=env,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines, batches = [], 0
+    for line in child.stdout:
+        lines.append(line.rstrip())
+        batches += bool(PROGRESS_LINE.match(line))
+        if kill_after_batches and batches >= kill_after_batches:
+            child.send_signal(signal.SIGKILL); break
+    child.wait()
+    return lines
+
+def traffic(path, stop, latencies, errors):
+    """Reads and writes like the app does while the migration runs."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+    rng = random.Random(7)
+    max_booking_id = conn.execute("SELECT MAX(id) FROM bookings").fetchone()[0]
+    max_part_type_id = conn.execute("SELECT MAX(id) FROM part_types").fetchone()[0]
+    max_item_id = conn.execute("SELECT MAX(id) FROM inventory_items").fetchone()[0]
+    writes = [
+        ("INSERT INTO bookings (customer_name, device_model, reported_issue) VALUES ('Zyxwvonline', 'Check Model', 'check')", lambda: ()),
+        ("UPDATE bookings SET customer_name = 'Qwertychanged' WHERE id = ?", lambda: (rng.randint(1, max_booking_id),)),
+        ("DELETE FROM bookings WHERE id = ? AND id NOT IN (SELECT booking_id FROM booking_parts_used)", lambda: (rng.randint(1, max_booking_id),)),
+        ("INSERT INTO part_types (part_name, brand, model) VALUES ('Trigramxyz part', 'Check', 'Check')", lambda: ()),
+        ("UPDATE part_types SET part_name = 'Renamedxyz ' || id WHERE id = ?", lambda: (rng.randint(1, max_part_type_id),)),
+        ("INSERT INTO inventory_items (part_type_id, status, date_received) VALUES (?, 'Available', '2019-01-01')", lambda: (rng.randint(1, max_part_type_id),)),
+        ("UPDATE inventory_items SET status = ? WHERE id = ?", lambda: (rng.choice(['Available', 'Reserved', 'Broken']), rng.randint(1, max_item_id))),
+        ("DELETE FROM inventory_items WHERE id = ? AND id NOT IN (SELECT inventory_item_id FROM booking_parts_used)", lambda: (rng.randint(1, max_item_id),)),
+    ]
+    while not stop.is_set():
+        sql, values = rng.choice(writes)
+        values = values()
+        started = time.perf_counter()
+        try:
+            conn.execute("SELECT * FROM bookings WHERE id = ?", (rng.randint(1, max_booking_id),)).fetchall()
+            latencies['read'].append(time.perf_counter() - started)
+        except sqlite3.Error as e: errors.append(f"read: {e}")
+        for attempt in range(2):
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE"); conn.execute(sql, values); conn.execute("COMMIT")
+                latencies['write'].append(time.perf_counter() - started)
+                break
+            except sqlite3.Error as e:
+                if conn.in_transaction: conn.execute("ROLLBACK")
+                # SQLite 3.40's FTS5 can fail the first write to an indexed table after another connection changed
+                # the schema ("no such table"); it happens on any schema change and the same write then succeeds.
+                if attempt == 0 and 'no such table' in str(e): latencies['schema_race'].append(sql); continue
+                errors.append(f"{sql[:40]}...: {e}"); break
+        time.sleep(0.002)
+    conn.close()
+
+def fts_contents(conn, fts_table):
+    """Per-term counts, per-row token counts and the row/token totals (FTS5 data record 1, used by bm25).
+
+    MATCH results hide a row indexed twice or a 'delete' of a row never indexed; the totals do not."""
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.{fts_table}_terms USING fts5vocab(main, {fts_table}, 'row')")
+    return (conn.execute(f"SELECT term, doc, cnt FROM temp.{fts_table}_terms ORDER BY term").fetchall(),
+            conn.execute(f"SELECT id, sz FROM {fts_table}_docsize ORDER BY id").fetchall(),
+            conn.execute(f"SELECT block FROM {fts_table}_data WHERE id = 1").fetchall())
+
+def verify(path, tmp_dir):
+    failures = []
+    conn = sqlite3.connect(path, isolation_level=None) # The integrity-check INSERTs must not leave a transaction open for backup()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if conn.execute("SELECT version FROM schema_version").fetchone()[0] != database_setup.DB_SCHEMA_VERSION:
+        failures.append("schema version not reached")
+    if conn.execute("SELECT COUNT(*) FROM schema_migration_progress").fetchone()[0]: failures.append("migration checkpoints left behind")
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%schema_migration_progress%'").fetchone()[0]:
+        failures.append("backfill-guarded triggers left behind")
+    for fts_table in ('bookings_fts', 'part_types_fts'):
+        try: conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('integrity-check')")
+        except sqlite3.Error as e: failures.append(f"{fts_table} integrity-check: {e}")
+    stale = conn.execute(f"""
+        SELECT COUNT(*) FROM part_type_stock_summary s LEFT JOIN (
+            SELECT part_type_id, COUNT(*) AS total, SUM(status = 'Available') AS available, SUM(status = 'Reserved') AS reserved,
+                   SUM(status = 'Broken') AS broken, MIN(CASE WHEN status IN ('Available', 'Reserved') THEN {database_setup.ITEM_RECEIPT_DATE_SQL.format(item='inventory_items')} END) AS oldest_open
+            FROM inventory_items GROUP BY part_type_id) recount ON recount.part_type_id = s.part_type_id
+        WHERE s.total_stock != IFNULL(recount.total, 0) OR s.available_stock != IFNULL(recount.available, 0)
+           OR s.reserved_stock != IFNULL(recount.reserved, 0) OR s.broken_stock != IFNULL(recount.broken, 0)
+           OR s.oldest_open_receipt_date IS NOT recount.oldest_open""").fetchone()[0]
+    if stale: failures.append(f"{stale} stock summary row(s) differ from a recount")
+    if conn.execute("SELECT COUNT(*) FROM part_types WHERE id NOT IN (SELECT part_type_id FROM part_type_stock_summary)").fetchone()[0]:
+        failures.append("part types without a stock summary row")
+
+    rebuilt_path = os.path.join(tmp_dir, 'rebuilt.db')
+    rebuilt = sqlite3.connect(rebuilt_path)
+    conn.backup(rebuilt)
+    for fts_table in ('bookings_fts', 'part_types_fts'): rebuilt.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    rebuilt.commit()
+    for fts_table, probe in FTS_PROBES:
+        query = f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ? ORDER BY rowid"
+        found, expected = conn.execute(query, (probe,)).fetchall(), rebuilt.execute(query, (probe,)).fetchall()
+        print(f"  {fts_table} MATCH '{probe}': {len(found)} row(s)" + ("" if found == expected else f", a rebuild finds {len(expected)}"))
+        if found != expected: failures.append(f"{fts_table} out of sync for '{probe}'")
+    for fts_table in ('bookings_fts', 'part_types_fts'):
+        if fts_contents(conn, fts_table) != fts_contents(rebuilt, fts_table): failures.append(f"{fts_table} index differs from a rebuild")
+    rebuilt.close(); conn.close()
+    return failures
+
+def run_check(scale):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'online_migration.db')
+        print(f"Generating a '{scale}' database at schema v8...")
+        create_v8_database(path, scale)
+
+        stop, latencies, errors = threading.Event(), {'read': [], 'write': [], 'schema_race': []}, []
+        traffic_thread = threading.Thread(target=traffic, args=(path, stop, latencies, errors))
+        traffic_thread.start()
+        started = time.perf_counter()
+        try:
+            for attempt, kill_after in enumerate(KILL_AFTER_BATCHES + [None], start=1):
+                lines = run_migration(path, kill_after)
+                progress = [line for line in lines if PROGRESS_LINE.match(line) or 'resuming' in line.lower()]
+                outcome = f"killed after {kill_after} batch(es)" if kill_after else "ran to the end"
+                print(f"Attempt {attempt}: {outcome}" + (f"; last: {progress[-1].strip()}" if progress else ""))
+        finally:
+            stop.set(); traffic_thread.join()
+        print(f"Migrated in {time.perf_counter() - started:.1f}s with concurrent traffic.")
+
+        for kind in ('read', 'write'):
+            samples = sorted(latencies[kind])
+            if samples: print(f"  {kind}s: {len(samples)}, p99 {samples[int(len(samples) * 0.99)] * 1000:.0f} ms, max {samples[-1] * 1000:.0f} ms")
+        if latencies['schema_race']: print(f"  {len(latencies['schema_race'])} write(s) retried after a concurrent schema change")
+        failures = verify(path, tmp_dir)
+        failures += [f"write failed during the migration: {error}" for error in errors[:5]]
+        for failure in failures: print(f"FAIL: {failure}", file=sys.stderr)
+        return not failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that schema migrations resume after a kill and run alongside reads and writes.")
+    parser.add_argument('--scale', choices=generate_synthetic_data.SCALES, default='medium', help="Synthetic database size (default: medium)")
+    ok = run_check(parser.parse_args().scale)
+    print("OK: the interrupted migration resumed, and concurrent writes kept the summary and search indexes exact." if ok else "Online migration check FAILED.")
+    sys.exit(0 if ok else 1)
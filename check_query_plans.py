@@ -0,0 +1,74 @@
+# check_query_plans.py - Every statement the routes run must be served by an index: no full table scans
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+
+import database_setup
+import generate_synthetic_data
+import benchmark_routes
+
+# Full table scans that are the point of the query, as (route, table alias in the plan): reason
+EXPECTED_FULL_SCANS = {
+    ('api_stock_aging_report', 'pt'): "reports every part type that has open units",
+}
+FULL_SCAN = re.compile(r"^\s*SCAN (\w+)$") # "SCAN x USING [COVERING] INDEX ..." and virtual tables are not full table scans
+SUBQUERY_NAME = re.compile(r"^\s*(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+
+def collect_plans(database):
+    """Runs every benchmark route once; returns {(route, normalized statement): plan lines}."""
+    os.environ['SLOW_QUERY_MS'] = '0' # Every statement counts as slow, so sql_metrics explains all of them
+    os.environ['SLOW_QUERY_LOG_SIZE'] = '1000000'
+    import app as inventory_app # Imported late: app reads its config from the environment at import time
+    inventory_app.DATABASE = database
+    inventory_app.app.config['TESTING'] = True
+    inventory_app.app.template_folder = os.path.dirname(os.path.abspath(__file__))
+    client = inventory_app.app.test_client()
+    with contextlib.redirect_stderr(io.StringIO()): # The slow query log would print every statement
+        for name, method, path, kwargs_factory in benchmark_routes.build_routes(benchmark_routes.pick_fixtures(database)):
+            response = client.open(path, method=method, **kwargs_factory(1)); response.get_data()
+            if response.status_code >= 400: print(f"WARNING: {name} answered {response.status_code}", file=sys.stderr)
+    if inventory_app._write_queue is not None: inventory_app._write_queue.stop()
+    if inventory_app._report_executor is not None: inventory_app._report_executor.shutdown()
+    inventory_app.get_db_pool().close_all()
+    return {(entry['route'], entry['statement']): entry['plan'] for entry in inventory_app.sql_metrics.slow_queries() if entry['plan']}
+
+def full_scans(plan):
+    subqueries = {match.group(1) for match in map(SUBQUERY_NAME.match, plan) if match}
+    return [match.group(1) for match in map(FULL_SCAN.match, plan) if match and match.group(1) not in subqueries]
+
+def run_check(database):
+    plans = collect_plans(database)
+    failures = []
+    for (route, statement), plan in sorted(plans.items()):
+        for table in full_scans(plan):
+            if (route, table) in EXPECTED_FULL_SCANS: continue
+            failures.append((route, table, statement, plan))
+    print(f"Checked {len(plans)} distinct statement(s) across {len({route for route, _ in plans})} route(s).")
+    for route, table, statement, plan in failures:
+        print(f"\nFAIL: {route} scans all of '{table}':\n  {statement[:300]}" + ''.join(f"\n    {line}" for line in plan), file=sys.stderr)
+    return not failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the query plans of every route on a generated database.")
+    parser.add_argument('--db', help="Database to check (a temporary copy is used)")
+    parser.add_argument('--scale', choices=generate_synthetic_data.SCALES, default='large',
+                        help="Without --db: generate a synthetic database of this size (default: large)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = os.path.join(tmp_dir, 'plan_check_inventory.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            if args.db: benchmark_routes.copy_database(args.db, database)
+            else:
+                database_setup.DATABASE = database; database_setup.init_db()
+                generate_synthetic_data.generate(database, *generate_synthetic_data.SCALES[args.scale])
+            database_setup.DATABASE = database; database_setup.init_db() # Brings a copied database up to the app's schema (and ANALYZEs it)
+        ok = run_check(database)
+    print("OK: no unexpected full table scans." if ok else "Query plan check FAILED.")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,70 @@
+# data_version_cache.py - In-process caches of query results that are dropped when the database changes
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class DataVersionCache:
+    """Caches values loaded from the database per key, until the database changes.
+
+    app.py keeps two instances: facet_cache for the brand/model/category filter lists and
+    parts_api_cache (bounded) for /api/parts_for_device responses.
+
+    Writers in this process call invalidate() after committing a change the cache depends on.
+    Commits by other processes (e.g. import_from_csv.py) are noticed through data_version(),
+    which returns a value that changes when another process commits, or None when it cannot
+    tell right now. app.py passes PRAGMA data_version of the write queue's connection, which the
+    queue's own commits do not change, so ordinary writes in this process do not clear the cache.
+    The value is shared by all callers, so one external commit clears the cache once.
+    With max_entries set the cache is bounded and evicts the least recently used key.
+    """
+
+    def __init__(self, data_version, max_entries=None):
+        self.data_version = data_version
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._generation = 0 # Bumped on every clear, so a load that raced with a write is not stored
+        self._seen_data_version = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'external_changes': 0, 'evictions': 0}
+
+    def _check_data_version(self):
+        """Drops cached values if another process has committed since the last check."""
+        data_version = self.data_version()
+        if data_version is None: return # Checked again on the next get()
+        with self._lock:
+            if data_version != self._seen_data_version: # The first reading also counts: values cached before it may be stale
+                if self._values: self._stats['external_changes'] += 1
+                self._values.clear(); self._generation += 1
+                self._seen_data_version = data_version
+
+    def get(self, conn, key, loader):
+        """Returns the cached value for key, calling loader(conn) on a miss."""
+        self._check_data_version()
+        with self._lock:
+            if key in self._values:
+                self._stats['hits'] += 1
+                self._values.move_to_end(key)
+                return self._values[key]
+            self._stats['misses'] += 1
+            generation = self._generation
+        values = loader(conn)
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = values
+                while self.max_entries is not None and len(self._values) > self.max_entries:
+                    self._values.popitem(last=False); self._stats['evictions'] += 1
+        return values
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear(); self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._values); stats['max_entries'] = self.max_entries
+            if self.max_entries is None: stats['cached_keys'] = sorted(self._values)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
@@ -1,10 +1,19 @@
-# database_setup.py - Applying Schema v8 (Artikelnummer, ZIR Reference)
+# database_setup.py - Applying Schema v16 (Query Plan Index Overhaul) with resumable, batched migrations
 import sqlite3
 import os
 import sys
+import time
 
 DATABASE = 'inventory.db'
-DB_SCHEMA_VERSION = 8 # Target schema version
+DB_SCHEMA_VERSION = 16 # Target schema version
+
+# Migration batching: rows are copied/backfilled in rowid ranges of this width, one transaction per batch.
+# The pause between batches lets the running app's writers take the write lock; readers never wait (WAL).
+# At 2M inventory items, 1000/20ms kept app writes under 150 ms during backfills (5000/20ms starved them).
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 1000))
+MIGRATION_BATCH_PAUSE_MS = int(os.environ.get('MIGRATION_BATCH_PAUSE_MS', 20))
+MIGRATION_PROGRESS_INTERVAL_S = float(os.environ.get('MIGRATION_PROGRESS_INTERVAL_S', 2.0))
+MIGRATION_BUSY_TIMEOUT_MS = int(os.environ.get('MIGRATION_BUSY_TIMEOUT_MS', 30000))
 
 # --- Database Connection Function ---
 def get_db_connection():
@@ -24,13 +33,12 @@ def get_schema_version(conn):
     except sqlite3.Error: # Table 'schema_version' might not exist
         return 0
 
-def set_schema_version(conn, version):
-    """Sets the schema version."""
-    cursor = conn.cursor()
-    cursor.execute("DROP TABLE IF EXISTS schema_version")
-    cursor.execute("CREATE TABLE schema_version (version INTEGER)")
-    cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
-    conn.commit()
+def set_schema_version(cursor, version):
+    """Sets the schema version in place; committed by the caller together with the migration it records."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+    cursor.execute("UPDATE schema_version SET version = ?", (version,))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
 
 # --- Helper to check if column exists ---
 def column_exists(cursor, table_name, column_name):
@@ -43,27 +51,148 @@ def column_exists(cursor, table_name, column_name):
         print(f"Error checking column {column_name} in {table_name}: {e}")
         return False # Assume it doesn't exist on error
 
+def table_exists(cursor, table_name):
+    """Checks if a table exists."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+    return cursor.fetchone() is not None
+
+
+# --- Migration Framework ---
+# A schema version is a registered list of tasks (see SCHEMA_MIGRATIONS). Each task commits on its own and
+# records itself in schema_migration_progress in the same transaction, so a rerun after an interruption skips
+# finished tasks and resumes a batched task after its last committed batch. schema_version only moves once all
+# tasks of a version are done. Tasks are short: the app can keep serving reads, and its writes wait at most
+# one batch (or one index build). Backfills recompute their rows from the source tables, or guard the sync
+# triggers with backfill_guard(), so writes made between batches are not lost.
+
+def create_migration_progress_table(cursor):
+    """Creates the checkpoint table: one row per started task, deleted when its version is recorded."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migration_progress (
+        version INTEGER NOT NULL, task TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0,
+        last_rowid INTEGER, max_rowid INTEGER, rows_done INTEGER NOT NULL DEFAULT 0,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        PRIMARY KEY (version, task) )
+    ''')
+
+def get_task_progress(cursor, version, task):
+    """Returns a task's checkpoint row, or None if the task has not started."""
+    cursor.execute("SELECT * FROM schema_migration_progress WHERE version = ? AND task = ?", (version, task))
+    return cursor.fetchone()
+
+def run_in_transaction(conn, work):
+    """Runs work(cursor) in one write transaction (BEGIN IMMEDIATE) and commits; rolls back and re-raises on error."""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        result = work(cursor)
+        cursor.execute("COMMIT")
+        return result
+    except BaseException:
+        if conn.in_transaction: cursor.execute("ROLLBACK")
+        raise
+
+def run_migration_task(conn, version, task, work):
+    """Runs work(cursor) once, in its own transaction; skipped when a previous run already finished it."""
+    progress = get_task_progress(conn.cursor(), version, task)
+    if progress and progress['done']:
+        print(f"  v{version} {task}: already done, skipped.")
+        return
+    def work_and_record(cursor):
+        work(cursor)
+        cursor.execute('''INSERT OR REPLACE INTO schema_migration_progress (version, task, done, updated_at)
+                          VALUES (?, ?, 1, CURRENT_TIMESTAMP)''', (version, task))
+    run_in_transaction(conn, work_and_record)
+
+def start_batched_task(cursor, version, task, table_name):
+    """Registers a batched task and fixes its rowid range: rows added later (higher rowids) are not copied.
+
+    Call it in the transaction that creates the task's sync triggers, so backfill_guard() never sees a gap."""
+    if get_task_progress(cursor, version, task): return
+    cursor.execute(f"SELECT COALESCE(MIN(rowid) - 1, 0) AS first_rowid, COALESCE(MAX(rowid), 0) AS max_rowid FROM {table_name}")
+    bounds = cursor.fetchone()
+    cursor.execute('''INSERT INTO schema_migration_progress (version, task, last_rowid, max_rowid)
+                      VALUES (?, ?, ?, ?)''', (version, task, bounds['first_rowid'], bounds['max_rowid']))
+
+def backfill_guard(version, task, row_id):
+    """SQL condition for a sync trigger: true when the row is outside the part of the table the batched task
+    still has to copy, i.e. already copied or added after the task started. Rows still ahead of the backfill
+    are skipped; the backfill reads their current values when it gets there."""
+    progress = f"FROM schema_migration_progress WHERE version = {version} AND task = '{task}'"
+    return f"({row_id} <= (SELECT last_rowid {progress}) OR {row_id} > (SELECT max_rowid {progress}))"
+
+def format_duration(seconds):
+    """Formats seconds as H:MM:SS for progress and ETA lines."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def run_batched_task(conn, version, task, table_name, batch_sql, batch_size=None):
+    """Runs batch_sql over table_name's rowid range, batch_size rowids per transaction, with progress and ETA.
+
+    batch_sql takes two parameters (low, high) and handles the rows with low < rowid <= high. The checkpoint
+    is saved in each batch's transaction, so an interrupted run continues after the last committed batch."""
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    cursor = conn.cursor()
+    progress = get_task_progress(cursor, version, task)
+    if progress and progress['done']:
+        print(f"  v{version} {task}: already done, skipped.")
+        return
+    if progress is None:
+        run_in_transaction(conn, lambda c: start_batched_task(c, version, task, table_name))
+        progress = get_task_progress(cursor, version, task)
+    elif progress['rows_done']:
+        print(f"  v{version} {task}: resuming after rowid {progress['last_rowid']:,} ({progress['rows_done']:,} rows already done).")
+    last_rowid, max_rowid, rows_done = progress['last_rowid'], progress['max_rowid'], progress['rows_done']
+
+    def copy_batch(cursor, low, high):
+        cursor.execute(batch_sql, (low, high))
+        batch_rows = max(cursor.rowcount, 0)
+        cursor.execute('''UPDATE schema_migration_progress SET last_rowid = ?, rows_done = rows_done + ?, updated_at = CURRENT_TIMESTAMP
+                          WHERE version = ? AND task = ?''', (high, batch_rows, version, task))
+        return batch_rows
+
+    start_rowid, started = last_rowid, time.monotonic()
+    last_report, longest_batch = started, 0.0
+    while last_rowid < max_rowid:
+        high = min(last_rowid + batch_size, max_rowid)
+        batch_start = time.monotonic()
+        rows_done += run_in_transaction(conn, lambda c: copy_batch(c, last_rowid, high))
+        last_rowid, now = high, time.monotonic()
+        longest_batch = max(longest_batch, now - batch_start)
+        if now - last_report >= MIGRATION_PROGRESS_INTERVAL_S and last_rowid < max_rowid:
+            rate = (last_rowid - start_rowid) / (now - started) # rowids per second, this run
+            eta = format_duration((max_rowid - last_rowid) / rate) if rate else "?"
+            print(f"  v{version} {task}: {100.0 * last_rowid / max_rowid:5.1f}% (rowid {last_rowid:,}/{max_rowid:,}, "
+                  f"{rows_done:,} rows), ETA {eta}")
+            last_report = now
+        if MIGRATION_BATCH_PAUSE_MS: time.sleep(MIGRATION_BATCH_PAUSE_MS / 1000.0)
+    run_in_transaction(conn, lambda c: c.execute("UPDATE schema_migration_progress SET done = 1 WHERE version = ? AND task = ?", (version, task)))
+    print(f"  v{version} {task}: {rows_done:,} rows in {format_duration(time.monotonic() - started)}, "
+          f"longest batch {longest_batch * 1000:.0f} ms.")
+
+def finish_migration(conn, version):
+    """Records a completed version and clears its checkpoints, in one transaction."""
+    def record(cursor):
+        set_schema_version(cursor, version)
+        cursor.execute("DELETE FROM schema_migration_progress WHERE version = ?", (version,))
+    run_in_transaction(conn, record)
+
 
 # --- Functions to apply each schema version ---
 
-def apply_schema_v6(cursor, conn, current_version):
+def apply_schema_v6(conn, current_version):
     """Applies changes for Serialized Inventory model (Schema v6)."""
     print("Applying schema version 6 (Serialized Inventory)...")
+    # Resumable: a rerun finds the renamed tables (the names depend only on the unchanged schema version).
+    part_types_old = f"part_types_old_v{current_version}"
+
     # --- 1. Create/Recreate part_types (replaces parts table) ---
-    try:
+    def create_part_types(cursor):
         print("Processing 'part_types' table (v6)...")
-        old_table_name_to_migrate = None
-        if current_version >= 2:
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='parts'")
-            if cursor.fetchone(): old_table_name_to_migrate = 'parts'
-
-        temp_table_name = None
-        if old_table_name_to_migrate:
-            temp_table_name = f"part_types_old_v{current_version}"
-            print(f"Renaming '{old_table_name_to_migrate}' to '{temp_table_name}'...")
-            cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name}")
-            cursor.execute(f"ALTER TABLE {old_table_name_to_migrate} RENAME TO {temp_table_name}")
-
+        if current_version >= 2 and table_exists(cursor, 'parts'):
+            print(f"Renaming 'parts' to '{part_types_old}'...")
+            cursor.execute(f"DROP TABLE IF EXISTS {part_types_old}")
+            cursor.execute(f"ALTER TABLE parts RENAME TO {part_types_old}")
         cursor.execute("DROP TABLE IF EXISTS part_types")
         cursor.execute('''
         CREATE TABLE part_types (
@@ -71,38 +200,34 @@ def apply_schema_v6(cursor, conn, current_version):
             part_type TEXT, brand TEXT, model TEXT, cost_price REAL, storage_location TEXT,
             description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
         )''')
-
-        if temp_table_name:
-            print(f"Copying data from {temp_table_name} to new 'part_types' table...")
+    try:
+        run_migration_task(conn, 6, 'create_part_types', create_part_types)
+        if table_exists(conn.cursor(), part_types_old):
+            print(f"Copying data from {part_types_old} to new 'part_types' table...")
             v_old_columns = "id, part_name, part_number, part_type, brand, model, cost_price, storage_location"
             v_new_columns = "id, part_name, part_number, part_type, brand, model, cost_price, storage_location"
-            try:
-                 cursor.execute(f'INSERT INTO part_types ({v_new_columns}) SELECT {v_old_columns} FROM {temp_table_name}')
-                 conn.commit()
-                 cursor.execute(f"DROP TABLE {temp_table_name}")
-                 print(f"Dropped temporary table {temp_table_name}.")
-            except sqlite3.Error as copy_error:
-                 print(f"!!! WARNING: Error copying data from {temp_table_name}: {copy_error}. Manual migration might be needed. {temp_table_name} kept.")
-
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_name ON part_types (part_name);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_number ON part_types (part_number);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_brand_model ON part_types (brand, model);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_type ON part_types (part_type);")
+            run_batched_task(conn, 6, 'copy_part_types', part_types_old,
+                             f'INSERT INTO part_types ({v_new_columns}) SELECT {v_old_columns} FROM {part_types_old} WHERE rowid > ? AND rowid <= ?')
+            run_migration_task(conn, 6, 'drop_part_types_old', lambda cursor: cursor.execute(f"DROP TABLE {part_types_old}"))
+            print(f"Dropped temporary table {part_types_old}.")
+
+        def index_part_types(cursor):
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_name ON part_types (part_name);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_number ON part_types (part_number);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_brand_model ON part_types (brand, model);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pt_type ON part_types (part_type);")
+        run_migration_task(conn, 6, 'index_part_types', index_part_types)
         print("'part_types' table created/updated (v6).")
     except sqlite3.Error as e: print(f"Error with 'part_types' table (v6): {e}"); raise
 
-    # --- 2. Create stock_orders table ---
-    try:
+    # --- 2.-5. Create stock_orders, inventory_items, stock_order_lines and booking_parts_used tables ---
+    def create_inventory_tables(cursor):
         print("Creating 'stock_orders' table (v6)...")
         cursor.execute("DROP TABLE IF EXISTS stock_orders")
         cursor.execute('''CREATE TABLE stock_orders (id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL, notes TEXT )''')
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_order_number ON stock_orders (order_number);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_order_date ON stock_orders (order_date);")
-        print("'stock_orders' table created.")
-    except sqlite3.Error as e: print(f"Error creating 'stock_orders': {e}"); raise
 
-    # --- 3. Create inventory_items table ---
-    try:
         print("Creating 'inventory_items' table (v6)...")
         cursor.execute("DROP TABLE IF EXISTS inventory_items")
         cursor.execute('''
@@ -115,11 +240,7 @@ def apply_schema_v6(cursor, conn, current_version):
         ''')
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_invitem_parttype_status ON inventory_items (part_type_id, status);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_invitem_serial ON inventory_items (serial_number);")
-        print("'inventory_items' table created.")
-    except sqlite3.Error as e: print(f"Error creating 'inventory_items': {e}"); raise
 
-    # --- 4. Create stock_order_lines table ---
-    try:
         print("Creating 'stock_order_lines' table (v6)...")
         cursor.execute("DROP TABLE IF EXISTS stock_order_lines")
         cursor.execute('''
@@ -130,11 +251,7 @@ def apply_schema_v6(cursor, conn, current_version):
             FOREIGN KEY (part_id) REFERENCES part_types (id) ON DELETE RESTRICT )
         ''')
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_line_order_part ON stock_order_lines (stock_order_id, part_id);")
-        print("'stock_order_lines' table created.")
-    except sqlite3.Error as e: print(f"Error creating 'stock_order_lines': {e}"); raise
 
-    # --- 5. Create booking_parts_used table ---
-    try:
         print("Creating 'booking_parts_used' table (v6)...")
         cursor.execute("DROP TABLE IF EXISTS booking_parts_used")
         cursor.execute('''
@@ -145,64 +262,54 @@ def apply_schema_v6(cursor, conn, current_version):
             FOREIGN KEY (inventory_item_id) REFERENCES inventory_items (id) ON DELETE RESTRICT )
         ''')
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_bpu_booking_item ON booking_parts_used (booking_id, inventory_item_id);")
-        print("'booking_parts_used' table created.")
-    except sqlite3.Error as e: print(f"Error creating 'booking_parts_used': {e}"); raise
+    try:
+        run_migration_task(conn, 6, 'create_inventory_tables', create_inventory_tables)
+        print("'stock_orders', 'inventory_items', 'stock_order_lines' and 'booking_parts_used' tables created.")
+    except sqlite3.Error as e: print(f"Error creating inventory tables (v6): {e}"); raise
 
     # --- 6. Ensure bookings table exists with gpc_number ---
-    try:
+    def create_bookings(cursor):
         print("Ensuring 'bookings' table structure (v6)...")
-        needs_bookings_update = True
-        bookings_existed = False
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-        if cursor.fetchone():
-            bookings_existed = True
+        if table_exists(cursor, 'bookings'):
             if column_exists(cursor, 'bookings', 'gpc_number'):
                 print("'bookings' table already has 'gpc_number'. Skipping recreation for v6.")
-                needs_bookings_update = False
-            else:
-                print("'bookings' table found but missing 'gpc_number'. Recreating for v6...")
+                return
+            print("'bookings' table found but missing 'gpc_number'. Recreating for v6...")
+            cursor.execute("DROP TABLE IF EXISTS bookings_old_v6_temp")
+            cursor.execute("ALTER TABLE bookings RENAME TO bookings_old_v6_temp")
         else:
             print("'bookings' table not found. Creating for v6...")
-
-        if needs_bookings_update:
-            if bookings_existed:
-                 cursor.execute("DROP TABLE IF EXISTS bookings_old_v6_temp")
-                 cursor.execute("ALTER TABLE bookings RENAME TO bookings_old_v6_temp")
-
-            cursor.execute("DROP TABLE IF EXISTS bookings") # Drop just in case
-            cursor.execute('''
-            CREATE TABLE bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, booking_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
-                customer_name TEXT NOT NULL, customer_phone TEXT, device_model TEXT NOT NULL,
-                device_serial TEXT, gpc_number TEXT, reported_issue TEXT NOT NULL,
-                status TEXT DEFAULT 'Booked In' NOT NULL, notes TEXT, last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL )
-            ''')
-            if bookings_existed:
-                 print("Copying data to new 'bookings' table (v6)...")
-                 cols_to_copy = "id, booking_date, customer_name, customer_phone, device_model, device_serial, reported_issue, status, notes, last_updated"
-                 try:
-                     cursor.execute(f'INSERT INTO bookings ({cols_to_copy}) SELECT {cols_to_copy} FROM bookings_old_v6_temp')
-                     cursor.execute("DROP TABLE bookings_old_v6_temp")
-                     print("Data copied, old v6 table dropped.")
-                 except sqlite3.Error as e_copy_book:
-                     print(f"!!! Warning: Failed to copy bookings data during v6 upgrade: {e_copy_book}. Old table kept.")
-
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_date ON bookings (booking_date);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_customer_name ON bookings (customer_name);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_status ON bookings (status);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_gpc_number ON bookings (gpc_number);")
-            print("'bookings' table created/updated (v6).")
+        cursor.execute("DROP TABLE IF EXISTS bookings") # Drop just in case
+        cursor.execute('''
+        CREATE TABLE bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, booking_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+            customer_name TEXT NOT NULL, customer_phone TEXT, device_model TEXT NOT NULL,
+            device_serial TEXT, gpc_number TEXT, reported_issue TEXT NOT NULL,
+            status TEXT DEFAULT 'Booked In' NOT NULL, notes TEXT, last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL )
+        ''')
+    def index_bookings(cursor):
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_date ON bookings (booking_date);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_customer_name ON bookings (customer_name);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_status ON bookings (status);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_gpc_number ON bookings (gpc_number);")
+    try:
+        run_migration_task(conn, 6, 'create_bookings', create_bookings)
+        if table_exists(conn.cursor(), 'bookings_old_v6_temp'):
+            print("Copying data to new 'bookings' table (v6)...")
+            cols_to_copy = "id, booking_date, customer_name, customer_phone, device_model, device_serial, reported_issue, status, notes, last_updated"
+            run_batched_task(conn, 6, 'copy_bookings', 'bookings_old_v6_temp',
+                             f'INSERT INTO bookings ({cols_to_copy}) SELECT {cols_to_copy} FROM bookings_old_v6_temp WHERE rowid > ? AND rowid <= ?')
+            run_migration_task(conn, 6, 'drop_bookings_old', lambda cursor: cursor.execute("DROP TABLE bookings_old_v6_temp"))
+            print("Data copied, old v6 table dropped.")
+        run_migration_task(conn, 6, 'index_bookings', index_bookings)
+        print("'bookings' table created/updated (v6).")
     except sqlite3.Error as e: print(f"Error ensuring bookings table structure (v6): {e}"); raise e
 
-    set_schema_version(conn, 6)
-    print("Schema version set to 6.")
-    return 6
-
 
-def apply_schema_v7(cursor, conn, current_version):
+def apply_schema_v7(conn, current_version):
     """Applies changes for adding artikelnummer (Schema v7)."""
     print("Applying schema version 7 (Adding artikelnummer to part_types)...")
-    try:
+    def add_artikelnummer(cursor):
         if not column_exists(cursor, 'part_types', 'artikelnummer'):
             print("Adding 'artikelnummer' column to 'part_types' table...")
             cursor.execute("ALTER TABLE part_types ADD COLUMN artikelnummer TEXT")
@@ -210,18 +317,17 @@ def apply_schema_v7(cursor, conn, current_version):
             print("'artikelnummer' column and index added to 'part_types'.")
         else:
             print("'artikelnummer' column already exists in 'part_types'.")
+    try:
+        run_migration_task(conn, 7, 'add_artikelnummer', add_artikelnummer)
     except sqlite3.Error as e:
         print(f"Error adding 'artikelnummer' to 'part_types': {e}")
         raise e
-    set_schema_version(conn, 7)
-    print("Schema version set to 7.")
-    return 7
 
 
-def apply_schema_v8(cursor, conn, current_version):
+def apply_schema_v8(conn, current_version):
     """Applies changes for adding ZIR Reference (Schema v8)."""
     print("Applying schema version 8 (Adding ZIR Reference to Bookings)...")
-    try:
+    def add_zir_reference(cursor):
         if not column_exists(cursor, 'bookings', 'zir_reference'):
             print("Adding 'zir_reference' column to 'bookings' table...")
             cursor.execute("ALTER TABLE bookings ADD COLUMN zir_reference TEXT")
@@ -229,17 +335,412 @@ def apply_schema_v8(cursor, conn, current_version):
             print("'zir_reference' column and index added to 'bookings'.")
         else:
             print("'zir_reference' column already exists in 'bookings'.")
+    try:
+        run_migration_task(conn, 8, 'add_zir_reference', add_zir_reference)
     except sqlite3.Error as e:
         print(f"Error adding 'zir_reference' to 'bookings': {e}")
         raise e
-    set_schema_version(conn, 8)
-    print("Schema version set to 8.")
-    return 8
 
 
+def apply_schema_v9(conn, current_version):
+    """Applies changes for the trigger-maintained stock summary (Schema v9)."""
+    print("Applying schema version 9 (part_type_stock_summary table + triggers)...")
+    def create_summary(cursor):
+        print("Creating 'part_type_stock_summary' table (v9)...")
+        # One row per part type. brand/model/part_name are copied so the index page
+        # ordering can be served entirely by idx_ptss_sort.
+        cursor.execute("DROP TABLE IF EXISTS part_type_stock_summary")
+        cursor.execute('''
+        CREATE TABLE part_type_stock_summary (
+            part_type_id INTEGER PRIMARY KEY, brand TEXT, model TEXT, part_name TEXT,
+            total_stock INTEGER NOT NULL DEFAULT 0, available_stock INTEGER NOT NULL DEFAULT 0,
+            reserved_stock INTEGER NOT NULL DEFAULT 0, installed_stock INTEGER NOT NULL DEFAULT 0,
+            broken_stock INTEGER NOT NULL DEFAULT 0, returned_stock INTEGER NOT NULL DEFAULT 0 )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ptss_sort ON part_type_stock_summary (
+            broken_stock DESC, available_stock DESC, reserved_stock DESC, returned_stock DESC,
+            total_stock DESC, brand, model, part_name)
+        ''')
+
+        # The triggers go in before the backfill: rows they touch ahead of the backfill are recomputed by it.
+        print("Creating stock summary triggers (v9)...")
+        cursor.execute("DROP TRIGGER IF EXISTS trg_pt_summary_insert")
+        cursor.execute('''
+        CREATE TRIGGER trg_pt_summary_insert AFTER INSERT ON part_types
+        BEGIN
+            INSERT OR IGNORE INTO part_type_stock_summary (part_type_id, brand, model, part_name)
+            VALUES (NEW.id, NEW.brand, NEW.model, NEW.part_name);
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_pt_summary_update")
+        cursor.execute('''
+        CREATE TRIGGER trg_pt_summary_update AFTER UPDATE OF brand, model, part_name ON part_types
+        BEGIN
+            UPDATE part_type_stock_summary SET brand = NEW.brand, model = NEW.model, part_name = NEW.part_name
+            WHERE part_type_id = NEW.id;
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_pt_summary_delete")
+        cursor.execute('''
+        CREATE TRIGGER trg_pt_summary_delete AFTER DELETE ON part_types
+        BEGIN
+            DELETE FROM part_type_stock_summary WHERE part_type_id = OLD.id;
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_summary_insert")
+        cursor.execute('''
+        CREATE TRIGGER trg_invitem_summary_insert AFTER INSERT ON inventory_items
+        BEGIN
+            INSERT OR IGNORE INTO part_type_stock_summary (part_type_id, brand, model, part_name)
+            SELECT id, brand, model, part_name FROM part_types WHERE id = NEW.part_type_id;
+            UPDATE part_type_stock_summary SET
+                total_stock = total_stock + 1,
+                available_stock = available_stock + (NEW.status = 'Available'),
+                reserved_stock = reserved_stock + (NEW.status = 'Reserved'),
+                installed_stock = installed_stock + (NEW.status = 'Installed'),
+                broken_stock = broken_stock + (NEW.status = 'Broken'),
+                returned_stock = returned_stock + (NEW.status = 'Returned')
+            WHERE part_type_id = NEW.part_type_id;
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_summary_delete")
+        cursor.execute('''
+        CREATE TRIGGER trg_invitem_summary_delete AFTER DELETE ON inventory_items
+        BEGIN
+            UPDATE part_type_stock_summary SET
+                total_stock = total_stock - 1,
+                available_stock = available_stock - (OLD.status = 'Available'),
+                reserved_stock = reserved_stock - (OLD.status = 'Reserved'),
+                installed_stock = installed_stock - (OLD.status = 'Installed'),
+                broken_stock = broken_stock - (OLD.status = 'Broken'),
+                returned_stock = returned_stock - (OLD.status = 'Returned')
+            WHERE part_type_id = OLD.part_type_id;
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_summary_update")
+        cursor.execute('''
+        CREATE TRIGGER trg_invitem_summary_update AFTER UPDATE OF status, part_type_id ON inventory_items
+        WHEN OLD.status IS NOT NEW.status OR OLD.part_type_id IS NOT NEW.part_type_id
+        BEGIN
+            UPDATE part_type_stock_summary SET
+                total_stock = total_stock - 1,
+                available_stock = available_stock - (OLD.status = 'Available'),
+                reserved_stock = reserved_stock - (OLD.status = 'Reserved'),
+                installed_stock = installed_stock - (OLD.status = 'Installed'),
+                broken_stock = broken_stock - (OLD.status = 'Broken'),
+                returned_stock = returned_stock - (OLD.status = 'Returned')
+            WHERE part_type_id = OLD.part_type_id;
+            INSERT OR IGNORE INTO part_type_stock_summary (part_type_id, brand, model, part_name)
+            SELECT id, brand, model, part_name FROM part_types WHERE id = NEW.part_type_id;
+            UPDATE part_type_stock_summary SET
+                total_stock = total_stock + 1,
+                available_stock = available_stock + (NEW.status = 'Available'),
+                reserved_stock = reserved_stock + (NEW.status = 'Reserved'),
+                installed_stock = installed_stock + (NEW.status = 'Installed'),
+                broken_stock = broken_stock + (NEW.status = 'Broken'),
+                returned_stock = returned_stock + (NEW.status = 'Returned')
+            WHERE part_type_id = NEW.part_type_id;
+        END
+        ''')
+        start_batched_task(cursor, 9, 'backfill_summary', 'part_types')
+    try:
+        run_migration_task(conn, 9, 'create_summary', create_summary)
+        print("Backfilling 'part_type_stock_summary' from 'inventory_items'...")
+        # Recomputes whole rows (REPLACE), overwriting whatever the triggers counted for these part types so far.
+        run_batched_task(conn, 9, 'backfill_summary', 'part_types', '''
+        INSERT OR REPLACE INTO part_type_stock_summary (part_type_id, brand, model, part_name, total_stock,
+            available_stock, reserved_stock, installed_stock, broken_stock, returned_stock)
+        SELECT pt.id, pt.brand, pt.model, pt.part_name, COUNT(i.id),
+               COALESCE(SUM(i.status = 'Available'), 0), COALESCE(SUM(i.status = 'Reserved'), 0),
+               COALESCE(SUM(i.status = 'Installed'), 0), COALESCE(SUM(i.status = 'Broken'), 0),
+               COALESCE(SUM(i.status = 'Returned'), 0)
+        FROM part_types pt LEFT JOIN inventory_items i ON pt.id = i.part_type_id
+        WHERE pt.id > ? AND pt.id <= ?
+        GROUP BY pt.id
+        ''')
+        print("'part_type_stock_summary' table and triggers created (v9).")
+    except sqlite3.Error as e:
+        print(f"Error creating stock summary (v9): {e}")
+        raise e
+
+
+def create_fts_triggers(cursor, table_name, fts_name, columns, guard=None):
+    """(Re)creates the triggers that keep an external-content FTS table in sync with its table.
+
+    With a guard (see backfill_guard) the triggers leave rows alone that the backfill has yet to index."""
+    when = lambda row_id: f"WHEN {guard(row_id)}" if guard else ""
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"NEW.{column}" for column in columns)
+    old_values = ', '.join(f"OLD.{column}" for column in columns)
+    cursor.execute(f"DROP TRIGGER IF EXISTS trg_{fts_name}_insert")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_{fts_name}_insert AFTER INSERT ON {table_name} {when('NEW.id')}
+    BEGIN
+        INSERT INTO {fts_name} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+    END
+    ''')
+    cursor.execute(f"DROP TRIGGER IF EXISTS trg_{fts_name}_delete")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_{fts_name}_delete AFTER DELETE ON {table_name} {when('OLD.id')}
+    BEGIN
+        INSERT INTO {fts_name} ({fts_name}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+    END
+    ''')
+    cursor.execute(f"DROP TRIGGER IF EXISTS trg_{fts_name}_update")
+    cursor.execute(f'''
+    CREATE TRIGGER trg_{fts_name}_update
+    AFTER UPDATE OF {column_list} ON {table_name} {when('OLD.id')}
+    BEGIN
+        INSERT INTO {fts_name} ({fts_name}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+        INSERT INTO {fts_name} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+    END
+    ''')
+
+def build_fts_index(conn, version, table_name, fts_name, columns, create_fts_table):
+    """Creates an external-content FTS table and indexes the existing rows in batches instead of one 'rebuild'.
+
+    Until the backfill is done the sync triggers are guarded, so a row is indexed exactly once: by the
+    backfill if it was written before the backfill reached it, otherwise by the triggers."""
+    task = f"index_{table_name}"
+    guard = lambda row_id: backfill_guard(version, task, row_id)
+    def create(cursor):
+        create_fts_table(cursor)
+        create_fts_triggers(cursor, table_name, fts_name, columns, guard=guard)
+        start_batched_task(cursor, version, task, table_name)
+    run_migration_task(conn, version, f"create_{fts_name}", create)
+    print(f"Building '{fts_name}' from existing {table_name}...")
+    column_list = ', '.join(columns)
+    run_batched_task(conn, version, task, table_name,
+                     f"INSERT INTO {fts_name} (rowid, {column_list}) SELECT id, {column_list} FROM {table_name} WHERE id > ? AND id <= ?")
+    print(f"Creating {fts_name} sync triggers (v{version})...")
+    run_migration_task(conn, version, f"unguard_{fts_name}_triggers",
+                       lambda cursor: create_fts_triggers(cursor, table_name, fts_name, columns))
+
+BOOKINGS_FTS_COLUMNS = ['customer_name', 'device_model', 'device_serial', 'gpc_number', 'zir_reference', 'notes']
+PART_TYPES_FTS_COLUMNS = ['artikelnummer', 'part_number', 'part_name', 'brand', 'model', 'part_type']
+
+def apply_schema_v10(conn, current_version):
+    """Applies changes for the FTS5 booking search index (Schema v10)."""
+    print("Applying schema version 10 (bookings_fts full-text index)...")
+    def create_bookings_fts(cursor):
+        print("Creating 'bookings_fts' virtual table (v10)...")
+        cursor.execute("DROP TABLE IF EXISTS bookings_fts")
+        # External-content table: the text lives in 'bookings', FTS only stores the index.
+        cursor.execute('''
+        CREATE VIRTUAL TABLE bookings_fts USING fts5(
+            customer_name, device_model, device_serial, gpc_number, zir_reference, notes,
+            content='bookings', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3' )
+        ''')
+    try:
+        build_fts_index(conn, 10, 'bookings', 'bookings_fts', BOOKINGS_FTS_COLUMNS, create_bookings_fts)
+        print("'bookings_fts' table and triggers created (v10).")
+    except sqlite3.Error as e:
+        print(f"Error creating booking search index (v10): {e}")
+        raise e
+
+
+def apply_schema_v11(conn, current_version):
+    """Applies changes for the trigram part type search index (Schema v11)."""
+    print("Applying schema version 11 (part_types_fts trigram index)...")
+    def create_part_types_fts(cursor):
+        print("Creating 'part_types_fts' virtual table (v11)...")
+        cursor.execute("DROP TABLE IF EXISTS part_types_fts")
+        # Trigram tokens let MATCH answer case-insensitive substring searches (3+ characters).
+        cursor.execute('''
+        CREATE VIRTUAL TABLE part_types_fts USING fts5(
+            artikelnummer, part_number, part_name, brand, model, part_type,
+            content='part_types', content_rowid='id', tokenize='trigram' )
+        ''')
+    try:
+        build_fts_index(conn, 11, 'part_types', 'part_types_fts', PART_TYPES_FTS_COLUMNS, create_part_types_fts)
+        print("'part_types_fts' table and triggers created (v11).")
+    except sqlite3.Error as e:
+        print(f"Error creating part type search index (v11): {e}")
+        raise e
+
+
+# Oldest receipt date (stock order date, else the item's own date) of a part type's Available/Reserved units.
+OLDEST_OPEN_RECEIPT_SQL = """
+    (SELECT MIN(COALESCE(so.order_date, i.date_received)) FROM inventory_items i
+     LEFT JOIN stock_order_lines sol ON i.stock_order_line_id = sol.id
+     LEFT JOIN stock_orders so ON sol.stock_order_id = so.id
+     WHERE i.part_type_id = part_type_stock_summary.part_type_id AND i.status IN ('Available', 'Reserved'))
+"""
+ITEM_RECEIPT_DATE_SQL = """
+    COALESCE((SELECT so.order_date FROM stock_order_lines sol JOIN stock_orders so ON sol.stock_order_id = so.id
+              WHERE sol.id = {item}.stock_order_line_id), {item}.date_received)
+"""
+
+def apply_schema_v12(conn, current_version):
+    """Applies changes for the precomputed oldest open receipt date (Schema v12)."""
+    print("Applying schema version 12 (oldest_open_receipt_date on part_type_stock_summary)...")
+    def create_oldest_open(cursor):
+        if not column_exists(cursor, 'part_type_stock_summary', 'oldest_open_receipt_date'):
+            print("Adding 'oldest_open_receipt_date' column to 'part_type_stock_summary'...")
+            cursor.execute("ALTER TABLE part_type_stock_summary ADD COLUMN oldest_open_receipt_date TIMESTAMP")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ptss_oldest_open ON part_type_stock_summary (oldest_open_receipt_date) WHERE oldest_open_receipt_date IS NOT NULL;")
+
+        # The triggers go in before the backfill: rows they touch ahead of the backfill are recomputed by it.
+        print("Creating oldest open receipt triggers (v12)...")
+        # New open unit: merge its receipt date into the running minimum.
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_oldest_open_insert")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_invitem_oldest_open_insert AFTER INSERT ON inventory_items
+        WHEN NEW.status IN ('Available', 'Reserved')
+        BEGIN
+            UPDATE part_type_stock_summary SET oldest_open_receipt_date = MIN(IFNULL(oldest_open_receipt_date, {ITEM_RECEIPT_DATE_SQL.format(item='NEW')}), {ITEM_RECEIPT_DATE_SQL.format(item='NEW')})
+            WHERE part_type_id = NEW.part_type_id;
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_oldest_open_update_new")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_invitem_oldest_open_update_new AFTER UPDATE OF status, part_type_id, stock_order_line_id ON inventory_items
+        WHEN NEW.status IN ('Available', 'Reserved')
+        BEGIN
+            UPDATE part_type_stock_summary SET oldest_open_receipt_date = MIN(IFNULL(oldest_open_receipt_date, {ITEM_RECEIPT_DATE_SQL.format(item='NEW')}), {ITEM_RECEIPT_DATE_SQL.format(item='NEW')})
+            WHERE part_type_id = NEW.part_type_id;
+        END
+        ''')
+        # An open unit left (status change, move or delete): only a unit at the current minimum forces a recount.
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_oldest_open_update_old")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_invitem_oldest_open_update_old AFTER UPDATE OF status, part_type_id, stock_order_line_id ON inventory_items
+        WHEN OLD.status IN ('Available', 'Reserved')
+        BEGIN
+            UPDATE part_type_stock_summary SET oldest_open_receipt_date = {OLDEST_OPEN_RECEIPT_SQL}
+            WHERE part_type_id = OLD.part_type_id AND oldest_open_receipt_date >= {ITEM_RECEIPT_DATE_SQL.format(item='OLD')};
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_invitem_oldest_open_delete")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_invitem_oldest_open_delete AFTER DELETE ON inventory_items
+        WHEN OLD.status IN ('Available', 'Reserved')
+        BEGIN
+            UPDATE part_type_stock_summary SET oldest_open_receipt_date = {OLDEST_OPEN_RECEIPT_SQL}
+            WHERE part_type_id = OLD.part_type_id AND oldest_open_receipt_date >= {ITEM_RECEIPT_DATE_SQL.format(item='OLD')};
+        END
+        ''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_stock_order_oldest_open_update")
+        cursor.execute(f'''
+        CREATE TRIGGER trg_stock_order_oldest_open_update AFTER UPDATE OF order_date ON stock_orders
+        BEGIN
+            UPDATE part_type_stock_summary SET oldest_open_receipt_date = {OLDEST_OPEN_RECEIPT_SQL}
+            WHERE part_type_id IN (SELECT part_id FROM stock_order_lines WHERE stock_order_id = NEW.id);
+        END
+        ''')
+        start_batched_task(cursor, 12, 'backfill_oldest_open', 'part_type_stock_summary')
+    try:
+        run_migration_task(conn, 12, 'create_oldest_open', create_oldest_open)
+        print("Backfilling 'oldest_open_receipt_date'...")
+        run_batched_task(conn, 12, 'backfill_oldest_open', 'part_type_stock_summary',
+                         f"UPDATE part_type_stock_summary SET oldest_open_receipt_date = {OLDEST_OPEN_RECEIPT_SQL} WHERE part_type_id > ? AND part_type_id <= ?")
+        print("'oldest_open_receipt_date' column, index and triggers created (v12).")
+    except sqlite3.Error as e:
+        print(f"Error adding oldest open receipt date (v12): {e}")
+        raise e
+
+
+def apply_schema_v13(conn, current_version):
+    """Applies changes for SQL-side item age filtering and sorting (Schema v13)."""
+    print("Applying schema version 13 (Adding part type / date received index on inventory_items)...")
+    try:
+        # Serves the per-part-type item list when it is filtered or sorted on age (date_received).
+        run_migration_task(conn, 13, 'idx_invitem_parttype_received', lambda cursor: cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invitem_parttype_received ON inventory_items (part_type_id, date_received);"))
+        print("Index 'idx_invitem_parttype_received' created (v13).")
+    except sqlite3.Error as e:
+        print(f"Error adding item age index (v13): {e}")
+        raise e
+
+
+def apply_schema_v14(conn, current_version):
+    """Applies changes for the item -> booking lookup used by item lists and exports (Schema v14)."""
+    print("Applying schema version 14 (Adding inventory_item_id index on booking_parts_used)...")
+    try:
+        # idx_bpu_booking_item leads with booking_id; joins from inventory_items fell back to an automatic index,
+        # and an ORDER BY i.id export had to sort the whole result before sending the first row.
+        run_migration_task(conn, 14, 'idx_bpu_item', lambda cursor: cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_bpu_item ON booking_parts_used (inventory_item_id);"))
+        print("Index 'idx_bpu_item' created (v14).")
+    except sqlite3.Error as e:
+        print(f"Error adding booking parts item index (v14): {e}")
+        raise e
+
+
+def apply_schema_v15(conn, current_version):
+    """Applies changes for FIFO reservation of Available units per part type (Schema v15)."""
+    print("Applying schema version 15 (Adding partial FIFO index of Available inventory_items)...")
+    try:
+        # Oldest Available unit of a part type = first entry of (part_type_id, date_received, rowid); only Available rows are indexed.
+        run_migration_task(conn, 15, 'idx_invitem_available_fifo', lambda cursor: cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invitem_available_fifo ON inventory_items (part_type_id, date_received) WHERE status = 'Available';"))
+        print("Index 'idx_invitem_available_fifo' created (v15).")
+    except sqlite3.Error as e:
+        print(f"Error adding FIFO index (v15): {e}")
+        raise e
+
+
+# Each index is matched to the app.py queries it serves; check_query_plans.py verifies the plans on a generated database.
+SCHEMA_V16_INDEXES = [
+    # Stock aging report and the oldest_open_receipt_date triggers: only open units are indexed, and every column the
+    # queries read (status included) is in the index, so neither touches the inventory_items table.
+    ('idx_invitem_open_receipt', "inventory_items (part_type_id, stock_order_line_id, date_received, status) WHERE status IN ('Available', 'Reserved')"),
+    # Batch status updates by stock order number (stock_order_line_id IN ...) and FK checks when order lines change.
+    ('idx_invitem_order_line', "inventory_items (stock_order_line_id)"),
+    # stock_order_lines.part_id was only the second column of idx_line_order_part; serves part type -> order line lookups.
+    ('idx_line_part', "stock_order_lines (part_id)"),
+    # Part types overview keyset order (brand, model, part_name, id) and the receive forms' part lists, without a sort step.
+    # Replaces idx_pt_brand_model, of which it is a superset.
+    ('idx_pt_brand_model_name', "part_types (brand, model, part_name)"),
+    # Model filter facet (SELECT DISTINCT model ... ORDER BY model).
+    ('idx_pt_model', "part_types (model)"),
+    # Device model typeahead rebuild (GROUP BY device_model over all bookings) as a covering index scan.
+    ('idx_booking_device_model', "bookings (device_model)"),
+    # Created by v7/v8 only when they added the column, so databases that already had it lack them;
+    # receive_stock_fast looks part types up by part_number OR artikelnummer.
+    ('idx_pt_artikelnummer', "part_types (artikelnummer)"),
+    ('idx_booking_zir_reference', "bookings (zir_reference)"),
+]
+
+def apply_schema_v16(conn, current_version):
+    """Applies the index overhaul matched to the app's query plans, then refreshes planner statistics (Schema v16)."""
+    print("Applying schema version 16 (Covering, partial and repaired indexes; ANALYZE)...")
+    try:
+        # One task (and transaction) per index: the write lock is held for one index build at a time.
+        for index_name, index_definition in SCHEMA_V16_INDEXES:
+            run_migration_task(conn, 16, index_name, lambda cursor: cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {index_definition};"))
+            print(f"Index '{index_name}' created (v16).")
+        run_migration_task(conn, 16, 'drop_idx_pt_brand_model', lambda cursor: cursor.execute("DROP INDEX IF EXISTS idx_pt_brand_model;"))
+        print("Index 'idx_pt_brand_model' dropped, superseded by 'idx_pt_brand_model_name' (v16).")
+        # Without statistics the planner guesses selectivity, e.g. prefers idx_invitem_parttype_status over the partial index.
+        # analysis_limit samples each index instead of reading it whole (2s -> 30ms at 2M items, same query plans).
+        conn.execute("PRAGMA analysis_limit = 1000")
+        run_migration_task(conn, 16, 'analyze', lambda cursor: cursor.execute("ANALYZE;"))
+        print("Planner statistics refreshed with ANALYZE (v16).")
+    except sqlite3.Error as e:
+        print(f"Error applying index overhaul (v16): {e}")
+        raise e
+
+
+# Registered schema versions, in order: (version, function applying it). A new version appends its entry here.
+SCHEMA_MIGRATIONS = [
+    (6, apply_schema_v6),
+    (7, apply_schema_v7),
+    (8, apply_schema_v8),
+    (9, apply_schema_v9),
+    (10, apply_schema_v10),
+    (11, apply_schema_v11),
+    (12, apply_schema_v12),
+    (13, apply_schema_v13),
+    (14, apply_schema_v14),
+    (15, apply_schema_v15),
+    (16, apply_schema_v16),
+]
+
 # --- Main Initialization Function ---
 def init_db():
-    """Initializes or updates the database schema sequentially."""
+    """Initializes or updates the database schema, one registered version (and one task) at a time."""
     print(f"--- Database Setup Start (DB: {DATABASE}) ---")
     if not os.path.exists(DATABASE):
         print(f"Database file '{DATABASE}' not found, will be created.")
@@ -254,40 +755,30 @@ def init_db():
             print("Database schema is already up to date or newer.")
             return
 
+        conn.isolation_level = None # Transactions are explicit: each migration task and batch commits on its own
         cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode = WAL") # Readers (the running app) never wait for a migration batch
+        cursor.execute(f"PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT_MS}")
         original_fk_setting = cursor.execute("PRAGMA foreign_keys").fetchone()[0]
         if original_fk_setting == 1 : cursor.execute("PRAGMA foreign_keys = OFF")
+        create_migration_progress_table(cursor)
 
-        cursor.execute("BEGIN TRANSACTION")
-        print("BEGIN schema migration transaction.")
         try:
             # --- Apply Necessary Schema Updates Sequentially ---
-            if current_version < 6:
-                print(f"Attempting upgrade from version {current_version} to 6...")
-                current_version = apply_schema_v6(cursor, conn, current_version)
-
-            if current_version == 6 and DB_SCHEMA_VERSION >= 7:
-                 print(f"Attempting upgrade from version {current_version} to 7...")
-                 current_version = apply_schema_v7(cursor, conn, current_version)
-
-            if current_version == 7 and DB_SCHEMA_VERSION >= 8:
-                 print(f"Attempting upgrade from version {current_version} to 8...")
-                 current_version = apply_schema_v8(cursor, conn, current_version)
-
-            # Add future 'if current_version < 9:' blocks here
-
-            # --- Commit or Rollback ---
-            if current_version == DB_SCHEMA_VERSION:
-                cursor.execute("COMMIT")
-                print("Schema migration transaction COMMITTED.")
-            else:
-                print(f"Migration did not reach target version ({DB_SCHEMA_VERSION}). Actual: {current_version}. Rolling back.")
-                cursor.execute("ROLLBACK")
+            for version, apply_schema in SCHEMA_MIGRATIONS:
+                if version <= current_version or version > DB_SCHEMA_VERSION: continue
+                if cursor.execute("SELECT 1 FROM schema_migration_progress WHERE version = ? LIMIT 1", (version,)).fetchone():
+                    print(f"Resuming interrupted upgrade from version {current_version} to {version}...")
+                else:
+                    print(f"Attempting upgrade from version {current_version} to {version}...")
+                apply_schema(conn, current_version)
+                finish_migration(conn, version)
+                current_version = version
+                print(f"Schema version set to {version}.")
 
         except Exception as e:
-            print(f"!!! Schema migration FAILED: {e}")
-            print("!!! Rolling back schema changes.")
-            cursor.execute("ROLLBACK")
+            print(f"!!! Schema migration FAILED after version {current_version}: {e}")
+            print("!!! Finished steps are kept; run database_setup.py again to resume from the last checkpoint.")
             raise # Re-raise exception to signal failure
 
         finally:
@@ -0,0 +1,123 @@
+# db_pool.py - Bounded, shared pool of tuned SQLite connections
+import sqlite3
+import sys
+import threading
+import time
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection became free within the checkout timeout."""
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection subclass handed out by the pool; sql_metrics subclasses it to time every statement."""
+
+class SQLiteConnectionPool:
+    """Hands out long-lived SQLite connections so statement and page caches survive between requests.
+
+    Connections are opened lazily up to max_size and shared between threads (one user at a
+    time). Every connection gets the configured PRAGMAs once, when it is opened. Rows come back
+    as plain tuples; repository.py wraps them in records.
+    """
+
+    def __init__(self, database, max_size=8, checkout_timeout=10.0, journal_mode='WAL', synchronous='NORMAL',
+                 busy_timeout_ms=5000, mmap_size=268435456, cache_size=-20000, temp_store='MEMORY', statement_cache_size=128,
+                 connection_factory=PooledConnection):
+        self.database = database
+        self.connection_factory = connection_factory # A PooledConnection subclass, e.g. sql_metrics' instrumented one
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.statement_cache_size = statement_cache_size # Prepared statements kept per connection (sqlite3's cached_statements)
+        self.pragmas = [
+            ('journal_mode', journal_mode), ('synchronous', synchronous), ('busy_timeout', busy_timeout_ms),
+            ('mmap_size', mmap_size), ('cache_size', cache_size), ('temp_store', temp_store), ('foreign_keys', 'ON'),
+        ]
+        self._idle = []
+        self._open_count = 0
+        self._cond = threading.Condition()
+        self._stats = {'checkouts': 0, 'hits': 0, 'misses': 0, 'waits': 0, 'wait_time_ms': 0.0,
+                       'timeouts': 0, 'health_check_failures': 0, 'closed': 0}
+
+    def _open_connection(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=self.connection_factory,
+                               cached_statements=self.statement_cache_size)
+        for pragma_name, pragma_value in self.pragmas:
+            conn.execute(f"PRAGMA {pragma_name} = {pragma_value}")
+        return conn
+
+    def open_unpooled(self):
+        """Opens a connection with the pool's PRAGMAs that the pool does not track (e.g. for a dedicated writer thread)."""
+        return self._open_connection()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            print(f"DB POOL: discarding unhealthy connection: {e}", file=sys.stderr)
+            return False
+
+    def _discard(self, conn):
+        try: conn.close()
+        except sqlite3.Error: pass
+        with self._cond:
+            self._open_count -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    def acquire(self):
+        """Returns a healthy connection, opening a new one or waiting for a free one if needed."""
+        with self._cond: self._stats['checkouts'] += 1
+        while True:
+            conn = None
+            with self._cond:
+                if not self._idle and self._open_count >= self.max_size:
+                    self._stats['waits'] += 1
+                    wait_start = time.perf_counter()
+                    got_free = self._cond.wait_for(lambda: self._idle or self._open_count < self.max_size, timeout=self.checkout_timeout)
+                    self._stats['wait_time_ms'] += (time.perf_counter() - wait_start) * 1000
+                    if not got_free:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(f"No database connection free within {self.checkout_timeout}s.")
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._stats['hits'] += 1
+                else:
+                    self._open_count += 1
+                    self._stats['misses'] += 1
+            if conn is None:
+                try:
+                    return self._open_connection()
+                except sqlite3.Error:
+                    with self._cond:
+                        self._open_count -= 1
+                        self._cond.notify()
+                    raise
+            if self._is_healthy(conn):
+                return conn
+            with self._cond: self._stats['health_check_failures'] += 1
+            self._discard(conn)
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything the request left open."""
+        try:
+            if conn.in_transaction: conn.rollback()
+        except sqlite3.Error as e:
+            print(f"DB POOL: rollback on release failed: {e}", file=sys.stderr)
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle: self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({'max_size': self.max_size, 'open': self._open_count, 'idle': len(self._idle),
+                          'in_use': self._open_count - len(self._idle)})
+        stats['hit_ratio'] = round(stats['hits'] / stats['checkouts'], 4) if stats['checkouts'] else None
+        stats['wait_time_ms'] = round(stats['wait_time_ms'], 3)
+        return stats
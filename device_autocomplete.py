@@ -0,0 +1,137 @@
+# device_autocomplete.py - In-memory prefix index of device models for booking form typeahead
+import bisect
+import heapq
+import sys
+import threading
+import time
+
+ALL_BRANDS = '' # Index key holding every model, used when no brand is given
+
+def normalize_model(text):
+    """Lower-cases text and collapses whitespace; index keys and query prefixes both go through this."""
+    return ' '.join((text or '').lower().split())
+
+class DeviceModelIndex:
+    """Sorted, per-brand lists of distinct device models with how often each was booked.
+
+    Models come from part_types.model (per part_types.brand) and bookings.device_model. Bookings
+    have no brand column, so a device_model that starts with a known brand ("Apple iPhone 11")
+    is filed under that brand without the brand word; the rest only go under ALL_BRANDS.
+    In-process writes are applied incrementally (record_booking, record_part_type); changes
+    made elsewhere (e.g. import_from_csv.py) are picked up by a full rebuild once the index is
+    older than max_age_seconds. That rebuild runs on a background thread with a connection from
+    connect(), so callers keep getting suggestions from the current index meanwhile.
+    """
+
+    def __init__(self, max_age_seconds=300, connect=None):
+        self.max_age_seconds = max_age_seconds
+        self.connect = connect # Opens a connection for background refreshes; without it they run on the caller's connection
+        self._keys = {}    # brand key -> sorted list of normalized models
+        self._entries = {} # (brand key, normalized model) -> {'model': display text, 'uses': booking count}
+        self._brands = {}  # normalized brand -> display brand
+        self._loaded_at = None
+        self._refreshing = False # A background rebuild is running
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock() # Only one caller does the first, blocking load
+        self._stats = {'queries': 0, 'rebuilds': 0, 'incremental_updates': 0, 'failed_refreshes': 0, 'last_rebuild_ms': None}
+
+    def _add(self, keys, entries, brand_key, model, uses, keep_sorted=True):
+        model_key = normalize_model(model)
+        if not model_key: return
+        entry = entries.get((brand_key, model_key))
+        if entry is None:
+            entries[(brand_key, model_key)] = {'model': ' '.join(model.split()), 'uses': uses}
+            if keep_sorted: bisect.insort(keys.setdefault(brand_key, []), model_key)
+            else: keys.setdefault(brand_key, []).append(model_key) # rebuild() sorts each list once at the end
+        else:
+            entry['uses'] += uses
+
+    def _split_brand(self, brands, device_model):
+        """Returns (brand key, model without the brand word) when device_model starts with a known brand."""
+        model_key = normalize_model(device_model)
+        for brand_key in brands:
+            if model_key.startswith(brand_key + ' '):
+                return brand_key, ' '.join(device_model.split())[len(brand_key) + 1:]
+        return None, device_model
+
+    def _add_model(self, keys, entries, brands, brand, model, uses, keep_sorted=True):
+        brand_key = normalize_model(brand)
+        if brand_key:
+            brands.setdefault(brand_key, ' '.join(brand.split()))
+        else:
+            brand_key, model = self._split_brand(brands, model)
+        self._add(keys, entries, ALL_BRANDS, model, uses, keep_sorted)
+        if brand_key: self._add(keys, entries, brand_key, model, uses, keep_sorted)
+
+    def rebuild(self, conn):
+        """Reloads the whole index from the database (two aggregate queries)."""
+        start = time.perf_counter()
+        keys = {}; entries = {}; brands = {}
+        for brand, model in conn.execute("SELECT DISTINCT brand, model FROM part_types WHERE model IS NOT NULL AND model != ''"):
+            self._add_model(keys, entries, brands, brand, model, 0, keep_sorted=False)
+        for device_model, uses in conn.execute("SELECT device_model, COUNT(*) FROM bookings WHERE device_model IS NOT NULL AND device_model != '' GROUP BY device_model"):
+            self._add_model(keys, entries, brands, None, device_model, uses, keep_sorted=False)
+        for models in keys.values(): models.sort()
+        with self._lock:
+            self._keys, self._entries, self._brands = keys, entries, brands
+            self._loaded_at = time.monotonic()
+            self._stats['rebuilds'] += 1
+            self._stats['last_rebuild_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+    def ensure_fresh(self, conn):
+        """Loads the index on first use (on conn); later refreshes happen in the background once it is too old."""
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None: self.rebuild(conn)
+            return
+        if time.monotonic() - self._loaded_at <= self.max_age_seconds: return
+        if self.connect is None: self.rebuild(conn); return
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='device-model-index-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            conn = self.connect()
+            try: self.rebuild(conn)
+            finally: conn.close()
+        except Exception as e: # The current index stays in use; the next ensure_fresh() tries again
+            print(f"DEVICE MODEL INDEX: refresh failed: {e}", file=sys.stderr)
+            with self._lock: self._stats['failed_refreshes'] += 1
+        finally:
+            with self._lock: self._refreshing = False
+
+    def record_booking(self, device_model):
+        """Counts one more booking of device_model."""
+        with self._lock:
+            if self._loaded_at is None: return # Not loaded yet; the first rebuild will see the booking
+            self._add_model(self._keys, self._entries, self._brands, None, device_model, 1)
+            self._stats['incremental_updates'] += 1
+
+    def record_part_type(self, brand, model):
+        """Makes a new or renamed part type model suggestible (renamed-away models leave at the next rebuild)."""
+        with self._lock:
+            if self._loaded_at is None: return
+            self._add_model(self._keys, self._entries, self._brands, brand, model, 0)
+            self._stats['incremental_updates'] += 1
+
+    def suggest(self, prefix, brand=None, limit=10):
+        """Returns up to limit models starting with prefix, most booked first (ties alphabetically)."""
+        prefix_key = normalize_model(prefix); brand_key = normalize_model(brand) or ALL_BRANDS
+        with self._lock:
+            self._stats['queries'] += 1
+            keys = self._keys.get(brand_key, [])
+            start = bisect.bisect_left(keys, prefix_key)
+            end = bisect.bisect_left(keys, prefix_key + '\uffff', lo=start) # Every key with the prefix sorts before this
+            matches = [self._entries[(brand_key, model_key)] for model_key in keys[start:end]]
+            brand_display = self._brands.get(brand_key) if brand_key else None
+        top = heapq.nsmallest(limit, matches, key=lambda entry: (-entry['uses'], entry['model'].lower()))
+        return [{'model': entry['model'], 'brand': brand_display, 'uses': entry['uses']} for entry in top]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['brands'] = len(self._brands); stats['models'] = len(self._keys.get(ALL_BRANDS, []))
+            stats['age_seconds'] = round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None
+        return stats
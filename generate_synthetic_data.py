@@ -0,0 +1,215 @@
+# generate_synthetic_data.py - Fills an inventory database with deterministic, realistic-looking test data
+import argparse
+import bisect
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import database_setup
+
+# Volumes per --scale preset: (part types, inventory items, bookings)
+SCALES = {
+    'small': (500, 20000, 5000),
+    'medium': (5000, 200000, 50000),
+    'large': (50000, 2000000, 500000),
+}
+DEFAULT_ANCHOR_DATE = '2025-06-01' # "Now" for the generated dates; fixed so the same seed always gives the same database
+HISTORY_DAYS = 3 * 365
+INSERT_BATCH_SIZE = 10000
+
+BRAND_MODELS = {
+    'Apple': [f'IPHONE {n}' for n in ('X', 'XR', 'XS', '11', '11 PRO', '11 PRO MAX', '12', '12 MINI', '12 PRO', '12 PRO MAX',
+                                      '13', '13 MINI', '13 PRO', '13 PRO MAX', '14', '14 PLUS', '14 PRO', '14 PRO MAX', '15', '15 PRO')]
+             + ['IPAD 9', 'IPAD AIR 4', 'IPAD PRO 11'],
+    'Samsung': [f'GALAXY {n}' for n in ('S20', 'S21', 'S21 FE', 'S22', 'S22 ULTRA', 'S23', 'S23 ULTRA', 'S24', 'A12', 'A13', 'A14',
+                                        'A15', 'A25', 'A33', 'A34', 'A52', 'A53', 'A54', 'Z FLIP 4', 'Z FOLD 4')],
+    'Google': [f'PIXEL {n}' for n in ('6', '6A', '7', '7A', '7 PRO', '8', '8 PRO')],
+    'OnePlus': ['9', '9 PRO', '10 PRO', '11', 'NORD 2', 'NORD CE 3'],
+    'Xiaomi': ['REDMI NOTE 11', 'REDMI NOTE 12', 'REDMI NOTE 13', '13T', 'POCO X5'],
+    'Motorola': ['MOTO G54', 'MOTO G84', 'EDGE 40'],
+}
+BRAND_WEIGHTS = {'Apple': 45, 'Samsung': 35, 'Google': 7, 'OnePlus': 5, 'Xiaomi': 5, 'Motorola': 3}
+CATEGORY_WEIGHTS = {'Screen': 30, 'Battery': 25, 'Back Cover': 12, 'Charging Port': 10, 'Camera': 8, 'Adhesive': 7,
+                    'Small Parts': 5, 'Tools': 1, 'Other': 2}
+CATEGORY_VARIANTS = {
+    'Screen': ['LCD Display + Touchscreen - Refurbished', 'OLED Display - OEM', 'Soft OLED Display - Premium', 'Incell LCD - Aftermarket'],
+    'Battery': ['Battery - OEM', 'Battery - High Capacity', 'Battery - Aftermarket'],
+    'Back Cover': ['Back Glass - Black', 'Back Glass - White', 'Back Cover incl. Frame'],
+    'Charging Port': ['Charging Port Flex Cable', 'USB-C Connector Board'],
+    'Camera': ['Rear Camera Module', 'Front Camera', 'Camera Lens Glass'],
+    'Adhesive': ['Display Adhesive Strip', 'Battery Adhesive Strip', 'Back Glass Adhesive'],
+    'Small Parts': ['Screw Set', 'Earpiece Speaker', 'Loudspeaker', 'Vibration Motor'],
+    'Tools': ['Opening Tool Set', 'Screwdriver Set'],
+    'Other': ['SIM Tray', 'Power Button Flex'],
+}
+# Item status mix for recent and for older receipts (older stock has mostly been used up)
+ITEM_STATUS_WEIGHTS_RECENT = {'Available': 70, 'Reserved': 8, 'Installed': 17, 'Broken': 3, 'Returned': 2}
+ITEM_STATUS_WEIGHTS_OLD = {'Available': 25, 'Reserved': 2, 'Installed': 62, 'Broken': 7, 'Returned': 4}
+OLD_RECEIPT_DAYS = 120
+# Booking status mix for open (recent) and for settled (older) bookings
+BOOKING_STATUS_WEIGHTS_RECENT = {'Booked In': 30, 'In Progress': 25, 'Awaiting Part': 20, 'Ready for Collection': 15, 'Completed': 8, 'Cancelled': 2}
+BOOKING_STATUS_WEIGHTS_OLD = {'Completed': 92, 'Cancelled': 6, 'Ready for Collection': 2}
+OPEN_BOOKING_DAYS = 30
+REPORTED_ISSUES = ['scherm kapot', 'accu vervangen', 'laadt niet op', 'camera werkt niet', 'achterkant gebroken',
+                   'geen geluid', 'waterschade', 'touch reageert niet', 'start niet op', 'knop defect']
+FIRST_NAMES = ['Jan', 'Piet', 'Sanne', 'Emma', 'Daan', 'Lotte', 'Sem', 'Julia', 'Lucas', 'Noah', 'Tess', 'Fleur', 'Mila', 'Finn',
+               'Anna', 'Bram', 'Lisa', 'Thijs', 'Eva', 'Ruben', 'Sophie', 'Milan', 'Zoë', 'Levi', 'Nina', 'Jesse', 'Iris', 'Luuk']
+LAST_NAMES = ['de Jong', 'Jansen', 'de Vries', 'van den Berg', 'van Dijk', 'Bakker', 'Janssen', 'Visser', 'Smit', 'Meijer',
+              'de Boer', 'Mulder', 'de Groot', 'Bos', 'Vos', 'Peters', 'Hendriks', 'van Leeuwen', 'Dekker', 'Brouwer']
+
+class WeightedChoice:
+    """rng-driven weighted pick in O(log n), for the large loops where random.choices() per call is too slow."""
+    def __init__(self, values, weights):
+        self.values = list(values); self.cumulative = []
+        total = 0
+        for weight in weights: total += weight; self.cumulative.append(total)
+        self.total = total
+    def pick(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+def timestamp(anchor, days_ago, rng):
+    moment = anchor - datetime.timedelta(days=days_ago, seconds=rng.randrange(86400))
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def batched(rows, size=INSERT_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size: yield batch; batch = []
+    if batch: yield batch
+
+def generate_part_types(rng, count, first_id, anchor):
+    brands = WeightedChoice(BRAND_WEIGHTS, BRAND_WEIGHTS.values())
+    categories = WeightedChoice(CATEGORY_WEIGHTS, CATEGORY_WEIGHTS.values())
+    for n in range(count):
+        part_type_id = first_id + n
+        brand = brands.pick(rng); model = rng.choice(BRAND_MODELS[brand]); category = categories.pick(rng)
+        variant = rng.choice(CATEGORY_VARIANTS[category])
+        part_name = f"{brand} {model.title()} {variant} #{part_type_id}"
+        yield (part_type_id, part_name, f"SYN{part_type_id:07d}", category, brand, model, round(rng.uniform(2, 180), 2),
+               f"{rng.choice('ABCDEFGH')}{rng.randint(1, 40):02d}-{rng.randint(1, 8)}", None, f"{2000000 + part_type_id}",
+               timestamp(anchor, HISTORY_DAYS + rng.randrange(90), rng))
+
+def generate_bookings(rng, count, first_id, anchor, device_models, open_ids, completed_ids):
+    statuses_recent = WeightedChoice(BOOKING_STATUS_WEIGHTS_RECENT, BOOKING_STATUS_WEIGHTS_RECENT.values())
+    statuses_old = WeightedChoice(BOOKING_STATUS_WEIGHTS_OLD, BOOKING_STATUS_WEIGHTS_OLD.values())
+    for n in range(count):
+        booking_id = first_id + n
+        days_ago = int(HISTORY_DAYS * (1 - n / count)) # Ids grow with the booking date, as in real use
+        status = (statuses_recent if days_ago < OPEN_BOOKING_DAYS else statuses_old).pick(rng)
+        if status == 'Completed': completed_ids.append(booking_id)
+        elif status != 'Cancelled': open_ids.append(booking_id)
+        booked_at = timestamp(anchor, days_ago, rng)
+        yield (booking_id, booked_at, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"06{rng.randrange(10**8):08d}",
+               rng.choice(device_models), f"SN{rng.randrange(10**10):010d}" if rng.random() < 0.6 else None,
+               f"#{rng.randrange(10**6)}" if rng.random() < 0.7 else None, rng.choice(REPORTED_ISSUES), status,
+               None, booked_at, f"zir{rng.randrange(10**7):07d}" if rng.random() < 0.3 else None)
+
+def plan_stock(rng, item_count, part_type_ids, anchor, first_order_id, first_line_id):
+    """Returns (orders, lines) receiving item_count units; lines carry their order date and age for generate_items()."""
+    # Popular part types get most of the stock (roughly Zipf-distributed over a shuffled order).
+    popularity = list(part_type_ids); rng.shuffle(popularity)
+    part_types = WeightedChoice(popularity, [1 / (rank + 1) for rank in range(len(popularity))])
+    orders, lines = [], []
+    items_left = item_count; order_id = first_order_id; line_id = first_line_id
+    order_count = max(1, item_count // 250)
+    while items_left > 0:
+        order_no = order_id - first_order_id
+        days_ago = int(HISTORY_DAYS * (1 - min(order_no, order_count - 1) / order_count))
+        order_date = timestamp(anchor, days_ago, rng)
+        orders.append((order_id, f"SO-{order_id:07d}", order_date, None))
+        for _ in range(rng.randint(3, 15)):
+            if items_left <= 0: break
+            qty = min(items_left, rng.randint(1, 50)); items_left -= qty
+            lines.append((line_id, order_id, part_types.pick(rng), qty, round(rng.uniform(2, 150), 2), order_date, days_ago))
+            line_id += 1
+        order_id += 1
+    return orders, lines
+
+def generate_items(rng, lines, first_item_id, open_booking_ids, completed_booking_ids, booking_parts):
+    """Yields the inventory item rows of the planned lines; Installed/Reserved units are linked to bookings in booking_parts."""
+    statuses_recent = WeightedChoice(ITEM_STATUS_WEIGHTS_RECENT, ITEM_STATUS_WEIGHTS_RECENT.values())
+    statuses_old = WeightedChoice(ITEM_STATUS_WEIGHTS_OLD, ITEM_STATUS_WEIGHTS_OLD.values())
+    item_id = first_item_id
+    for line_id, _order_id, part_type_id, qty, _cost, order_date, days_ago in lines:
+        statuses = statuses_old if days_ago > OLD_RECEIPT_DAYS else statuses_recent
+        for _ in range(qty):
+            status = statuses.pick(rng)
+            if status == 'Installed' and completed_booking_ids: booking_parts.append((rng.choice(completed_booking_ids), item_id, order_date))
+            elif status == 'Reserved' and open_booking_ids: booking_parts.append((rng.choice(open_booking_ids), item_id, order_date))
+            yield (item_id, part_type_id, None, status, line_id, None, order_date, order_date, None)
+            item_id += 1
+
+def next_id(cursor, table):
+    return (cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]) + 1
+
+def generate(database, part_type_count, item_count, booking_count, seed=42, anchor_date=DEFAULT_ANCHOR_DATE):
+    """Appends the requested volumes to database (schema v8 or later; newer summary/FTS tables follow via their triggers)."""
+    rng = random.Random(seed)
+    anchor = datetime.datetime.strptime(anchor_date, '%Y-%m-%d')
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA journal_mode = WAL"); conn.execute("PRAGMA synchronous = OFF"); conn.execute("PRAGMA cache_size = -200000")
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    try:
+        cursor.execute("BEGIN")
+        first_part_type_id = next_id(cursor, 'part_types')
+        for batch in batched(generate_part_types(rng, part_type_count, first_part_type_id, anchor)):
+            cursor.executemany("""INSERT INTO part_types (id, part_name, part_number, part_type, brand, model, cost_price,
+                                  storage_location, description, artikelnummer, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)""", batch)
+        print(f"  {part_type_count} part types ({time.perf_counter() - started:.1f}s)")
+        device_models = [f"{brand} {model}" for brand, models in BRAND_MODELS.items() for model in models]
+        open_booking_ids, completed_booking_ids = [], []
+        for batch in batched(generate_bookings(rng, booking_count, next_id(cursor, 'bookings'), anchor, device_models, open_booking_ids, completed_booking_ids)):
+            cursor.executemany("""INSERT INTO bookings (id, booking_date, customer_name, customer_phone, device_model, device_serial,
+                                  gpc_number, reported_issue, status, notes, last_updated, zir_reference) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""", batch)
+        print(f"  {booking_count} bookings ({time.perf_counter() - started:.1f}s)")
+        part_type_ids = range(first_part_type_id, first_part_type_id + part_type_count)
+        orders, lines = plan_stock(rng, item_count, part_type_ids, anchor, next_id(cursor, 'stock_orders'), next_id(cursor, 'stock_order_lines'))
+        # Orders and lines go in first: the receipt-date triggers on inventory_items look up the order date.
+        cursor.executemany("INSERT INTO stock_orders (id, order_number, order_date, notes) VALUES (?,?,?,?)", orders)
+        cursor.executemany("INSERT INTO stock_order_lines (id, stock_order_id, part_id, quantity_received, cost_price_per_unit) VALUES (?,?,?,?,?)",
+                           (line[:5] for line in lines))
+        booking_parts = []
+        items = generate_items(rng, lines, next_id(cursor, 'inventory_items'), open_booking_ids, completed_booking_ids, booking_parts)
+        for batch in batched(items):
+            cursor.executemany("""INSERT INTO inventory_items (id, part_type_id, serial_number, status, stock_order_line_id,
+                                  current_location, date_received, last_updated, notes) VALUES (?,?,?,?,?,?,?,?,?)""", batch)
+        cursor.executemany("INSERT INTO booking_parts_used (booking_id, inventory_item_id, date_assigned) VALUES (?,?,?)", booking_parts)
+        print(f"  {item_count} inventory items in {len(orders)} stock orders / {len(lines)} lines, {len(booking_parts)} booking parts ({time.perf_counter() - started:.1f}s)")
+        conn.commit()
+        conn.execute("ANALYZE")
+    except sqlite3.Error:
+        conn.rollback(); raise
+    finally:
+        conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill an inventory database with deterministic synthetic data.")
+    parser.add_argument('--db', default='synthetic_inventory.db', help="Database to fill; created with database_setup.py if missing")
+    parser.add_argument('--scale', choices=SCALES, default='small', help="Volume preset (part types / items / bookings): " +
+                        ", ".join(f"{name}={p}/{i}/{b}" for name, (p, i, b) in SCALES.items()))
+    parser.add_argument('--part-types', type=int, help="Override the preset number of part types")
+    parser.add_argument('--items', type=int, help="Override the preset number of inventory items")
+    parser.add_argument('--bookings', type=int, help="Override the preset number of bookings")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--anchor-date', default=DEFAULT_ANCHOR_DATE, help="YYYY-MM-DD treated as 'now' for the generated dates")
+    args = parser.parse_args()
+    part_type_count, item_count, booking_count = SCALES[args.scale]
+    part_type_count = args.part_types if args.part_types is not None else part_type_count
+    item_count = args.items if args.items is not None else item_count
+    booking_count = args.bookings if args.bookings is not None else booking_count
+    if os.path.abspath(args.db) == os.path.abspath(database_setup.DATABASE):
+        print(f"Refusing to fill the live database '{args.db}'; pass another --db.", file=sys.stderr); sys.exit(1)
+    if not os.path.exists(args.db):
+        database_setup.DATABASE = args.db
+        database_setup.init_db()
+    print(f"Generating {part_type_count} part types, {item_count} items, {booking_count} bookings into '{args.db}' (seed {args.seed})...")
+    generate(args.db, part_type_count, item_count, booking_count, seed=args.seed, anchor_date=args.anchor_date)
+
+if __name__ == '__main__':
+    main()
@@ -1,127 +1,343 @@
 import sqlite3
 import csv
+import sys
+import time
+import codecs
+import datetime
+import argparse
 
 DATABASE_NAME = 'inventory.db'
 CSV_FILE_NAME = 'Voorraad lijst - Sheet1.csv' # Make sure this file is in the same directory as the script
+IMPORT_BATCH_SIZE = 5000 # CSV rows per executemany()/commit batch
+ENCODING_SAMPLE_BYTES = 64 * 1024
+# Tried in order on the sample; utf-8 is strict enough to rule itself out, latin-1 accepts any byte.
+ENCODING_CANDIDATES = ['utf-8-sig', 'windows-1252', 'latin-1']
+MAX_REPORTED_FAILURES = 20 # Failed rows listed individually in the summary; the rest are only counted
 
-def import_part_types_from_csv(db_name, csv_file_path):
+INSERT_PART_TYPE_SQL = """
+INSERT INTO part_types
+(part_name, part_number, artikelnummer, part_type, brand, model)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+STOCKTAKE_SURPLUS_STATUSES = ['Broken', 'Returned'] # Status given to Available units that were not found in the count
+MAX_REPORTED_DIFFERENCES = 50 # Part types listed individually in the stocktake diff report
+
+UPSERT_COLUMNS = ('part_name', 'part_type', 'brand', 'model')
+UPDATE_PART_TYPE_SQL = "UPDATE part_types SET part_name = ?, part_type = ?, brand = ?, model = ? WHERE id = ?"
+
+def detect_encoding(csv_file_path, sample_size=ENCODING_SAMPLE_BYTES):
+    """Returns the first ENCODING_CANDIDATES entry that decodes the start of the file."""
+    with open(csv_file_path, mode='rb') as raw_file:
+        sample = raw_file.read(sample_size)
+    for encoding in ENCODING_CANDIDATES:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False) # A multi-byte char may be cut off at the end of the sample
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return ENCODING_CANDIDATES[-1]
+
+def load_existing_part_types(cursor):
+    """Returns ({artikelnummer: part}, {part_number: part}) for every part type already in the database."""
+    by_artikelnummer = {}; by_part_number = {}
+    cursor.execute("SELECT id, part_name, part_number, artikelnummer, part_type, brand, model FROM part_types WHERE artikelnummer IS NOT NULL OR part_number IS NOT NULL")
+    for row in cursor.fetchall():
+        part = {'id': row[0], 'part_name': row[1], 'part_type': row[4], 'brand': row[5], 'model': row[6]}
+        if row[3]: by_artikelnummer.setdefault(row[3], part)
+        if row[2]: by_part_number.setdefault(row[2], part)
+    return by_artikelnummer, by_part_number
+
+def parse_csv_row(row):
+    """Returns (values, None) for a usable CSV row or (None, reason) for one that has to be skipped."""
+    artikelnummer = (row.get('Artikelnummer') or '').strip()
+    gpcid = (row.get('GPCID') or '').strip()
+    phone_type = (row.get('Phone Type') or '').strip()
+    # Aantal is ignored for part_types
+    soort = (row.get('Soort') or '').strip()
+    merk = (row.get('Merk') or '').strip()
+
+    # Validate essential fields
+    if not artikelnummer and not gpcid: # At least one unique ID should be present
+        return None, "missing Artikelnummer and GPCID"
+    if not phone_type or not soort or not merk:
+        return None, "missing Phone Type, Soort, or Merk"
+    return {'part_name': f"{merk} {phone_type} {soort}", 'part_number': gpcid or None, 'artikelnummer': artikelnummer or None,
+            'part_type': soort, 'brand': merk, 'model': phone_type}, None
+
+def import_part_types_from_csv(db_name, csv_file_path, batch_size=IMPORT_BATCH_SIZE, upsert=False):
+    """Imports part types from a supplier CSV in batches and prints one summary report.
+
+    Rows whose Artikelnummer or GPCID already exists are skipped, or with upsert=True have
+    their part name, category, brand and model updated when those changed. Each batch is
+    written with executemany() and committed on its own. Returns the report dict.
+    """
+    report = {'rows_read': 0, 'inserted': 0, 'updated': 0, 'skipped_duplicates': 0, 'failed': 0,
+              'batches_committed': 0, 'encoding': None, 'failures': [], 'error': None}
     conn = None
-    inserted_count = 0
-    skipped_count = 0
-    failed_count = 0
+    start_time = time.perf_counter()
 
     try:
+        report['encoding'] = detect_encoding(csv_file_path)
         conn = sqlite3.connect(db_name)
         cursor = conn.cursor()
+        by_artikelnummer, by_part_number = load_existing_part_types(cursor)
+        pending_inserts = []; pending_updates = {} # part type id -> part dict with the new values
 
-        # Try opening with 'windows-1252' encoding
-        try:
-            csvfile = open(csv_file_path, mode='r', encoding='windows-1252')
-            print(f"Successfully opened '{csv_file_path}' with 'windows-1252' encoding.")
-        except UnicodeDecodeError:
-            # Fallback to 'latin-1' if 'windows-1252' also fails
-            print(f"Opening with 'windows-1252' failed. Trying 'latin-1'.")
-            csvfile.close() # Close the previous attempt
-            csvfile = open(csv_file_path, mode='r', encoding='latin-1')
-            print(f"Successfully opened '{csv_file_path}' with 'latin-1' encoding.")
-        except Exception as e_open:
-            # If other error occurs during open (like FileNotFoundError before encoding is an issue)
-            print(f"Error opening file '{csv_file_path}': {e_open}")
-            return
-
-
-        with csvfile: # Ensures the file is closed automatically
+        def flush_batch():
+            # pending_updates holds at most one UPDATE per part type, however often it repeats in the batch.
+            if pending_inserts:
+                cursor.executemany(INSERT_PART_TYPE_SQL, [(p['part_name'], p['part_number'], p['artikelnummer'], p['part_type'], p['brand'], p['model'])
+                                                          for p in pending_inserts])
+            if pending_updates:
+                cursor.executemany(UPDATE_PART_TYPE_SQL, [(p['part_name'], p['part_type'], p['brand'], p['model'], part_id)
+                                                          for part_id, p in pending_updates.items()])
+            conn.commit()
+            report['inserted'] += len(pending_inserts); report['updated'] += len(pending_updates); report['batches_committed'] += 1
+            pending_inserts.clear(); pending_updates.clear()
+
+        with open(csv_file_path, mode='r', encoding=report['encoding'], newline='') as csvfile:
             reader = csv.DictReader(csvfile)
+            rows_in_batch = 0
             for row_number, row in enumerate(reader, 1):
-                try:
-                    artikelnummer = row.get('Artikelnummer', '').strip()
-                    gpcid = row.get('GPCID', '').strip()
-                    phone_type = row.get('Phone Type', '').strip()
-                    # Aantal = row.get('Aantal', '').strip() # Ignored for part_types
-                    soort = row.get('Soort', '').strip()
-                    merk = row.get('Merk', '').strip()
-
-                    # Validate essential fields
-                    if not artikelnummer and not gpcid: # At least one unique ID should be present
-                        print(f"Row {row_number}: Skipping row due to missing Artikelnummer and GPCID. Data: {row}")
-                        failed_count += 1
-                        continue
-                    if not phone_type or not soort or not merk:
-                        print(f"Row {row_number}: Skipping row due to missing Phone Type, Soort, or Merk. Data: {row}")
-                        failed_count += 1
-                        continue
-                    
-                    # Construct part_name
-                    part_name = f"{merk} {phone_type} {soort}"
-
-                    check_sql = "SELECT id FROM part_types WHERE "
-                    check_params = []
-                    conditions = []
-
-                    if artikelnummer:
-                        conditions.append("artikelnummer = ?")
-                        check_params.append(artikelnummer)
-                    if gpcid:
-                        conditions.append("part_number = ?")
-                        check_params.append(gpcid)
-                    
-                    if not conditions: 
-                         print(f"Row {row_number}: Skipping due to no valid identifiers. Data: {row}")
-                         failed_count += 1
-                         continue
-
-                    check_sql += " OR ".join(conditions)
-                    
-                    cursor.execute(check_sql, tuple(check_params))
-                    existing_part = cursor.fetchone()
-
-                    if existing_part:
-                        print(f"Row {row_number}: Skipping duplicate. Artikelnummer '{artikelnummer}' or GPCID '{gpcid}' likely already exists.")
-                        skipped_count += 1
-                        continue
-
-                    insert_sql = """
-                    INSERT INTO part_types 
-                    (part_name, part_number, artikelnummer, part_type, brand, model)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """
-                    cursor.execute(insert_sql, (
-                        part_name,
-                        gpcid if gpcid else None,
-                        artikelnummer if artikelnummer else None,
-                        soort,
-                        merk,
-                        phone_type
-                    ))
-                    inserted_count += 1
-
-                except Exception as e:
-                    print(f"Row {row_number}: Failed to process row. Error: {e}. Data: {row}")
-                    failed_count += 1
-        
-        conn.commit()
-        print(f"\nImport from CSV complete.")
-        print(f"Successfully inserted: {inserted_count} new part types.")
-        print(f"Skipped (duplicates or existing): {skipped_count} part types.")
-        print(f"Failed (errors or missing essential data): {failed_count} part types.")
+                report['rows_read'] += 1; rows_in_batch += 1
+                part, reason = parse_csv_row(row)
+                if part is None:
+                    report['failed'] += 1
+                    if len(report['failures']) < MAX_REPORTED_FAILURES: report['failures'].append(f"Row {row_number}: {reason}. Data: {row}")
+                else:
+                    existing = by_artikelnummer.get(part['artikelnummer']) or by_part_number.get(part['part_number'])
+                    if existing is None:
+                        pending_inserts.append(part)
+                        if part['artikelnummer']: by_artikelnummer[part['artikelnummer']] = part
+                        if part['part_number']: by_part_number[part['part_number']] = part
+                    elif upsert and existing.get('id') is not None and any(existing[column] != part[column] for column in UPSERT_COLUMNS):
+                        for column in UPSERT_COLUMNS: existing[column] = part[column]
+                        pending_updates[existing['id']] = existing
+                    else: # Also repeated rows for a part type inserted earlier in this run: the first row wins
+                        report['skipped_duplicates'] += 1
+                if rows_in_batch >= batch_size:
+                    flush_batch(); rows_in_batch = 0
+            if rows_in_batch: flush_batch()
 
     except sqlite3.Error as e:
-        print(f"SQLite error during import: {e}")
+        report['error'] = f"SQLite error during import: {e}"
         if conn:
             conn.rollback()
     except FileNotFoundError:
-        print(f"Error: The file '{csv_file_path}' was not found.")
+        report['error'] = f"The file '{csv_file_path}' was not found."
     except UnicodeDecodeError as ude:
-        print(f"UnicodeDecodeError: Could not decode the file with 'windows-1252' or 'latin-1'. The file might be saved with a different encoding. Error: {ude}")
+        report['error'] = f"Could not decode the file as '{report['encoding']}' (detected from the first {ENCODING_SAMPLE_BYTES} bytes). Error: {ude}"
+        if conn:
+            conn.rollback()
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        report['error'] = f"An unexpected error occurred: {e}"
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+    report['elapsed_seconds'] = round(time.perf_counter() - start_time, 3)
+    print_import_report(report)
+    return report
+
+def print_import_report(report):
+    print(f"\nImport from CSV {'stopped' if report['error'] else 'complete'}.")
+    if report['error']:
+        print(f"Error: {report['error']} Batches committed before the error are kept.")
+    print(f"Encoding: {report['encoding'] or 'n/a'}")
+    print(f"Rows read: {report['rows_read']} in {report['elapsed_seconds']}s ({report['batches_committed']} batches committed).")
+    print(f"Successfully inserted: {report['inserted']} new part types.")
+    print(f"Updated (upsert of changed name/category/brand/model): {report['updated']} part types.")
+    print(f"Skipped (duplicates or existing): {report['skipped_duplicates']} part types.")
+    print(f"Failed (errors or missing essential data): {report['failed']} part types.")
+    for failure in report['failures']:
+        print(f"  {failure}")
+    if report['failed'] > len(report['failures']):
+        print(f"  ... and {report['failed'] - len(report['failures'])} more.")
+
+def load_stocktake_counts(cursor, csv_file_path, encoding, report, batch_size=IMPORT_BATCH_SIZE):
+    """Streams the counted quantities (Artikelnummer/GPCID + Aantal) into the temp table stocktake_counts."""
+    cursor.execute("DROP TABLE IF EXISTS temp.stocktake_counts")
+    cursor.execute("CREATE TEMP TABLE stocktake_counts (row_number INTEGER PRIMARY KEY, artikelnummer TEXT, part_number TEXT, counted INTEGER NOT NULL)")
+    batch = []
+    with open(csv_file_path, mode='r', encoding=encoding, newline='') as csvfile:
+        for row_number, row in enumerate(csv.DictReader(csvfile), 1):
+            report['rows_read'] += 1
+            artikelnummer = (row.get('Artikelnummer') or '').strip(); gpcid = (row.get('GPCID') or '').strip()
+            aantal = (row.get('Aantal') or '').strip()
+            reason = None
+            if not artikelnummer and not gpcid: reason = "missing Artikelnummer and GPCID"
+            elif not aantal.isdigit(): reason = f"Aantal '{aantal}' is not a whole number of 0 or more"
+            if reason:
+                report['failed'] += 1
+                if len(report['failures']) < MAX_REPORTED_FAILURES: report['failures'].append(f"Row {row_number}: {reason}. Data: {row}")
+                continue
+            batch.append((row_number, artikelnummer or None, gpcid or None, int(aantal)))
+            if len(batch) >= batch_size:
+                cursor.executemany("INSERT INTO stocktake_counts VALUES (?, ?, ?, ?)", batch); batch.clear()
+    if batch: cursor.executemany("INSERT INTO stocktake_counts VALUES (?, ?, ?, ?)", batch)
+
+def build_stocktake_diff(cursor):
+    """Fills temp table stocktake_diff (counted vs. Available per part type) from stocktake_counts in one pass.
+
+    Rows are matched on Artikelnummer first, then GPCID, like the part type import. Several
+    rows for the same part type are added up. Part types that are not on the sheet are left alone.
+    """
+    cursor.execute("DROP TABLE IF EXISTS temp.stocktake_matches")
+    cursor.execute("""
+        CREATE TEMP TABLE stocktake_matches AS
+        SELECT c.row_number, c.counted, COALESCE(MIN(pt_a.id), MIN(pt_p.id)) AS part_type_id
+        FROM stocktake_counts c
+        LEFT JOIN part_types pt_a ON pt_a.artikelnummer = c.artikelnummer
+        LEFT JOIN part_types pt_p ON pt_p.part_number = c.part_number
+        GROUP BY c.row_number
+    """)
+    cursor.execute("DROP TABLE IF EXISTS temp.stocktake_diff")
+    # part_type_stock_summary keeps available_stock up to date, so no inventory_items scan is needed here.
+    cursor.execute("""
+        CREATE TEMP TABLE stocktake_diff AS
+        SELECT m.part_type_id, SUM(m.counted) AS counted, COALESCE(s.available_stock, 0) AS available,
+               SUM(m.counted) - COALESCE(s.available_stock, 0) AS difference,
+               pt.artikelnummer, pt.part_number, pt.part_name
+        FROM stocktake_matches m
+        JOIN part_types pt ON pt.id = m.part_type_id
+        LEFT JOIN part_type_stock_summary s ON s.part_type_id = m.part_type_id
+        GROUP BY m.part_type_id
+    """)
+    cursor.execute("SELECT row_number FROM stocktake_matches WHERE part_type_id IS NULL ORDER BY row_number")
+    return [row[0] for row in cursor.fetchall()]
+
+def apply_stocktake_corrections(cursor, csv_file_path, surplus_status):
+    """Books the stocktake_diff differences in bulk, in the caller's transaction.
+
+    Shortfalls in the system become new Available units on lines of one synthetic stock order;
+    for surpluses the oldest Available units of the part type get surplus_status.
+    Returns (stock_order_id or None, units_created, units_marked).
+    """
+    stock_order_id = None; units_created = 0
+    cursor.execute("SELECT COUNT(*) FROM stocktake_diff WHERE difference > 0")
+    if cursor.fetchone()[0]:
+        order_number = f"STOCKTAKE-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        cursor.execute("INSERT INTO stock_orders (order_number, notes, order_date) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                       (order_number, f"Stocktake correction from '{csv_file_path}'"))
+        stock_order_id = cursor.lastrowid
+        cursor.execute("""INSERT INTO stock_order_lines (stock_order_id, part_id, quantity_received)
+                          SELECT ?, part_type_id, difference FROM stocktake_diff WHERE difference > 0 ORDER BY part_type_id""", (stock_order_id,))
+        cursor.execute("""
+            INSERT INTO inventory_items (part_type_id, status, stock_order_line_id, date_received, last_updated, notes)
+            WITH RECURSIVE unit(line_id, part_type_id, n) AS (
+                SELECT id, part_id, quantity_received FROM stock_order_lines WHERE stock_order_id = ?
+                UNION ALL SELECT line_id, part_type_id, n - 1 FROM unit WHERE n > 1
+            )
+            SELECT part_type_id, 'Available', line_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 'Stocktake correction' FROM unit
+        """, (stock_order_id,))
+        units_created = cursor.rowcount
+    cursor.execute("""
+        UPDATE inventory_items SET status = ?, last_updated = CURRENT_TIMESTAMP,
+               notes = TRIM(COALESCE(notes, '') || ' Stocktake: not found in count.')
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT i.id, d.difference,
+                       ROW_NUMBER() OVER (PARTITION BY i.part_type_id ORDER BY i.date_received, i.id) AS unit_rank
+                FROM stocktake_diff d
+                JOIN inventory_items i ON i.part_type_id = d.part_type_id AND i.status = 'Available'
+                WHERE d.difference < 0
+            ) WHERE unit_rank <= -difference
+        )
+    """, (surplus_status,))
+    return stock_order_id, units_created, cursor.rowcount
+
+def stocktake_from_csv(db_name, csv_file_path, apply=False, surplus_status='Broken'):
+    """Compares the Aantal column of a count sheet with the Available units per part type.
+
+    Without apply this is a dry run: only the diff report is printed. With apply the
+    differences are booked (see apply_stocktake_corrections) in one transaction.
+    Returns the report dict.
+    """
+    report = {'rows_read': 0, 'failed': 0, 'failures': [], 'unmatched_rows': [], 'part_types_counted': 0,
+              'part_types_matching': 0, 'shortfalls': [], 'surpluses': [], 'applied': False, 'stock_order_id': None,
+              'units_created': 0, 'units_marked': 0, 'surplus_status': surplus_status, 'encoding': None, 'error': None}
+    if surplus_status not in STOCKTAKE_SURPLUS_STATUSES:
+        report['error'] = f"Invalid surplus status '{surplus_status}'. Use one of: {', '.join(STOCKTAKE_SURPLUS_STATUSES)}."
+        print_stocktake_report(report); return report
+    conn = None
+    start_time = time.perf_counter()
+    try:
+        report['encoding'] = detect_encoding(csv_file_path)
+        conn = sqlite3.connect(db_name)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE") # Counts and corrections see the same Available units
+        load_stocktake_counts(cursor, csv_file_path, report['encoding'], report)
+        report['unmatched_rows'] = build_stocktake_diff(cursor)
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(difference = 0), 0) FROM stocktake_diff")
+        report['part_types_counted'], report['part_types_matching'] = cursor.fetchone()
+        for key, condition in (('shortfalls', 'difference > 0 ORDER BY difference DESC'), ('surpluses', 'difference < 0 ORDER BY difference ASC')):
+            cursor.execute(f"SELECT part_type_id, artikelnummer, part_number, part_name, counted, available, difference FROM stocktake_diff WHERE {condition}")
+            report[key] = [dict(zip(('part_type_id', 'artikelnummer', 'part_number', 'part_name', 'counted', 'available', 'difference'), row))
+                           for row in cursor.fetchall()]
+        if apply:
+            report['stock_order_id'], report['units_created'], report['units_marked'] = apply_stocktake_corrections(cursor, csv_file_path, surplus_status)
+            conn.commit(); report['applied'] = True
+        else:
+            conn.rollback()
+    except sqlite3.Error as e:
+        report['error'] = f"SQLite error during stocktake: {e}"
+        if conn:
+            conn.rollback()
+    except FileNotFoundError:
+        report['error'] = f"The file '{csv_file_path}' was not found."
+    except UnicodeDecodeError as ude:
+        report['error'] = f"Could not decode the file as '{report['encoding']}'. Error: {ude}"
         if conn:
             conn.rollback()
     finally:
         if conn:
             conn.close()
 
+    report['elapsed_seconds'] = round(time.perf_counter() - start_time, 3)
+    print_stocktake_report(report)
+    return report
+
+def print_stocktake_report(report):
+    print(f"\nStocktake {'stopped' if report['error'] else ('applied' if report['applied'] else 'dry run (nothing changed)')}.")
+    if report['error']:
+        print(f"Error: {report['error']} Nothing was changed.")
+        return
+    print(f"Rows read: {report['rows_read']} in {report['elapsed_seconds']}s (encoding {report['encoding']}).")
+    print(f"Part types counted: {report['part_types_counted']}, matching: {report['part_types_matching']}, "
+          f"more counted than Available: {len(report['shortfalls'])}, fewer counted than Available: {len(report['surpluses'])}.")
+    for title, entries in (("Counted more than Available (units to create)", report['shortfalls']),
+                           (f"Counted fewer than Available (units to mark '{report['surplus_status']}')", report['surpluses'])):
+        if not entries: continue
+        print(f"{title}: {sum(abs(entry['difference']) for entry in entries)} units")
+        for entry in entries[:MAX_REPORTED_DIFFERENCES]:
+            print(f"  {entry['artikelnummer'] or '-'} / {entry['part_number'] or '-'} {entry['part_name']}: counted {entry['counted']}, Available {entry['available']} ({entry['difference']:+d})")
+        if len(entries) > MAX_REPORTED_DIFFERENCES:
+            print(f"  ... and {len(entries) - MAX_REPORTED_DIFFERENCES} more part types.")
+    if report['unmatched_rows']:
+        print(f"Rows without a known part type (ignored): {len(report['unmatched_rows'])}, e.g. rows {', '.join(map(str, report['unmatched_rows'][:10]))}.")
+    print(f"Failed (missing identifiers or invalid Aantal): {report['failed']} rows.")
+    for failure in report['failures']:
+        print(f"  {failure}")
+    if report['applied']:
+        print(f"Created {report['units_created']} units under stock order ID {report['stock_order_id']}; marked {report['units_marked']} units '{report['surplus_status']}'.")
+
 if __name__ == '__main__':
-    print(f"Attempting to import part types from '{CSV_FILE_NAME}' into '{DATABASE_NAME}'...")
+    parser = argparse.ArgumentParser(description="Import part types from, or run a stocktake against, a supplier CSV (Artikelnummer, GPCID, Phone Type, Aantal, Soort, Merk).")
+    parser.add_argument('csv_file', nargs='?', default=CSV_FILE_NAME)
+    parser.add_argument('--db', default=DATABASE_NAME)
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--upsert', action='store_true', help="Update name/category/brand/model of existing part types that changed.")
+    parser.add_argument('--stocktake', action='store_true', help="Compare the Aantal column with the Available units instead of importing part types (dry run).")
+    parser.add_argument('--apply', action='store_true', help="With --stocktake: book the differences.")
+    parser.add_argument('--surplus-status', default='Broken', choices=STOCKTAKE_SURPLUS_STATUSES, help="With --stocktake --apply: status for Available units missing from the count.")
+    args = parser.parse_args()
     # IMPORTANT: Backup your database (inventory.db) before running this script!
-    import_part_types_from_csv(DATABASE_NAME, CSV_FILE_NAME)
\ No newline at end of file
+    if args.stocktake:
+        print(f"Attempting stocktake from '{args.csv_file}' against '{args.db}'{'' if args.apply else ' (dry run)'}...")
+        result = stocktake_from_csv(args.db, args.csv_file, apply=args.apply, surplus_status=args.surplus_status)
+    else:
+        print(f"Attempting to import part types from '{args.csv_file}' into '{args.db}'...")
+        result = import_part_types_from_csv(args.db, args.csv_file, batch_size=max(1, args.batch_size), upsert=args.upsert)
+    sys.exit(1 if result['error'] else 0)
\ No newline at end of file
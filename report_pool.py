@@ -0,0 +1,153 @@
+# report_pool.py - Runs heavy read-only queries in worker processes on read-only snapshots
+import os
+import sqlite3
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+class ReportError(sqlite3.OperationalError):
+    """Raised when a report could not be produced by the worker pool."""
+
+class ReportTimeoutError(ReportError):
+    """Raised when a report ran longer than its timeout (the worker aborts the query itself)."""
+
+class ReportBusyError(ReportError):
+    """Raised when the cap on concurrently running reports stayed reached for the whole timeout."""
+
+_worker_connections = {} # Per worker process: database path -> read-only connection
+
+def _worker_connection(database, pragmas, statement_cache_size):
+    conn = _worker_connections.get(database)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True, isolation_level=None, cached_statements=statement_cache_size)
+        for pragma_name, pragma_value in pragmas:
+            conn.execute(f"PRAGMA {pragma_name} = {pragma_value}")
+        _worker_connections[database] = conn
+    return conn
+
+def run_report_queries(database, pragmas, queries, timeout_s, statement_cache_size=128):
+    """Worker side: runs [(sql, params)] in one read transaction; returns [(columns, rows, seconds)].
+
+    All queries see the same WAL snapshot, so e.g. a COUNT(*) and the page it belongs to agree.
+    A progress handler aborts the running statement once timeout_s has passed.
+    """
+    conn = _worker_connection(database, pragmas, statement_cache_size)
+    deadline = time.monotonic() + timeout_s
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+    results = []
+    conn.execute("BEGIN")
+    try:
+        for sql, params in queries:
+            start = time.perf_counter()
+            cursor = conn.execute(sql, params); rows = cursor.fetchall()
+            results.append(([description[0] for description in cursor.description], rows, time.perf_counter() - start))
+    finally:
+        conn.execute("COMMIT")
+        conn.set_progress_handler(None, 0)
+    return results
+
+class ReportExecutor:
+    """Process pool for report queries, with a concurrency cap, timeouts and memoized results.
+
+    Results are memoized per report key until PRAGMA data_version changes on a dedicated
+    connection, which happens after any commit to the database by any other connection (the
+    writer thread, other processes); commits therefore never serve stale memoized results.
+    Item and booking ages are computed from SQLite's 'now' and change without a commit (at the
+    time of day of each receipt or booking), so memoized results also expire after cache_max_age_s.
+    """
+
+    def __init__(self, database, max_workers=2, max_concurrent=4, timeout_s=15.0, cache_entries=128, pragmas=(), statement_cache_size=128,
+                 cache_max_age_s=60.0):
+        self.database = os.path.abspath(database)
+        self.max_workers = max_workers
+        self.timeout_s = timeout_s
+        self.cache_entries = cache_entries
+        self.cache_max_age_s = cache_max_age_s
+        self.pragmas = list(pragmas)
+        self.statement_cache_size = statement_cache_size
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        self._results = OrderedDict() # key -> (data_version, expires_at, results)
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'cache_hits': 0, 'timeouts': 0, 'rejected': 0, 'errors': 0, 'running': 0, 'run_time_ms': 0.0}
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: the web process has live threads (writer, pool), which fork would copy mid-state.
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _data_version(self):
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(f"file:{self.database}?mode=ro", uri=True, check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def run(self, key, queries, on_run=None):
+        """Returns [(columns, rows, seconds)] for queries, from the memo if nothing was committed since and it has not expired.
+
+        on_run(results) is called when the queries actually ran (not for memoized results), e.g. to record their timings.
+        """
+        data_version = self._data_version() # Read before running: a commit during the run invalidates the result
+        expires_at = time.monotonic() + self.cache_max_age_s # Counted from before the run, like data_version
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] == data_version and time.monotonic() < cached[1]:
+                self._results.move_to_end(key); self._stats['cache_hits'] += 1
+                return cached[2]
+        if not self._slots.acquire(timeout=self.timeout_s):
+            with self._lock: self._stats['rejected'] += 1
+            raise ReportBusyError(f"Too many reports running (limit {self.max_concurrent}); try again shortly.")
+        start = time.perf_counter()
+        with self._lock: self._stats['running'] += 1
+        try:
+            future = self._get_executor().submit(run_report_queries, self.database, self.pragmas, queries, self.timeout_s, self.statement_cache_size)
+            try:
+                results = future.result(timeout=self.timeout_s + 5) # Grace for process start-up; the worker enforces timeout_s itself
+            except FutureTimeoutError:
+                future.cancel()
+                with self._lock: self._stats['timeouts'] += 1
+                raise ReportTimeoutError(f"Report did not finish within {self.timeout_s}s.")
+            except sqlite3.OperationalError as e:
+                if 'interrupted' not in str(e): raise
+                with self._lock: self._stats['timeouts'] += 1
+                raise ReportTimeoutError(f"Report did not finish within {self.timeout_s}s.")
+            except BrokenProcessPool as e:
+                with self._executor_lock: self._executor = None # Start a fresh pool next time
+                raise ReportError(f"Report worker crashed: {e}")
+        except ReportError:
+            raise
+        except Exception:
+            with self._lock: self._stats['errors'] += 1
+            raise
+        finally:
+            self._slots.release()
+            with self._lock: self._stats['running'] -= 1
+        with self._lock:
+            self._stats['runs'] += 1; self._stats['run_time_ms'] += (time.perf_counter() - start) * 1000
+            self._results[key] = (data_version, expires_at, results)
+            while len(self._results) > self.cache_entries: self._results.popitem(last=False)
+        if on_run is not None: on_run(results)
+        return results
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None: self._executor.shutdown(wait=False, cancel_futures=True); self._executor = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_reports'] = len(self._results)
+        stats.update({'max_workers': self.max_workers, 'max_concurrent': self.max_concurrent, 'timeout_s': self.timeout_s,
+                      'cache_max_age_s': self.cache_max_age_s})
+        stats['avg_run_time_ms'] = round(stats['run_time_ms'] / stats['runs'], 3) if stats['runs'] else None
+        stats['run_time_ms'] = round(stats['run_time_ms'], 3)
+        return stats
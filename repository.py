@@ -0,0 +1,342 @@
+# repository.py - Every SQL statement the app runs, as named parameterized text, and lean tuple-backed row records
+from functools import lru_cache
+from operator import itemgetter
+
+# sqlite3 keeps this many prepared statements per connection (its default is 128). The app has about 50
+# named statements; the rest is headroom for the filter/page variants of the list views, so combining
+# filters does not evict the statements every request runs.
+STATEMENT_CACHE_SIZE = 256
+QUERY_VARIANT_CACHE_SIZE = 1024 # Composed statement texts kept by the lru_caches below
+
+# --- Row Records ---
+class Record(tuple):
+    """A row as a plain tuple of its values that also answers row['column'] and row.column.
+
+    The column names live on a class shared by all rows of the same column list (record_type),
+    so a row costs one tuple and no per-row dict or description reference. dict(row) gives the
+    column dict, e.g. for JSON.
+    """
+    __slots__ = ()
+    _fields = ()
+    _positions = {}
+    _make = classmethod(tuple.__new__) # _make(values) -> record, without a Python-level __init__
+
+    def __getitem__(self, key):
+        if key.__class__ is str: key = self._positions[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._fields
+
+    def __repr__(self):
+        return f"Record({', '.join(f'{name}={value!r}' for name, value in zip(self._fields, self))})"
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def record_type(fields):
+    """Returns the Record subclass for a tuple of column names; the first of duplicate names wins, as with sqlite3.Row."""
+    positions = {}
+    for position, name in enumerate(fields): positions.setdefault(name, position)
+    namespace = {'__slots__': (), '_fields': fields, '_positions': positions}
+    namespace.update((name, property(itemgetter(position))) for name, position in positions.items()
+                     if name.isidentifier() and not hasattr(Record, name)) # Jinja's row.column; row['column'] covers the rest
+    return type('Record', (Record,), namespace)
+
+def column_names(cursor):
+    return tuple(description[0] for description in cursor.description)
+
+def to_records(fields, rows):
+    """Wraps plain row tuples (e.g. from a report worker) in the Record type of fields."""
+    return list(map(record_type(tuple(fields))._make, rows))
+
+def fetch_all(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    return list(map(record_type(column_names(cursor))._make, rows))
+
+def fetch_one(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    return None if row is None else record_type(column_names(cursor))._make(row)
+
+def fetch_dicts(cursor, sql, params=()):
+    """Column dicts straight from the row tuples, for responses serialized to JSON."""
+    cursor.execute(sql, params)
+    rows = cursor.fetchall(); fields = column_names(cursor)
+    return [dict(zip(fields, row)) for row in rows]
+
+# --- Statement Variants ---
+# Dynamic statements are composed from the named fragments below. Each distinct variant is built once
+# and then handed out as the same string object, so a request allocates no SQL text and sqlite3 finds
+# the prepared statement in its cache.
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def with_conditions(sql, conditions, suffix=''):
+    """sql (ending in a WHERE clause) AND-ed with the conditions tuple, followed by suffix."""
+    return sql + ''.join(f" AND {condition}" for condition in conditions) + suffix
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def age_range_conditions(date_column, has_min_age, has_max_age):
+    """Conditions bounding date_column from above (minimum age) and below (maximum age), in that parameter order."""
+    return ((f"{date_column} <= ?",) if has_min_age else ()) + ((f"{date_column} > ?",) if has_max_age else ())
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def part_types_search_sql(columns, use_fts, table_alias='pt'):
+    if use_fts: return f"{table_alias}.id IN (SELECT rowid FROM part_types_fts WHERE part_types_fts MATCH ?)"
+    return "(" + " OR ".join(f"LOWER(IFNULL({table_alias}.{col},'')) LIKE LOWER(?)" for col in columns) + ")"
+
+def part_types_search_condition(search_term, columns, table_alias='pt'):
+    """Builds a (condition, params) pair matching part types whose columns (a tuple) contain search_term.
+
+    Terms of 3+ characters are answered by the trigram index part_types_fts (schema v11); shorter
+    terms cannot form a trigram and fall back to the equivalent case-insensitive LIKE.
+    """
+    if len(search_term) >= 3:
+        match_expr = "{" + " ".join(columns) + "} : \"" + search_term.replace('"', '""') + "\""
+        return part_types_search_sql(columns, True, table_alias), [match_expr]
+    return part_types_search_sql(columns, False, table_alias), [f"%{search_term}%"] * len(columns)
+
+# --- Keyset Pagination ---
+# A sort key is (sql_expression, 'ASC'|'DESC', row_column); sort keys are tuples so variants can be cached.
+# The last key must make the order unique. NULLs sort first in ascending order (SQLite default), which
+# keyset_predicate() mirrors.
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def keyset_predicate(sort_keys, null_values, backwards=False):
+    """Builds (sql, value_positions) selecting rows strictly after a cursor in sort order (before, if backwards).
+
+    null_values tells which cursor values are NULL; the parameters are the cursor values at value_positions.
+    """
+    alternatives = []; positions = []
+    for position, (expr, direction, _col) in enumerate(sort_keys):
+        ascending = (direction == 'ASC') != backwards
+        if null_values[position]: # NULL is the smallest value
+            after_sql, after_positions = (f"{expr} IS NOT NULL", []) if ascending else (None, [])
+        else:
+            after_sql, after_positions = (f"{expr} > ?", [position]) if ascending else (f"({expr} < ? OR {expr} IS NULL)", [position])
+        if after_sql:
+            equal_parts = [f"{prev_expr} IS ?" for prev_expr, _d, _c in sort_keys[:position]]
+            alternatives.append("(" + " AND ".join(equal_parts + [after_sql]) + ")")
+            positions.extend(list(range(position)) + after_positions)
+    if not alternatives: return "0", ()
+    predicate = "(" + " OR ".join(alternatives) + ")"
+    # Redundant bound on the leading key so SQLite can seek its index instead of scanning from the start.
+    # Descending sort keys are NOT NULL columns throughout this app.
+    lead_expr, lead_direction, _col = sort_keys[0]
+    if not null_values[0]:
+        predicate = f"{lead_expr} {'>=' if (lead_direction == 'ASC') != backwards else '<='} ? AND {predicate}"
+        positions.insert(0, 0)
+    return predicate, tuple(positions)
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def keyset_page_sql(sql, sort_keys, null_values=None, backwards=False):
+    """Returns (page_sql, value_positions): sql (ending in a WHERE clause) limited to one page (LIMIT ?) after a cursor.
+
+    null_values None means the first page (no cursor).
+    """
+    page_sql = sql; positions = ()
+    if null_values is not None:
+        predicate, positions = keyset_predicate(sort_keys, null_values, backwards)
+        page_sql += f" AND {predicate}"
+    order_terms = [f"{expr} {('DESC' if direction == 'ASC' else 'ASC') if backwards else direction}" for expr, direction, _col in sort_keys]
+    return page_sql + " ORDER BY " + ", ".join(order_terms) + " LIMIT ?", positions
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def count_sql(sql):
+    return f"SELECT COUNT(*) AS total_rows FROM ({sql})"
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def ordered_sql(sql, sort_keys):
+    return sql + " ORDER BY " + ", ".join(f"{expr} {direction}" for expr, direction, _col in sort_keys)
+
+# --- Schema ---
+SCHEMA_VERSION_SQL = "SELECT version FROM schema_version LIMIT 1"
+SCHEMA_VERSION_TABLE_SQL = "SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'"
+
+# --- Filter Facets ---
+FACET_QUERIES = {
+    'brand': "SELECT DISTINCT brand FROM part_types WHERE brand IS NOT NULL AND brand != '' ORDER BY brand",
+    'model': "SELECT DISTINCT model FROM part_types WHERE model IS NOT NULL AND model != '' ORDER BY model",
+    'part_type': "SELECT DISTINCT part_type FROM part_types WHERE part_type IS NOT NULL AND part_type != '' ORDER BY part_type",
+}
+
+# --- Part Types ---
+PART_TYPE_BY_ID_SQL = "SELECT * FROM part_types WHERE id = ?"
+PART_TYPE_FOR_EDIT_SQL = "SELECT id,part_name,part_number,artikelnummer,part_type,brand,model,cost_price,storage_location,description FROM part_types WHERE id=?"
+PART_TYPE_IDENTIFIERS_SQL = "SELECT part_number,artikelnummer FROM part_types WHERE id=?"
+PART_TYPE_BY_IDENTIFIER_SQL = "SELECT id, part_name FROM part_types WHERE part_number = ? OR artikelnummer = ?"
+# The picker of the receive stock form, its error re-renders included.
+PART_TYPES_FOR_RECEIVING_SQL = "SELECT id,part_name,part_number,artikelnummer,brand,model FROM part_types ORDER BY brand,model,part_name ASC"
+INSERT_PART_TYPE_SQL = "INSERT INTO part_types (part_name,part_number,artikelnummer,part_type,brand,model,cost_price,storage_location,description,created_at) VALUES (?,?,?,?,?,?,?,?,?,CURRENT_TIMESTAMP)"
+UPDATE_PART_TYPE_SQL = "UPDATE part_types SET part_name=?,part_number=?,artikelnummer=?,part_type=?,brand=?,model=?,cost_price=?,storage_location=?,description=? WHERE id=?"
+
+PART_TYPES_OVERVIEW_SQL = "SELECT id,part_name,part_number,artikelnummer,brand,model,part_type FROM part_types WHERE 1=1"
+PART_TYPES_OVERVIEW_SORT_KEYS = (('brand', 'ASC', 'brand'), ('model', 'ASC', 'model'), ('part_name', 'ASC', 'part_name'), ('id', 'ASC', 'id'))
+
+# --- Stock Summary (index) ---
+# oldest_open_receipt_date is maintained by triggers (schema v12); served by idx_ptss_oldest_open.
+OLD_STOCK_ALERT_SQL = "SELECT 1 FROM part_type_stock_summary WHERE oldest_open_receipt_date < ? LIMIT 1;"
+# Per-status counts are kept exact by triggers on inventory_items (schema v9);
+# INDEX_SORT_KEYS matches idx_ptss_sort so no aggregation or sort is needed here.
+INDEX_SUMMARY_SQL = """
+    SELECT
+        pt.id, pt.part_name, pt.part_number, pt.artikelnummer, pt.brand, pt.model, pt.part_type, pt.storage_location,
+        s.total_stock, s.available_stock, s.reserved_stock, s.broken_stock, s.returned_stock
+    FROM part_type_stock_summary s
+    JOIN part_types pt ON pt.id = s.part_type_id
+    WHERE 1=1"""
+INDEX_PART_TYPE_CATEGORY_CONDITION = "pt.part_type = ?"
+# Same order as idx_ptss_sort; part_type_id (the rowid) breaks remaining ties.
+INDEX_SORT_KEYS = (
+    ('s.broken_stock', 'DESC', 'broken_stock'), ('s.available_stock', 'DESC', 'available_stock'),
+    ('s.reserved_stock', 'DESC', 'reserved_stock'), ('s.returned_stock', 'DESC', 'returned_stock'),
+    ('s.total_stock', 'DESC', 'total_stock'), ('s.brand', 'ASC', 'brand'), ('s.model', 'ASC', 'model'),
+    ('s.part_name', 'ASC', 'part_name'), ('s.part_type_id', 'ASC', 'id'),
+)
+
+# --- Inventory Items ---
+# Ages are computed in SQL; these expressions match the old Python strptime/relativedelta results.
+ITEM_DAYS_IN_STOCK_SQL = "COALESCE(CAST(julianday('now','localtime') - julianday(i.date_received) AS INTEGER), 0)"
+ITEMS_SQL = """
+    SELECT i.id AS item_id, i.part_type_id, pt_parent.part_name, pt_parent.brand, pt_parent.model,
+           i.serial_number, i.status AS item_status, i.notes AS item_notes,
+           i.date_received, {days_in_stock} AS days_in_stock, i.last_updated, so.order_number AS stock_order_number, bpu.id AS booking_part_id,
+           b.id AS booking_id, b.customer_name AS booking_customer, b.gpc_number AS booking_gpc_number,
+           pt_parent.storage_location AS default_storage_location
+    FROM inventory_items i
+    LEFT JOIN stock_order_lines sol ON i.stock_order_line_id = sol.id
+    LEFT JOIN stock_orders so ON sol.stock_order_id = so.id
+    LEFT JOIN booking_parts_used bpu ON i.id = bpu.inventory_item_id
+    LEFT JOIN bookings b ON bpu.booking_id = b.id
+    LEFT JOIN part_types pt_parent ON i.part_type_id = pt_parent.id
+    WHERE {part_type_condition}"""
+ALL_ITEMS_SQL = ITEMS_SQL.format(days_in_stock=ITEM_DAYS_IN_STOCK_SQL, part_type_condition="1=1") # Full inventory_items history
+PART_TYPE_ITEMS_SQL = ITEMS_SQL.format(days_in_stock=ITEM_DAYS_IN_STOCK_SQL, part_type_condition="i.part_type_id = ?")
+ITEMS_STOCK_ORDER_CONDITION = "LOWER(IFNULL(so.order_number,'')) LIKE LOWER(?)"
+ITEMS_GPC_CONDITION = "LOWER(IFNULL(b.gpc_number,'')) LIKE LOWER(?)"
+ITEMS_BOOKING_ID_CONDITION = "b.id = ?"
+ITEMS_RECEIVED_ON_CONDITION = "i.date_received >= ? AND i.date_received < date(?, '+1 day')" # Range keeps idx_invitem_parttype_received usable
+# bpu.id only breaks ties for an item that was assigned to more than one booking.
+PART_TYPE_DETAILS_SORT_KEYS = (('i.status', 'ASC', 'item_status'), ('i.id', 'ASC', 'item_id'), ('bpu.id', 'ASC', 'booking_part_id'))
+PART_TYPE_DETAILS_AGE_SORT_KEYS = {
+    'age_asc': (('i.date_received', 'DESC', 'date_received'), ('i.id', 'DESC', 'item_id'), ('bpu.id', 'ASC', 'booking_part_id')),
+    'age_desc': (('i.date_received', 'ASC', 'date_received'), ('i.id', 'ASC', 'item_id'), ('bpu.id', 'ASC', 'booking_part_id')),
+}
+# Without an explicit age sort the item export follows inventory_items rowid order, so rows stream without a sort step.
+ITEMS_EXPORT_SORT_KEYS = (('i.id', 'ASC', 'item_id'), ('bpu.id', 'ASC', 'booking_part_id'))
+
+SET_ITEM_STATUS_SQL = "UPDATE inventory_items SET status = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?"
+RESERVE_ITEM_SQL = "UPDATE inventory_items SET status = 'Reserved', last_updated = CURRENT_TIMESTAMP WHERE id = ? AND status = 'Available'"
+ITEM_STATUS_SQL = "SELECT status FROM inventory_items WHERE id = ?"
+# A single probe of idx_invitem_available_fifo.
+OLDEST_AVAILABLE_ITEM_SQL = """SELECT id FROM inventory_items
+                               WHERE part_type_id = ? AND status = 'Available' ORDER BY date_received, id LIMIT 1"""
+INSERT_BOOKING_PART_SQL = "INSERT INTO booking_parts_used (booking_id, inventory_item_id) VALUES (?, ?)"
+INSTALL_BOOKING_PARTS_SQL = """UPDATE inventory_items SET status = 'Installed', last_updated = CURRENT_TIMESTAMP
+                               WHERE id IN (SELECT inventory_item_id FROM booking_parts_used WHERE booking_id IN (SELECT value FROM json_each(?)))
+                                 AND status != 'Installed'"""
+
+# Batch status changes target explicit ids (one JSON parameter however many are selected) or a filter.
+ITEM_IDS_CONDITION = "id IN (SELECT value FROM json_each(?))"
+ITEM_PART_TYPE_CONDITION = "part_type_id = ?"
+ITEM_STATUS_CONDITION = "status = ?"
+ITEM_STOCK_ORDER_CONDITION = "stock_order_line_id IN (SELECT sol.id FROM stock_order_lines sol JOIN stock_orders so ON sol.stock_order_id = so.id WHERE so.order_number = ?)"
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def batch_item_status_sql(conditions):
+    """Returns (status_counts_sql, update_sql) for the items matching all conditions; update_sql takes (status, *params, status)."""
+    where_sql = " AND ".join(conditions)
+    return (f"SELECT status, COUNT(*) FROM inventory_items WHERE {where_sql} GROUP BY status",
+            f"UPDATE inventory_items SET status = ?, last_updated = CURRENT_TIMESTAMP WHERE {where_sql} AND status != ?")
+
+# --- Stock Orders ---
+INSERT_STOCK_ORDER_SQL = "INSERT INTO stock_orders (order_number,notes,order_date) VALUES (?,?,?)"
+INSERT_STOCK_ORDER_NOW_SQL = "INSERT INTO stock_orders (order_number,notes,order_date) VALUES (?,?,CURRENT_TIMESTAMP)"
+INSERT_STOCK_ORDER_LINE_SQL = "INSERT INTO stock_order_lines (stock_order_id,part_id,quantity_received) VALUES (?,?,?)"
+# All units of a line in one recursive-CTE INSERT ... SELECT; takes (quantity, part_type_id, line_id).
+INSERT_RECEIVED_UNITS_SQL = """
+    INSERT INTO inventory_items (part_type_id,status,stock_order_line_id,date_received,last_updated)
+    WITH RECURSIVE unit(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM unit WHERE n < ?)
+    SELECT ?, 'Available', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM unit
+"""
+
+ORDER_LINES_SQL = """SELECT so.id as order_id,so.order_number,so.order_date,so.notes AS order_notes,sol.id as line_id,sol.quantity_received,sol.cost_price_per_unit,
+               pt.id as part_type_id,pt.part_name,pt.part_number,pt.artikelnummer,pt.brand,pt.model
+               FROM stock_order_lines sol JOIN stock_orders so ON sol.stock_order_id=so.id JOIN part_types pt ON sol.part_id=pt.id WHERE 1=1"""
+ORDER_LINES_SEARCH_COLUMNS = ('artikelnummer', 'part_number', 'part_name', 'brand', 'model')
+ORDERS_OVERVIEW_SORT_KEYS = (('so.order_date', 'DESC', 'order_date'), ('so.id', 'DESC', 'order_id'), ('sol.id', 'ASC', 'line_id'))
+
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def order_lines_search_condition(part_condition):
+    """Order number or notes like the term, or a part matching it; takes (like, like, *part_params)."""
+    return f"(LOWER(IFNULL(so.order_number,'')) LIKE LOWER(?) OR LOWER(IFNULL(so.notes,'')) LIKE LOWER(?) OR {part_condition})"
+
+# --- Stock Aging Report ---
+@lru_cache(maxsize=QUERY_VARIANT_CACHE_SIZE)
+def stock_aging_sql(bucket_count, by_part_type):
+    """Per part type counts of open units in bucket_count receipt-age buckets, newest first.
+
+    Takes the bucket edges (newest to oldest) as: edge 0, then each (newer, older) pair, then the
+    oldest edge; followed by the part type id if by_part_type.
+    """
+    bucket_exprs = ["SUM(r.receipt_date >= ?)"] + ["SUM(r.receipt_date < ? AND r.receipt_date >= ?)"] * (bucket_count - 2) + ["SUM(r.receipt_date < ?)"]
+    return f"""
+        SELECT pt.id, pt.part_name, pt.brand, pt.model, COUNT(*) AS open_units, MIN(r.receipt_date) AS oldest_receipt_date,
+               {', '.join(f'{expr} AS bucket_{n}' for n, expr in enumerate(bucket_exprs))}
+        FROM (
+            SELECT i.part_type_id, COALESCE(so.order_date, i.date_received) AS receipt_date
+            FROM inventory_items i
+            LEFT JOIN stock_order_lines sol ON i.stock_order_line_id = sol.id
+            LEFT JOIN stock_orders so ON sol.stock_order_id = so.id
+            WHERE i.status IN ('Available', 'Reserved') {"AND i.part_type_id = ?" if by_part_type else ""}
+        ) r
+        JOIN part_types pt ON pt.id = r.part_type_id
+        GROUP BY pt.id
+        ORDER BY oldest_receipt_date ASC, pt.brand, pt.model, pt.part_name
+    """
+
+# --- Parts For Device ---
+# grouped: one entry per part type with its available_count from part_type_stock_summary.
+PARTS_FOR_DEVICE_GROUPED_SQL = """
+    SELECT pt.id AS part_type_id, pt.part_name, pt.brand, pt.model,
+           pt.part_number, pt.artikelnummer, s.available_stock AS available_count
+    FROM part_type_stock_summary s
+    JOIN part_types pt ON s.part_type_id = pt.id
+    WHERE s.available_stock > 0"""
+PARTS_FOR_DEVICE_SQL = """
+    SELECT i.id, pt.part_name, pt.brand, pt.model, i.serial_number,
+           pt.part_number, pt.artikelnummer
+    FROM inventory_items i
+    JOIN part_types pt ON i.part_type_id = pt.id
+    WHERE i.status = 'Available'"""
+PARTS_FOR_DEVICE_GROUPED_ORDER_SQL = " ORDER BY pt.brand, pt.model, pt.part_name, pt.id;"
+PARTS_FOR_DEVICE_ORDER_SQL = " ORDER BY pt.brand, pt.model, pt.part_name, i.id;"
+PART_BRAND_CONDITION = "LOWER(pt.brand) = LOWER(?)"
+
+# --- Bookings ---
+BOOKING_MONTHS_IN_SYSTEM_SQL = """COALESCE((CAST(strftime('%Y','now','localtime') AS INTEGER) - CAST(strftime('%Y',b.booking_date) AS INTEGER)) * 12
+    + CAST(strftime('%m','now','localtime') AS INTEGER) - CAST(strftime('%m',b.booking_date) AS INTEGER)
+    - (strftime('%d %H:%M:%S','now','localtime') < strftime('%d %H:%M:%S',b.booking_date)), 0)"""
+BOOKING_LIST_COLUMNS = f"b.id, b.booking_date, b.customer_name, b.device_model, b.device_serial, b.status, b.notes, b.gpc_number, b.zir_reference, b.last_updated, {BOOKING_MONTHS_IN_SYSTEM_SQL} AS months_in_system"
+BOOKINGS_SQL = f"SELECT {BOOKING_LIST_COLUMNS} FROM bookings b WHERE 1=1"
+BOOKINGS_NONE_SQL = f"SELECT {BOOKING_LIST_COLUMNS} FROM bookings b WHERE 0" # Nothing searchable in the term: no rows, same columns
+# Exact booking ID / GPC / ZIR lookups go through the primary key and idx_booking_* indexes; take ([id,] term, term).
+BOOKING_EXACT_CONDITION = "(b.gpc_number = ? OR b.zir_reference = ?)"
+BOOKING_EXACT_WITH_ID_CONDITION = "(b.id = ? OR b.gpc_number = ? OR b.zir_reference = ?)"
+BOOKING_EXACT_MATCH_SQL = f"SELECT 1 FROM bookings b WHERE {BOOKING_EXACT_CONDITION} LIMIT 1"
+BOOKING_EXACT_WITH_ID_MATCH_SQL = f"SELECT 1 FROM bookings b WHERE {BOOKING_EXACT_WITH_ID_CONDITION} LIMIT 1"
+BOOKINGS_EXACT_SQL = f"SELECT {BOOKING_LIST_COLUMNS} FROM bookings b WHERE {BOOKING_EXACT_CONDITION}"
+BOOKINGS_EXACT_WITH_ID_SQL = f"SELECT {BOOKING_LIST_COLUMNS} FROM bookings b WHERE {BOOKING_EXACT_WITH_ID_CONDITION}"
+BOOKINGS_SEARCH_SQL = f"SELECT {BOOKING_LIST_COLUMNS}, bookings_fts.rank AS search_rank FROM bookings_fts JOIN bookings b ON b.id = bookings_fts.rowid WHERE bookings_fts MATCH ?"
+BOOKINGS_SORT_KEYS = (('b.booking_date', 'DESC', 'booking_date'), ('b.id', 'DESC', 'id'))
+BOOKINGS_AGE_SORT_KEYS = {'age_asc': BOOKINGS_SORT_KEYS, 'age_desc': (('b.booking_date', 'ASC', 'booking_date'), ('b.id', 'ASC', 'id'))}
+# Search results are ranked by bm25 first (lower rank = better match).
+BOOKINGS_SEARCH_SORT_KEYS = (('bookings_fts.rank', 'ASC', 'search_rank'),) + BOOKINGS_SORT_KEYS
+
+BOOKING_FOR_EDIT_SQL = "SELECT id, booking_date, customer_name, customer_phone, device_model, device_serial, gpc_number, zir_reference, reported_issue, status, notes FROM bookings WHERE id = ?"
+INSERT_BOOKING_SQL = """INSERT INTO bookings (customer_name, customer_phone, device_model, device_serial, gpc_number, zir_reference, reported_issue, notes, last_updated, booking_date)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"""
+INSERT_BOOKING_DATED_SQL = """INSERT INTO bookings (customer_name, customer_phone, device_model, device_serial, gpc_number, zir_reference, reported_issue, notes, last_updated, booking_date)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)"""
+UPDATE_BOOKING_SQL = "UPDATE bookings SET status = ?, notes = ?, gpc_number = ?, zir_reference = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?"
+BOOKING_STATUS_COUNTS_SQL = "SELECT status, COUNT(*) FROM bookings WHERE id IN (SELECT value FROM json_each(?)) GROUP BY status"
+SET_BOOKINGS_STATUS_SQL = "UPDATE bookings SET status = ?, last_updated = CURRENT_TIMESTAMP WHERE id IN (SELECT value FROM json_each(?)) AND status != ?"
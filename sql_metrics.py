@@ -0,0 +1,296 @@
+# sql_metrics.py - Per-route SQL statement timing, a slow query log and Prometheus text exposition
+import bisect
+import datetime
+import hashlib
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from db_pool import PooledConnection
+
+REQUEST_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] # seconds
+QUERIES_PER_REQUEST_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 250, 1000]
+TRANSACTION_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5] # seconds
+NO_ROUTE = '(none)' # Statements run outside a request, e.g. the writer thread's BEGIN/COMMIT
+OVERFLOW_STATEMENT = '(other statements)' # Once max_statements distinct statements are tracked
+STATEMENT_LABEL_MAX = 200 # Longer normalized statements are cut in the label; query_id tells them apart
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Collapses whitespace and replaces literals and placeholder lists, so one statement shape is one key."""
+    sql = _COMMENT.sub(' ', sql)
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(?, ...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+def explain_query_plan(conn, sql, params):
+    """Returns the EXPLAIN QUERY PLAN of sql as indented lines, or [] if it cannot be explained."""
+    if params is None or not _EXPLAINABLE.match(sql): return []
+    try:
+        plan_rows = sqlite3.Connection.cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall() # Plain cursor: not timed itself
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: -1}; lines = []
+    for node_id, parent_id, _notused, detail in plan_rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+class Histogram:
+    """Cumulative-bucket histogram as Prometheus expects it (counts of observations <= each bound)."""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds; self.counts = [0] * (len(bounds) + 1); self.sum = 0.0; self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1; self.sum += value; self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, bucket_count in zip(self.bounds + ['+Inf'], self.counts):
+            running += bucket_count
+            yield bound, running
+
+class RequestMetrics:
+    __slots__ = ('route', 'queries', 'rows', 'sql_seconds', 'transactions')
+
+    def __init__(self, route):
+        self.route = route; self.queries = 0; self.rows = 0; self.sql_seconds = 0.0; self.transactions = 0
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times each statement (its execute plus the fetches that read its rows) and counts the rows returned.
+
+    A statement is recorded when its rows are exhausted, on the next execute, on close() or
+    when the cursor is garbage collected; time spent between fetches (e.g. writing a streamed
+    export) is not counted.
+    """
+    _statement = None
+
+    def _start(self, sql, params, seconds):
+        self._statement = sql; self._params = params; self._seconds = seconds; self._rows = 0
+        self._request = self.connection.metrics.current_request() # The statement belongs to the request that ran it, not the one finishing it
+
+    def _finish(self):
+        if self._statement is None: return
+        sql, self._statement = self._statement, None
+        self.connection.metrics.record_statement(sql, self._seconds, self._rows, self.connection, self._params, self._request)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try: return super().execute(sql, parameters)
+        finally: self._start(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        try: return super().executemany(sql, seq_of_parameters)
+        finally: self._start(sql, None, time.perf_counter() - start) # Parameter sets may be a spent generator: no plan
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._seconds += time.perf_counter() - start
+        if row is None: self._finish()
+        else: self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._seconds += time.perf_counter() - start; self._rows += len(rows)
+        if len(rows) < size: self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._seconds += time.perf_counter() - start; self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._seconds += time.perf_counter() - start; self._finish()
+            raise
+        self._seconds += time.perf_counter() - start; self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try: self._finish() # e.g. a fetchone() lookup whose cursor is simply dropped
+        except Exception: pass
+
+class InstrumentedConnection(PooledConnection):
+    """Pooled connection whose cursors (including those behind execute()) are InstrumentedCursors."""
+    metrics = None # Set on the per-registry subclass, see SQLMetrics.connection_factory
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + '}'
+
+class SQLMetrics:
+    """Collects per-route request latency, statement timings, rows fetched and write transaction durations.
+
+    Statements are attributed to the request running on the current thread; bind() carries that
+    request over to work run on another thread (the group-commit writer). Statements slower
+    than slow_query_ms are printed to stderr with their EXPLAIN QUERY PLAN and kept in a short
+    in-memory log.
+    """
+
+    def __init__(self, enabled=True, slow_query_ms=200, max_statements=500, slow_log_size=50):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self.connection_factory = type('InstrumentedConnection', (InstrumentedConnection,), {'metrics': self})
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._request_latency = {} # (route, method) -> Histogram
+        self._request_status = {} # (route, method, status) -> count
+        self._queries_per_request = {} # route -> Histogram
+        self._route_sql = {} # route -> [rows fetched, SQL seconds]
+        self._transactions = {} # route -> Histogram
+        self._statements = {} # (route, normalized sql) -> [count, seconds, rows, max seconds]
+        self._slow_counts = {} # route -> count
+        self._slow_log = deque(maxlen=slow_log_size)
+
+    def current_request(self):
+        return getattr(self._local, 'request', None)
+
+    def start_request(self, route):
+        if self.enabled: self._local.request = RequestMetrics(route)
+
+    def finish_request(self, method, status, seconds):
+        request_metrics = self.current_request()
+        if request_metrics is None: return
+        self._local.request = None
+        route = request_metrics.route
+        with self._lock:
+            self._request_latency.setdefault((route, method), Histogram(REQUEST_LATENCY_BUCKETS)).observe(seconds)
+            self._request_status[(route, method, status)] = self._request_status.get((route, method, status), 0) + 1
+            self._queries_per_request.setdefault(route, Histogram(QUERIES_PER_REQUEST_BUCKETS)).observe(request_metrics.queries)
+            route_sql = self._route_sql.setdefault(route, [0, 0.0])
+            route_sql[0] += request_metrics.rows; route_sql[1] += request_metrics.sql_seconds
+
+    def bind(self, work):
+        """Wraps work(cursor) so the statements it runs on another thread count towards the current request."""
+        request_metrics = self.current_request()
+        if request_metrics is None: return work
+        def bound_work(cursor):
+            previous = self.current_request(); self._local.request = request_metrics
+            try: return work(cursor)
+            finally: self._local.request = previous
+        return bound_work
+
+    def record_statement(self, sql, seconds, rows, conn=None, params=None, request_metrics=None):
+        """Adds one finished statement of request_metrics (None: outside a request); conn and params explain it if it was slow."""
+        if not self.enabled: return
+        route = request_metrics.route if request_metrics is not None else NO_ROUTE
+        if request_metrics is not None:
+            request_metrics.queries += 1; request_metrics.rows += rows; request_metrics.sql_seconds += seconds
+        statement = normalize_sql(sql)
+        with self._lock:
+            stats = self._statements.get((route, statement))
+            if stats is None:
+                if len(self._statements) >= self.max_statements: statement = OVERFLOW_STATEMENT
+                stats = self._statements.setdefault((route, statement), [0, 0.0, 0, 0.0])
+            stats[0] += 1; stats[1] += seconds; stats[2] += rows; stats[3] = max(stats[3], seconds)
+        if seconds * 1000 >= self.slow_query_ms: self._log_slow_query(route, sql, statement, seconds, rows, conn, params)
+
+    def _log_slow_query(self, route, sql, statement, seconds, rows, conn, params):
+        plan = explain_query_plan(conn, sql, params) if conn is not None else []
+        print(f"SLOW QUERY: {seconds * 1000:.1f} ms, {rows} row(s), route {route}: {statement}" +
+              ''.join(f"\n    {line}" for line in plan), file=sys.stderr)
+        with self._lock:
+            self._slow_counts[route] = self._slow_counts.get(route, 0) + 1
+            self._slow_log.append({'at': datetime.datetime.now().isoformat(timespec='seconds'), 'route': route,
+                                   'ms': round(seconds * 1000, 3), 'rows': rows, 'statement': statement, 'plan': plan})
+
+    def record_transaction(self, seconds):
+        if not self.enabled: return
+        request_metrics = self.current_request()
+        route = request_metrics.route if request_metrics is not None else NO_ROUTE
+        if request_metrics is not None: request_metrics.transactions += 1
+        with self._lock: self._transactions.setdefault(route, Histogram(TRANSACTION_BUCKETS)).observe(seconds)
+
+    def slow_queries(self):
+        with self._lock: return list(self._slow_log)
+
+    def render_prometheus(self, component_stats=()):
+        """Returns all metrics in the Prometheus text format; component_stats adds (name, stats dict) gauges."""
+        lines = []
+        def histogram(name, help_text, histograms):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+            for label_pairs, hist in sorted(histograms.items()):
+                label_values = dict(label_pairs)
+                for bound, cumulative_count in hist.cumulative():
+                    lines.append(f"{name}_bucket{_labels(**label_values, le=bound)} {cumulative_count}")
+                lines.append(f"{name}_sum{_labels(**label_values)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_labels(**label_values)} {hist.count}")
+        def samples(name, metric_type, help_text, values):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"])
+            lines.extend(f"{name}{_labels(**label_values)} {value}" for label_values, value in values)
+        with self._lock:
+            histogram('inventory_http_request_duration_seconds', "Request latency per route.",
+                      {(('route', route), ('method', method)): hist for (route, method), hist in self._request_latency.items()})
+            samples('inventory_http_requests_total', 'counter', "Requests per route, method and status.",
+                    [(dict(route=route, method=method, status=status), count) for (route, method, status), count in sorted(self._request_status.items())])
+            histogram('inventory_sql_queries_per_request', "SQL statements run by one request.",
+                      {(('route', route),): hist for route, hist in self._queries_per_request.items()})
+            samples('inventory_sql_rows_fetched_total', 'counter', "Rows returned by SQL statements, per route.",
+                    [(dict(route=route), rows) for route, (rows, _seconds) in sorted(self._route_sql.items())])
+            samples('inventory_sql_time_seconds_total', 'counter', "Time spent in SQL statements, per route.",
+                    [(dict(route=route), f"{seconds:.6f}") for route, (_rows, seconds) in sorted(self._route_sql.items())])
+            histogram('inventory_sql_transaction_duration_seconds', "Write transaction duration (queue wait included), per route.",
+                      {(('route', route),): hist for route, hist in self._transactions.items()})
+            statements = sorted(self._statements.items())
+            statement_labels = {key: dict(route=key[0], query_id=hashlib.sha1(key[1].encode()).hexdigest()[:12],
+                                          statement=key[1][:STATEMENT_LABEL_MAX]) for key, _stats in statements}
+            samples('inventory_sql_statements_total', 'counter', "Executions per route and normalized statement.",
+                    [(statement_labels[key], stats[0]) for key, stats in statements])
+            samples('inventory_sql_statement_seconds_total', 'counter', "Time per route and normalized statement (execute and fetches).",
+                    [(statement_labels[key], f"{stats[1]:.6f}") for key, stats in statements])
+            samples('inventory_sql_statement_rows_total', 'counter', "Rows returned per route and normalized statement.",
+                    [(statement_labels[key], stats[2]) for key, stats in statements])
+            samples('inventory_sql_statement_max_seconds', 'gauge', "Slowest single execution per route and normalized statement.",
+                    [(statement_labels[key], f"{stats[3]:.6f}") for key, stats in statements])
+            samples('inventory_sql_slow_queries_total', 'counter', f"Statements slower than {self.slow_query_ms} ms, per route.",
+                    [(dict(route=route), count) for route, count in sorted(self._slow_counts.items())])
+        for component, stats in component_stats:
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool): value = int(value)
+                if not isinstance(value, (int, float)): continue # None before first use, nested histograms
+                name = f"inventory_{component}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+                lines.extend([f"# TYPE {name} gauge", f"{name} {value}"])
+        return '\n'.join(lines) + '\n'
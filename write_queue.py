@@ -0,0 +1,195 @@
+# write_queue.py - Single writer thread that group-commits queued write units
+import sqlite3
+import sys
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64] # Upper bounds for the batch size histogram; larger batches go in '+Inf'
+
+class WriteQueueTimeoutError(sqlite3.OperationalError):
+    """Raised when a submitted write unit was not started within the submit timeout; it was withdrawn and never runs."""
+
+class WriteOutcomeUnknownError(sqlite3.OperationalError):
+    """Raised when the submit timeout ran out while the writer was running the unit: it may still commit."""
+
+def is_busy_error(e):
+    """True for SQLITE_BUSY / SQLITE_LOCKED (incl. extended codes such as SQLITE_BUSY_SNAPSHOT)."""
+    error_code = getattr(e, 'sqlite_errorcode', None)
+    if error_code is not None: return error_code & 0xff in (5, 6)
+    return 'locked' in str(e).lower() or 'busy' in str(e).lower()
+
+class GroupCommitWriter:
+    """Owns the only write connection and applies queued work units on one thread.
+
+    Units that arrive while a transaction is being committed are picked up together and run in
+    one BEGIN IMMEDIATE ... COMMIT (group commit), each under its own SAVEPOINT: a unit that raises
+    is rolled back to its savepoint and gets its exception, the others still commit. Callers block
+    in submit() until the batch holding their unit has committed. A unit is work(cursor) and must
+    only touch the database, because it runs on the writer's connection and thread. connect() must
+    return a connection usable from any thread (check_same_thread=False), for data_version().
+    """
+
+    def __init__(self, connect, max_batch=64, batch_wait_ms=0, submit_timeout=30.0,
+                 retry_attempts=5, retry_base_delay_ms=20, retry_max_delay_ms=1000):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.batch_wait_ms = batch_wait_ms
+        self.submit_timeout = submit_timeout
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_base_delay_ms = retry_base_delay_ms
+        self.retry_max_delay_ms = retry_max_delay_ms
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._conn_lock = threading.Lock() # Held by the writer for a whole batch, and by data_version()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'submitted': 0, 'batches': 0, 'units': 0, 'failed_units': 0, 'failed_batches': 0, 'cancelled_units': 0,
+                       'outcome_unknown_units': 0, 'busy_retries': 0, 'max_batch_size': 0, 'max_queue_depth': 0, 'commit_time_ms': 0.0}
+        self._batch_sizes = {str(bound): 0 for bound in BATCH_SIZE_BUCKETS + ['+Inf']}
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, work):
+        """Queues work(cursor) and returns its result once committed (re-raises its exception).
+
+        On timeout a unit the writer has not started yet is withdrawn (WriteQueueTimeoutError); one it
+        has started cannot be, and its batch may still commit (WriteOutcomeUnknownError).
+        """
+        if threading.current_thread() is self._thread: raise RuntimeError("Write units cannot submit further write units.")
+        self._ensure_started()
+        future = Future()
+        self._queue.put((work, future))
+        with self._stats_lock:
+            self._stats['submitted'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queue.qsize())
+        try:
+            return future.result(timeout=self.submit_timeout)
+        except FutureTimeoutError:
+            if future.cancel(): # The writer skips cancelled units, so this one never runs
+                raise WriteQueueTimeoutError(f"Write not committed within {self.submit_timeout}s.")
+            if future.done(): return future.result() # Resolved just as the wait ran out
+            with self._stats_lock: self._stats['outcome_unknown_units'] += 1
+            raise WriteOutcomeUnknownError(f"Write still running after {self.submit_timeout}s; it may yet be committed.")
+
+    def _connection(self):
+        """The writer's connection, opened on first use; the caller holds _conn_lock."""
+        if self._conn is None:
+            self._conn = self.connect()
+            self._conn.isolation_level = None # Transactions and savepoints are issued explicitly
+        return self._conn
+
+    def data_version(self, timeout=0.05):
+        """PRAGMA data_version of the writer's connection, or None if a batch kept it busy for timeout seconds.
+
+        The writer's own commits do not change it, so it only moves when a connection outside this
+        queue commits, e.g. another process such as import_from_csv.py.
+        """
+        if not self._conn_lock.acquire(timeout=timeout): return None
+        try: return self._connection().execute("PRAGMA data_version").fetchone()[0]
+        finally: self._conn_lock.release()
+
+    def _next_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _begin(self, conn):
+        for attempt in range(self.retry_attempts):
+            try:
+                conn.execute("BEGIN IMMEDIATE"); return
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == self.retry_attempts - 1: raise
+                with self._stats_lock: self._stats['busy_retries'] += 1
+                delay_ms = min(self.retry_max_delay_ms, self.retry_base_delay_ms * 2 ** attempt)
+                time.sleep(random.uniform(delay_ms / 2, delay_ms) / 1000)
+
+    def _apply_batch(self, conn, batch):
+        """Runs one batch in one transaction; returns [(future, result, exception)] to resolve after COMMIT."""
+        outcomes = []
+        self._begin(conn)
+        cursor = conn.cursor()
+        for work, future in batch:
+            if not future.set_running_or_notify_cancel():
+                with self._stats_lock: self._stats['cancelled_units'] += 1
+                continue
+            cursor.execute("SAVEPOINT write_unit")
+            try:
+                result = work(cursor)
+                cursor.execute("RELEASE write_unit")
+                outcomes.append((future, result, None))
+            except Exception as e:
+                cursor.execute("ROLLBACK TO write_unit"); cursor.execute("RELEASE write_unit")
+                outcomes.append((future, None, e))
+        commit_start = time.perf_counter()
+        conn.execute("COMMIT")
+        with self._stats_lock: self._stats['commit_time_ms'] += (time.perf_counter() - commit_start) * 1000
+        return outcomes
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            batch = self._next_batch(item)
+            stop_requested = any(entry is None for entry in batch)
+            batch = [entry for entry in batch if entry is not None]
+            with self._conn_lock:
+                try:
+                    outcomes = self._apply_batch(self._connection(), batch)
+                except Exception as e: # BEGIN or COMMIT failed: nothing in this batch was committed
+                    print(f"WRITE QUEUE: batch of {len(batch)} failed: {e}", file=sys.stderr)
+                    try:
+                        if self._conn is not None and self._conn.in_transaction: self._conn.execute("ROLLBACK")
+                    except sqlite3.Error: pass
+                    outcomes = [(future, None, e) for _, future in batch if future.running() or future.set_running_or_notify_cancel()]
+                    with self._stats_lock: self._stats['failed_batches'] += 1
+                    if isinstance(e, sqlite3.Error) and not is_busy_error(e) and self._conn is not None:
+                        try: self._conn.close()
+                        except sqlite3.Error: pass
+                        self._conn = None # Reopened for the next batch
+            with self._stats_lock:
+                self._stats['batches'] += 1; self._stats['units'] += len(batch)
+                self._stats['failed_units'] += sum(1 for _, _, error in outcomes if error is not None)
+                self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+                self._batch_sizes[str(next((bound for bound in BATCH_SIZE_BUCKETS if len(batch) <= bound), '+Inf'))] += 1
+            for future, result, error in outcomes:
+                if error is not None: future.set_exception(error)
+                else: future.set_result(result)
+            if stop_requested: break
+        self._close_connection()
+
+    def _close_connection(self):
+        with self._conn_lock:
+            if self._conn is not None: self._conn.close(); self._conn = None
+
+    def stop(self, timeout=5.0):
+        """Lets the writer finish what is queued, then closes its connection."""
+        with self._start_lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None); thread.join(timeout)
+        else:
+            self._close_connection() # Opened by data_version() before any write was submitted
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['batch_size_histogram'] = dict(self._batch_sizes)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch_size'] = round(stats['units'] / stats['batches'], 3) if stats['batches'] else None
+        stats['commit_time_ms'] = round(stats['commit_time_ms'], 3)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats